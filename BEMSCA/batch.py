@@ -0,0 +1,437 @@
+import argparse
+import concurrent.futures
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+import numpy.random as nprand
+import bioprocess
+import export
+import instrumentation
+import sweep
+import utils
+import warehouse
+
+# Heavy modules only loaded when a graph is first rendered (see "utils.lazy_import")
+outputs = utils.lazy_import("outputs")
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+BATCH_DIRECTORY = "results/batch"
+
+# Exit codes of headless batch runs
+EXIT_SUCCESS = 0
+EXIT_FAILED_JOBS = 1 # at least one job failed while running
+EXIT_INVALID_JOBS = 2 # job file or arguments are invalid (no job was run)
+EXIT_INTERRUPTED = 130
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for validating jobs against the database data before any simulation starts, returns a list of errors
+def validate_jobs(db_data, jobs):
+    errors = []
+    bio_params_names = db_data["Bioprocess Parameters"].index.tolist()
+
+    for i, job in enumerate(jobs):
+        location = f'Job {i+1} ({job.get("command")})'
+
+        if job.get("command") == "simulate":
+            if job.get("bioprocess parameters") not in bio_params_names:
+                errors.append(f'{location}: unknown bioprocess parameters "{job.get("bioprocess parameters")}"')
+
+        elif job.get("command") == "compare":
+            selection = job.get("bioprocess parameters", [])
+            for sets in selection:
+                if sets not in bio_params_names:
+                    errors.append(f'{location}: unknown bioprocess parameters "{sets}"')
+            if len(selection) < 2:
+                errors.append(f'{location}: at least two sets of bioprocess parameters must be compared')
+            if job.get("base case") not in selection:
+                errors.append(f'{location}: base case must be one of the compared bioprocess parameters')
+            if job.get("color palette") not in db_data["Color Palettes"].index:
+                errors.append(f'{location}: unknown color palette "{job.get("color palette")}"')
+            if len(job.get("labels", [])) != len(selection):
+                errors.append(f'{location}: one label must be defined for each set of bioprocess parameters')
+            if "study name" not in job:
+                errors.append(f'{location}: study name must be defined')
+
+        elif job.get("command") == "sweep":
+            if not os.path.exists(job.get("sweep file", "")):
+                errors.append(f'{location}: sweep file "{job.get("sweep file")}" does not exist')
+
+        elif job.get("command") == "report":
+            if "sweep" in job:
+                if not sweep.read_sweep_results(job["sweep"]):
+                    errors.append(f'{location}: sweep "{job["sweep"]}" has no completed tasks')
+            else:
+                selection = job.get("bioprocess parameters", [])
+                for sets in selection:
+                    if sets not in bio_params_names:
+                        errors.append(f'{location}: unknown bioprocess parameters "{sets}"')
+                if len(selection) < 2:
+                    errors.append(f'{location}: at least two sets of bioprocess parameters must be compared')
+                if "base case" in job and job["base case"] not in selection:
+                    errors.append(f'{location}: base case must be one of the compared bioprocess parameters')
+                if "labels" in job and len(job["labels"]) != len(selection):
+                    errors.append(f'{location}: one label must be defined for each set of bioprocess parameters')
+            if "study name" not in job:
+                errors.append(f'{location}: study name must be defined')
+
+        else:
+            errors.append(f'{location}: unknown command (must be "simulate", "compare", "sweep" or "report")')
+
+    return errors
+
+
+# Function for simulating a set of bioprocess parameters in a worker process (see "sweep.initialize_worker"). The
+# results are sent back to the parent process with their summary record (see "sweep.summarize_results") as their
+# "summary" attribute and only the arrays needed by the outputs (see "slim_results"). The instrumentation report of the
+# simulation is kept as its "instrumentation" attribute, if the worker is instrumented
+def simulate_task(bio_params_name, seed):
+    instrumentation.reset()
+
+    # Seed worker explicitly (forked workers would otherwise share the same random state), without the variates
+    # cached by previous simulations of the worker
+    nprand.seed(seed)
+    bioprocess.clear_cached_variates()
+    simulation_results = bioprocess.Bioprocess(sweep.worker_data,
+                                               sweep.worker_data["Bioprocess Parameters"].loc[[bio_params_name]])
+
+    if instrumentation.enabled:
+        simulation_results.instrumentation = instrumentation.report()
+
+    simulation_results.summary = sweep.summarize_results(simulation_results, workflows=True)
+    return slim_results(simulation_results)
+
+
+# Function for dropping the fold increase distributions of every search iteration but the last from simulation
+# results, so that sending them to another process only pickles the arrays needed by the outputs (the final fold
+# increase and cell number distributions) rather than tens of MB of distributions at 1e5 simulation runs
+def slim_results(simulation_results):
+    bioreactor_expansion = simulation_results.bioreactor_expansion
+    bioreactor_expansion.fold_increase_pds = bioreactor_expansion.fold_increase_pds[-1:]
+    bioreactor_expansion.monte_carlo = (*bioreactor_expansion.monte_carlo[:2], bioreactor_expansion.fold_increase_pds)
+    return simulation_results
+
+
+# Function for running jobs, writing their structured outputs to a JSON file and returning the exit code.
+# The bioprocess parameters of all simulate and compare jobs are simulated concurrently on a pool of worker
+# processes, while sweep jobs run on their own pools (see "sweep.py"). If instrumentation options are given (see
+# "instrumentation.enable"), every simulation is instrumented and the structured outputs include the report of each
+# simulation along with reports aggregated across all simulations (and sweep tasks) and of the batch run itself.
+# All simulations use the given Monte Carlo engine, planar mode and decision index file, if any (see "bioprocess.
+# ENGINES", "bioprocess.PLANAR_MODE" and "decisionindex.enable")
+def run_jobs(jobs, output_file=None, workers=None, seed=None, graphs=True, quiet=False, dpi=None, formats=None,
+             export_file=None, instrument=None, engine=None, planar_mode=None, decision_index=None):
+    if instrument is not None:
+        instrumentation.enable(**instrument)
+
+    # Load stored database data and validate jobs
+    db_data = utils.get_database_data()
+    errors = validate_jobs(db_data, jobs)
+    if errors:
+        print('\n'.join(errors), file=sys.stderr)
+        return EXIT_INVALID_JOBS
+
+    # Define output file
+    if output_file is None:
+        os.makedirs(BATCH_DIRECTORY, exist_ok=True)
+        output_file = os.path.join(BATCH_DIRECTORY, f'{datetime.datetime.now():%Y%m%d-%H%M%S}.json')
+
+    # Determine all bioprocess parameters to be simulated (each set is simulated only once)
+    selection = []
+    for job in jobs:
+        if job["command"] == "simulate":
+            selection.append(job["bioprocess parameters"])
+        elif job["command"] == "compare" or (job["command"] == "report" and "sweep" not in job):
+            selection += job["bioprocess parameters"]
+    selection = list(dict.fromkeys(selection))
+
+    # Define resolution and file formats of graphs
+    if graphs:
+        outputs.configure_rendering(dpi, formats)
+
+    # Open export file, to which the records of all simulations are streamed as they are completed
+    writer = None
+    if export_file is not None:
+        try:
+            writer = export.RecordWriter(export_file)
+        except (ValueError, ImportError, OSError) as error:
+            print(f'Invalid export file "{export_file}": {error}', file=sys.stderr)
+            return EXIT_INVALID_JOBS
+
+    # Simulate all sets of bioprocess parameters concurrently
+    simulation_results = {}
+    failures = {}
+    simulation_reports = []
+    if selection:
+        with concurrent.futures.ProcessPoolExecutor(workers, initializer=sweep.initialize_worker,
+                                                    initargs=("database.db", instrument, engine, planar_mode,
+                                                              decision_index)) as executor:
+            futures = {executor.submit(simulate_task, sets, None if seed is None else seed + i): sets
+                       for i, sets in enumerate(selection)}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    simulation_results[futures[future]] = future.result()
+                except Exception as error:
+                    failures[futures[future]] = repr(error)
+                    continue
+                if instrument is not None:
+                    simulation_reports.append(future.result().instrumentation)
+                if writer is not None:
+                    writer.write({"Name": futures[future], **future.result().summary})
+
+    # Present outputs of each job (in order) and organize its structured outputs
+    results_warehouse = warehouse.ResultsWarehouse()
+    job_outputs = []
+    for job in jobs:
+        job_output = dict(job)
+        try:
+            if job["command"] in ["simulate", "compare"]:
+                if job["command"] == "simulate":
+                    job_selection = [job["bioprocess parameters"]]
+                else:
+                    job_selection = job["bioprocess parameters"]
+                failed = [sets for sets in job_selection if sets in failures]
+                if failed:
+                    raise RuntimeError('; '.join(f'{sets}: {failures[sets]}' for sets in failed))
+
+                # Graphical (and terminal) outputs, as presented by the interactive commands
+                if graphs:
+                    with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+                        if job["command"] == "simulate":
+                            outputs.simulate_output(db_data, job_selection[0], simulation_results[job_selection[0]])
+                        else:
+                            output_customization = [job_selection.index(job["base case"]), job["study name"],
+                                                    job["color palette"], job["labels"]]
+                            outputs.compare_output(db_data, job_selection,
+                                                   [simulation_results[sets] for sets in job_selection],
+                                                   output_customization)
+
+                job_output["results"] = {}
+                for sets in job_selection:
+                    job_output["results"][sets] = dict(simulation_results[sets].summary)
+                    job_output["results"][sets]["Warehouse Run"] = results_warehouse.store(db_data, sets,
+                                                                                           simulation_results[sets])
+                    if instrument is not None:
+                        job_output["results"][sets]["Instrumentation"] = simulation_results[sets].instrumentation
+
+                # Differences from the base-case (paired if simulated with the common random numbers engine)
+                if job["command"] == "compare":
+                    differences = outputs.paired_differences([simulation_results[sets] for sets in job_selection],
+                                                             job["labels"], job_selection.index(job["base case"]))
+                    job_output["differences"] = {label: {column: float(value) for column, value in row.items()}
+                                                 for label, row in differences.iterrows()}
+
+            elif job["command"] == "report":
+                # Compare sets of bioprocess parameters or all completed tasks of a sweep in a comparison report
+                records = {}
+                if "sweep" not in job:
+                    failed = [sets for sets in job["bioprocess parameters"] if sets in failures]
+                    if failed:
+                        raise RuntimeError('; '.join(f'{sets}: {failures[sets]}' for sets in failed))
+                    records = {sets: simulation_results[sets].summary for sets in job["bioprocess parameters"]}
+
+                with contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext():
+                    job_output["results"] = report_job(job, records)
+
+            elif job["command"] == "sweep":
+                (sweep_name, bio_params_names, axes, sweep_seed, sweep_workers) = sweep.read_sweep_file(job["sweep file"])
+                for record in sweep.run_sweep(sweep_name, bio_params_names, axes, sweep_seed, sweep_workers or workers,
+                                              instrument=instrument, engine=engine, planar_mode=planar_mode,
+                                              decision_index=decision_index):
+                    if "Instrumentation" in record:
+                        simulation_reports.append(record["Instrumentation"])
+                    if not quiet:
+                        print(f'[{record["Name"]}] {record["Overrides"]} -> {record["Overall Cost"]:,.2f} €')
+                    if writer is not None:
+                        writer.write(record)
+                job_output["results"] = {"journal": os.path.join(sweep.SWEEP_DIRECTORY, f'{sweep_name}.jsonl'),
+                                         "completed tasks": len(sweep.read_sweep_results(sweep_name)),
+                                         "failed tasks": len(sweep.read_sweep_results(sweep_name, failed=True))}
+
+            job_output["status"] = "completed"
+
+        except Exception as error:
+            job_output["status"] = "failed"
+            job_output["error"] = repr(error)
+            print(f'Job ({job["command"]}) failed: {error!r}', file=sys.stderr)
+
+        job_outputs.append(job_output)
+
+    results_warehouse.close()
+    if writer is not None:
+        writer.close()
+
+    # Wait for graphs rendered in the background (see "outputs.render")
+    if graphs and selection:
+        outputs.close_renderer()
+
+    # Write structured outputs of all jobs (and instrumentation reports, if instrumented)
+    batch_output = {"jobs": job_outputs}
+    if instrument is not None:
+        batch_output["instrumentation"] = {"Simulations": instrumentation.aggregate(simulation_reports),
+                                           "Batch": instrumentation.report()}
+        instrumentation.disable()
+        if not quiet:
+            print(instrumentation.format_report(batch_output["instrumentation"]["Simulations"]))
+    with open(output_file, 'w') as file:
+        json.dump(batch_output, file, indent=2)
+
+    if not quiet:
+        print(f'Outputs of {len(jobs)} jobs saved to "{output_file}"')
+
+    if any(job_output["status"] == "failed" for job_output in job_outputs):
+        return EXIT_FAILED_JOBS
+    return EXIT_SUCCESS
+
+
+# Function for presenting the comparison report of a report job (see "outputs.compare_report"), from the records of
+# its sets of bioprocess parameters (by name, see "sweep.summarize_results") or of the completed tasks of its sweep,
+# returns the structured results of the job
+def report_job(job, records):
+    if "sweep" in job:
+        records = sweep.read_sweep_results(job["sweep"])
+        labels = [f'{record["Name"]}: ' + ', '.join(f'{axis if isinstance(axis, str) else "/".join(axis)}={value}'
+                                                    for axis, value in record["Overrides"])
+                  for record in records]
+        base_case_index = 0
+    else:
+        records = [records[sets] for sets in job["bioprocess parameters"]]
+        labels = job.get("labels", job["bioprocess parameters"])
+        base_case_index = job["bioprocess parameters"].index(job.get("base case", job["bioprocess parameters"][0]))
+
+    report = outputs.compare_report(records, labels, job["study name"], base_case_index)
+    return {"table": os.path.join(outputs.RESULTS_DIRECTORY, f'Comparison_{job["study name"]}.csv'),
+            "conditions": len(report)}
+
+
+# Function for reading a job file (JSON object with a list of "jobs" and, optionally, the "seed" of the random
+# draws and the number of "workers"). Each job is an object with its "command" ("simulate", "compare" or "sweep")
+# and the same inputs requested by the respective interactive command
+def read_job_file(file_name):
+    with open(file_name) as file:
+        job_file = json.load(file)
+
+    return job_file["jobs"], job_file.get("seed"), job_file.get("workers")
+
+
+# Function for parsing the command line arguments of a headless batch run and running its jobs, returns the exit code
+def main(arguments):
+    parser = argparse.ArgumentParser(prog="main.py", description="Run BEMSCA jobs without the input loop.")
+    parser.add_argument("--output", help="JSON file to which structured outputs are written")
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    parser.add_argument("--seed", type=int, help="seed of the random draws (for reproducible results)")
+    parser.add_argument("--no-graphs", action="store_true", help="do not create graphs (nor terminal outputs)")
+    parser.add_argument("--quiet", action="store_true", help="do not print terminal outputs")
+    parser.add_argument("--dpi", type=int, help="resolution of graphs")
+    parser.add_argument("--export", help="JSON Lines, CSV or Parquet file to which the results of all simulations "
+                                         "are streamed as they are completed")
+    parser.add_argument("--formats", help='comma-separated file formats of graphs ("png", "svg" and/or "pdf")')
+    parser.add_argument("--engine", choices=list(bioprocess.ENGINES), help='Monte Carlo engine of simulations '
+                                                                           '(e.g., "pooled" reads pre-generated draw '
+                                                                           'pools, default: "legacy")')
+    parser.add_argument("--stochastic-planar", action="store_true", help="simulate the cells inoculated by the "
+                                                                         "planar expansion of each run and couple "
+                                                                         "them to the bioreactor expansion")
+    parser.add_argument("--decision-index", help="look up the Monte Carlo decisions of simulations in a decision "
+                                                 "index file (see decisionindex.py), searching them as usual if "
+                                                 "not covered")
+    parser.add_argument("--instrument", action="store_true", help="time the phases of each simulation and count "
+                                                                  "samples, search iterations and cache hits")
+    parser.add_argument("--profile", action="store_true", help="profile function calls of each simulation "
+                                                               "(implies --instrument)")
+    parser.add_argument("--trace-memory", action="store_true", help="trace the peak memory of each simulation "
+                                                                    "(implies --instrument)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the jobs of one or more job files")
+    run_parser.add_argument("job_files", nargs="+")
+
+    simulate_parser = subparsers.add_parser("simulate", help="simulate sets of bioprocess parameters")
+    simulate_parser.add_argument("bioprocess_parameters", nargs="+")
+
+    compare_parser = subparsers.add_parser("compare", help="compare sets of bioprocess parameters")
+    compare_parser.add_argument("bioprocess_parameters", nargs="+")
+    compare_parser.add_argument("--base-case", required=True)
+    compare_parser.add_argument("--study-name", required=True)
+    compare_parser.add_argument("--color-palette", required=True)
+    compare_parser.add_argument("--labels", nargs="+", required=True)
+
+    sweep_parser = subparsers.add_parser("sweep", help="run sweeps described by sweep files")
+    sweep_parser.add_argument("sweep_files", nargs="+")
+
+    report_parser = subparsers.add_parser("report", help="compare any number of sets of bioprocess parameters "
+                                                         "(or the completed tasks of a sweep) in a comparison report")
+    report_parser.add_argument("bioprocess_parameters", nargs="*")
+    report_parser.add_argument("--study-name", required=True)
+    report_parser.add_argument("--sweep", help="name of the sweep whose completed tasks are compared")
+    report_parser.add_argument("--base-case")
+    report_parser.add_argument("--labels", nargs="+")
+
+    try:
+        options = parser.parse_args(arguments)
+    except SystemExit as exit:
+        return EXIT_SUCCESS if exit.code == 0 else EXIT_INVALID_JOBS
+
+    # Check file formats of graphs
+    formats = None
+    if options.formats is not None:
+        formats = options.formats.lower().split(",")
+        if any(file_format not in ["png", "svg", "pdf"] for file_format in formats):
+            print(f'Invalid file formats of graphs: "{options.formats}"', file=sys.stderr)
+            return EXIT_INVALID_JOBS
+
+    # Organize jobs from job files or arguments
+    seed = options.seed
+    workers = options.workers
+    if options.command == "run":
+        jobs = []
+        for job_file in options.job_files:
+            try:
+                (file_jobs, file_seed, file_workers) = read_job_file(job_file)
+            except (OSError, ValueError, KeyError) as error:
+                print(f'Invalid job file "{job_file}": {error!r}', file=sys.stderr)
+                return EXIT_INVALID_JOBS
+            jobs += file_jobs
+            seed = file_seed if seed is None else seed
+            workers = file_workers if workers is None else workers
+    elif options.command == "simulate":
+        jobs = [{"command": "simulate", "bioprocess parameters": sets} for sets in options.bioprocess_parameters]
+    elif options.command == "compare":
+        jobs = [{"command": "compare", "bioprocess parameters": options.bioprocess_parameters,
+                 "base case": options.base_case, "study name": options.study_name,
+                 "color palette": options.color_palette, "labels": options.labels}]
+    elif options.command == "report":
+        job = {"command": "report", "study name": options.study_name}
+        if options.sweep is not None:
+            job["sweep"] = options.sweep
+        else:
+            job["bioprocess parameters"] = options.bioprocess_parameters
+        if options.base_case is not None:
+            job["base case"] = options.base_case
+        if options.labels is not None:
+            job["labels"] = options.labels
+        jobs = [job]
+    else:
+        jobs = [{"command": "sweep", "sweep file": sweep_file} for sweep_file in options.sweep_files]
+
+    # Define instrumentation options (simulations are not instrumented by default)
+    instrument = None
+    if options.instrument or options.profile or options.trace_memory:
+        instrument = {"profile": options.profile, "trace_memory": options.trace_memory}
+
+    try:
+        return run_jobs(jobs, options.output, workers, seed, graphs=not options.no_graphs, quiet=options.quiet,
+                        dpi=options.dpi, formats=formats, export_file=options.export, instrument=instrument,
+                        engine=options.engine,
+                        planar_mode="stochastic" if options.stochastic_planar else None,
+                        decision_index=options.decision_index)
+    except KeyboardInterrupt:
+        return EXIT_INTERRUPTED
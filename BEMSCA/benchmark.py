@@ -0,0 +1,297 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import numpy.random as nprand
+import pandas as pd
+import bioprocess
+import outputs
+import sweep
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+BENCHMARK_DIRECTORY = "results/benchmarks"
+BENCHMARK_RUNS = int(1e4) # Monte Carlo simulation runs used by benchmarks (unless scaling them)
+BENCHMARK_REPEATS = 3
+BENCHMARK_SEED = 0
+
+# Values of each scaling benchmark
+RUNS_SCALING = [int(1e3), int(3e3), int(1e4), int(3e4)]
+TARGET_SCALING = [5e8, 2e9, 1e10] # target cell numbers
+SCENARIO_SCALING = [10, 100, 1000] # number of scenarios
+
+# Relative change of a benchmark's time (between two benchmark files) considered significant (see "compare")
+SIGNIFICANT_CHANGE = 0.1
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for measuring a function, returns its median and minimum time (s) over a number of repeats and the peak
+# memory (MB) allocated by one additional (traced) call, which is not timed as tracing slows it down
+def measure(function, repeats=BENCHMARK_REPEATS):
+    times = []
+    for repeat in range(repeats):
+        nprand.seed(BENCHMARK_SEED)
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    nprand.seed(BENCHMARK_SEED)
+    tracemalloc.start()
+    try:
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+    return {"Time": statistics.median(times), "Min Time": min(times), "Peak Memory": peak_memory}
+
+
+# Function for timing each phase of the simulation of a set of bioprocess parameters (s), by running the parts of
+# a simulated bioprocess again. The cycle search and cap search are told apart by the first progress checkpoint of
+# the cap search (see "bioprocess.report_progress")
+def time_phases(db_data, bio_params):
+    nprand.seed(BENCHMARK_SEED)
+    simulation_results = bioprocess.Bioprocess(db_data, bio_params)
+    planar_expansion = simulation_results.planar_expansion
+    bioreactor_expansion = simulation_results.bioreactor_expansion
+    phases = {}
+
+    # Planar workflow
+    start = time.perf_counter()
+    planar_expansion.determine_planar_workflow()
+    phases["Planar Workflow"] = time.perf_counter() - start
+
+    # Monte Carlo simulation (cycle search followed by cap search)
+    checkpoints = []
+    bioreactor_expansion.progress = lambda event: checkpoints.append((event["Stage"], time.perf_counter()))
+    nprand.seed(BENCHMARK_SEED)
+    start = time.perf_counter()
+    monte_carlo = bioreactor_expansion.simulate_bioreactor_expansion(bio_params)
+    end = time.perf_counter()
+    bioreactor_expansion.progress = None
+    cap_start = next((checkpoint for (stage, checkpoint) in checkpoints if stage == "Fold Increase Cap"), end)
+    phases["Cycle Search"] = cap_start - start
+    phases["Cap Search"] = end - cap_start
+
+    # Bioreactor assignment (deterministic part of the bioreactor workflow)
+    start = time.perf_counter()
+    bioreactor_expansion.determine_bioreactor_workflow(bio_params, monte_carlo)
+    phases["Bioreactor Assignment"] = time.perf_counter() - start
+
+    # Costing (daily costs and costs of both phases)
+    start = time.perf_counter()
+    d_facility_cost = simulation_results.determine_daily_facility_cost(db_data)
+    d_labor_cost = simulation_results.determine_daily_labor_cost(db_data)
+    planar_expansion.determine_planar_expansion_cost(db_data, d_facility_cost, d_labor_cost)
+    bioreactor_expansion.determine_bioreactor_expansion_cost(db_data, d_facility_cost, d_labor_cost)
+    phases["Costing"] = time.perf_counter() - start
+
+    # Rendering of the cost categories graph (in this process, with the current rendering settings)
+    record = sweep.summarize_results(simulation_results)
+    data = {"Categories": ["Consumables", "Reagents", "Facility", "Labor"],
+            "Costs": [record["Consumables Cost"], record["Reagents Cost"], record["Facility Cost"],
+                      record["Labor Cost"]],
+            "Medium Cost": record["Medium Cost"]}
+    outputs.initialize_renderer()
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        outputs.render_graph("Cost Categories", data, os.path.join(directory, "graph"), outputs.DPI,
+                             outputs.FORMATS)
+        phases["Rendering"] = time.perf_counter() - start
+
+    return phases
+
+
+# Function for benchmarking the simulation of each set of bioprocess parameters of the database (presets)
+def benchmark_presets(db_data, repeats):
+    results = {}
+    for bio_params_name in db_data["Bioprocess Parameters"].index:
+        bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]]
+        results[bio_params_name] = measure(lambda: bioprocess.Bioprocess(db_data, bio_params), repeats)
+        results[bio_params_name]["Phases"] = time_phases(db_data, bio_params)
+        print(f'[{bio_params_name}] {results[bio_params_name]["Time"]:.3f} s '
+              f'({results[bio_params_name]["Peak Memory"]:.1f} MB)')
+
+    return results
+
+
+# Function for benchmarking the simulation of a set of bioprocess parameters with different numbers of Monte Carlo
+# simulation runs
+def benchmark_runs_scaling(db_data, bio_params_name, repeats):
+    bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]]
+    default_runs = bioprocess.SIMULATION_RUNS
+    results = {}
+    try:
+        for runs in RUNS_SCALING:
+            bioprocess.SIMULATION_RUNS = runs
+            results[str(runs)] = measure(lambda: bioprocess.Bioprocess(db_data, bio_params), repeats)
+            print(f'[{bio_params_name}] {runs} runs: {results[str(runs)]["Time"]:.3f} s')
+    finally:
+        bioprocess.SIMULATION_RUNS = default_runs
+
+    return results
+
+
+# Function for benchmarking the simulation of a set of bioprocess parameters with different target cell numbers
+def benchmark_target_scaling(db_data, bio_params_name, repeats):
+    results = {}
+    for target in TARGET_SCALING:
+        bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]].copy()
+        bio_params["Target Cell Number"] = target
+        results[f'{target:.0e}'] = measure(lambda: bioprocess.Bioprocess(db_data, bio_params), repeats)
+        print(f'[{bio_params_name}] target {target:.0e} cells: {results[f"{target:.0e}"]["Time"]:.3f} s')
+
+    return results
+
+
+# Function for benchmarking the handling of increasing numbers of scenarios: recomputing the deterministic part of
+# the simulation of each scenario (reusing a Monte Carlo simulation, as done when database values are edited),
+# summarizing their results and building a comparison report (without rendering its graphs)
+def benchmark_scenario_scaling(db_data, bio_params_name, repeats):
+    bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]]
+    nprand.seed(BENCHMARK_SEED)
+    monte_carlo = bioprocess.Bioprocess(db_data, bio_params).bioreactor_expansion.monte_carlo
+
+    results = {}
+    for scenarios in SCENARIO_SCALING:
+        def run_scenarios():
+            records = [sweep.summarize_results(bioprocess.Bioprocess(db_data, bio_params, monte_carlo))
+                       for scenario in range(scenarios)]
+            build_report_table(records)
+        results[str(scenarios)] = measure(run_scenarios, repeats)
+        print(f'[{bio_params_name}] {scenarios} scenarios: {results[str(scenarios)]["Time"]:.3f} s')
+
+    return results
+
+
+# Function for building the table of a comparison report without rendering its graphs (see "outputs.compare_report")
+def build_report_table(records):
+    render = outputs.render
+    outputs.render = lambda *arguments: None
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            results_directory = outputs.RESULTS_DIRECTORY
+            outputs.RESULTS_DIRECTORY = directory
+            try:
+                return outputs.compare_report(records, [str(i) for i in range(len(records))], "Benchmark")
+            finally:
+                outputs.RESULTS_DIRECTORY = results_directory
+    finally:
+        outputs.render = render
+
+
+# Function for describing the environment of a benchmark (so benchmark files of different commits can be compared)
+def describe_environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {"Commit": commit, "Timestamp": datetime.datetime.now().isoformat(), "Platform": platform.platform(),
+            "Processor": platform.processor(), "CPUs": os.cpu_count(), "Python": platform.python_version(),
+            "numpy": np.__version__, "pandas": pd.__version__}
+
+
+# Function for running the benchmark suite, returns its results (saved to a JSON file)
+def run_benchmarks(suites, runs=BENCHMARK_RUNS, repeats=BENCHMARK_REPEATS, bio_params_name="Default",
+                   output_file=None):
+    db_data = utils.get_database_data()
+    default_runs = bioprocess.SIMULATION_RUNS
+    bioprocess.SIMULATION_RUNS = runs
+
+    results = {"Environment": describe_environment(), "Simulation Runs": runs, "Repeats": repeats}
+    try:
+        if "presets" in suites:
+            results["Presets"] = benchmark_presets(db_data, repeats)
+        if "runs" in suites:
+            results["Runs Scaling"] = benchmark_runs_scaling(db_data, bio_params_name, repeats)
+        if "targets" in suites:
+            results["Target Scaling"] = benchmark_target_scaling(db_data, bio_params_name, repeats)
+        if "scenarios" in suites:
+            results["Scenario Scaling"] = benchmark_scenario_scaling(db_data, bio_params_name, repeats)
+    finally:
+        bioprocess.SIMULATION_RUNS = default_runs
+
+    # Peak memory of the whole benchmark process (MB, as reported by the operating system)
+    try:
+        import resource
+        results["Max Resident Memory"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    except ImportError:
+        results["Max Resident Memory"] = None
+
+    # Save results
+    if output_file is None:
+        os.makedirs(BENCHMARK_DIRECTORY, exist_ok=True)
+        output_file = os.path.join(BENCHMARK_DIRECTORY, f'{datetime.datetime.now():%Y%m%d-%H%M%S}'
+                                                        f'_{results["Environment"]["Commit"] or "unknown"}.json')
+    with open(output_file, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'\nBenchmark results saved to "{output_file}"')
+
+    return results
+
+
+# Function for comparing the times of two benchmark files, returns the (benchmark, old time, new time) of each
+# benchmark present in both
+def compare(old_file, new_file):
+    with open(old_file) as file:
+        old_results = json.load(file)
+    with open(new_file) as file:
+        new_results = json.load(file)
+
+    # Auxiliary function for collecting the times of all benchmarks (and phases) of a results file
+    def collect_times(results, prefix=''):
+        times = {}
+        for key, value in results.items():
+            if isinstance(value, dict):
+                if "Time" in value:
+                    times[f'{prefix}{key}'] = value["Time"]
+                times.update(collect_times({k: v for k, v in value.items() if k != "Time"}, f'{prefix}{key} / '))
+            elif prefix.endswith("Phases / ") and isinstance(value, float):
+                times[f'{prefix}{key}'] = value
+        return times
+
+    old_times = collect_times(old_results)
+    new_times = collect_times(new_results)
+    return [(benchmark, old_times[benchmark], new_times[benchmark]) for benchmark in old_times
+            if benchmark in new_times]
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Run benchmark suite, e.g.: python3 benchmark.py --runs 10000 presets runs
+# or compare two benchmark files, e.g.: python3 benchmark.py --compare old.json new.json
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="benchmark.py", description="Benchmark BEMSCA's simulations and outputs.")
+    parser.add_argument("suites", nargs="*", default=["presets", "runs", "targets", "scenarios"],
+                        help='benchmarks to run ("presets", "runs", "targets" and/or "scenarios", default: all)')
+    parser.add_argument("--runs", type=int, default=BENCHMARK_RUNS, help="Monte Carlo simulation runs")
+    parser.add_argument("--repeats", type=int, default=BENCHMARK_REPEATS, help="timed repeats of each benchmark")
+    parser.add_argument("--bioprocess-parameters", default="Default", help="bioprocess parameters of scaling benchmarks")
+    parser.add_argument("--output", help="JSON file to which results are saved")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two benchmark files")
+    options = parser.parse_args()
+
+    if options.compare:
+        for (benchmark, old_time, new_time) in compare(*options.compare):
+            change = new_time / old_time - 1 if old_time > 0 else 0
+            flag = '  <--' if abs(change) >= SIGNIFICANT_CHANGE else ''
+            print(f'{benchmark:<60} {old_time:>10.4f} s {new_time:>10.4f} s {change:>+8.1%}{flag}')
+        sys.exit(0)
+
+    run_benchmarks(options.suites, options.runs, options.repeats, options.bioprocess_parameters, options.output)
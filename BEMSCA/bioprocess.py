@@ -2,20 +2,40 @@ import math
 import numpy as np
 import numpy.random as nprand
 import pandas as pd
+import instrumentation
 import utils
 
+# Modules only loaded when they are first used (see "utils.lazy_import")
+drawpools = utils.lazy_import("drawpools")
+replicates = utils.lazy_import("replicates")
+
 
 # -----------------------------------------------------------------------------
 #    GLOBAL CONSTANTS
 # -----------------------------------------------------------------------------
+CACHED_VARIATES = 32 # cycle fold increase variates of the most recent Expansion and Recovery Simulations kept in cache
+COMMON_RANDOM_SEED = 0 # seed of the standardized variates shared by all simulations of the common Monte Carlo engine
+DECISION_INDEX = None # index of precomputed Monte Carlo decisions looked up by simulations (see "decisionindex.enable")
+ENGINE = "legacy" # Monte Carlo engine used to simulate bioreactor expansions (see "ENGINES")
 INI_QC_CELLS = 4e6 # number of cells used for initial quality control
 INT_FC_ANTIBODIES = ["OCT4", "SOX2"]
 INT_IMMUNO_ANTIBODIES = ["OCT4", "SOX2"]
+PLANAR_MODE = "deterministic" # "stochastic" simulates the cells obtained by the planar workflow (see "PlanarExpansion")
+PLANAR_SIMULATION_DRAWS = int(1e7) # confluency draws of each chunk of runs of the stochastic planar expansion
 ROCKI = "Y_27632"
+SIMULATION_RUNS = int(1e5) # Monte Carlo simulation runs of each distribution (can be lowered, e.g. for benchmarks)
 SUR_FC_ANTIBODIES = ["TRA-1-60-PE", "SSEA-4-PE"]
 SUR_IMMUNO_ANTIBODIES = ["TRA-1-60", "SSEA-4"]
 YEAR_TO_DAYS = 365.25 # days
 
+# Fold increase variates of each cycle (rows) and simulation run (columns) of Expansion and Recovery Simulations,
+# drawn once by the cached, common and empirical Monte Carlo engines (see "BioreactorExpansion.
+# sample_cached_fold_increases")
+cycle_fold_increases = {}
+
+# Standard normal and uniform variates of each cycle, shared by all simulations of the common Monte Carlo engine
+common_variates = {}
+
 
 # -----------------------------------------------------------------------------
 #    CLASSES
@@ -52,14 +72,23 @@ class PlanarExpansion():
         self.inoc_cells = self.seeding_density * self.min_bioreactor_volume
 
         # Determine optimal planar expansion workflow
-        self.planar_workflow = self.determine_planar_workflow()
+        with instrumentation.span("Planar Workflow"):
+            self.planar_workflow = self.determine_planar_workflow()
 
         # Determine total surfaces and duration of optimal workflow
         self.total_surfaces = sum(self.planar_workflow)
         self.duration = len(self.planar_workflow) * self.PASS_DURATION
 
+        # Simulate distribution of cells inoculated into the first bioreactor (stochastic planar mode only, the
+        # workflow otherwise guarantees the inoculation cells)
+        self.inoc_cells_pd = None
+        if PLANAR_MODE == "stochastic":
+            with instrumentation.span("Planar Simulation"):
+                self.inoc_cells_pd = self.simulate_planar_expansion()
+
         # Determine planar expansion cost
-        self.determine_planar_expansion_cost(db_data, d_facility_cost, d_labor_cost)
+        with instrumentation.span("Planar Expansion Cost"):
+            self.determine_planar_expansion_cost(db_data, d_facility_cost, d_labor_cost)
 
 
     # Function for determining the optimal planar expansion workflow
@@ -96,7 +125,36 @@ class PlanarExpansion():
         planar_workflow.insert(0, 1)
 
         return planar_workflow
-    
+
+
+    # Function for simulating the cells obtained by the planar workflow in each simulation run (stochastic planar
+    # mode), returns the distribution of cells inoculated into the first bioreactor. The confluency of every surface
+    # of every passage is sampled from its normal distribution, for all runs of a chunk at once. A passage whose
+    # surfaces yield less cells than expected (mean confluency) seeds the next passage with proportionally less
+    # cells, which then reach a proportionally lower confluency (surplus cells are not used). Cells for the initial
+    # quality control are taken before inoculation, which uses at most the cells required by the bioreactor
+    def simulate_planar_expansion(self, runs=None):
+        runs = SIMULATION_RUNS if runs is None else runs
+        surface_confluency = self.planar_platform_data["Surface Confluency"].item()
+        confluency_std = self.planar_platform_data["Confluency STD"].item()
+
+        inoc_cells_pd = np.empty(runs)
+        chunk_runs = max(PLANAR_SIMULATION_DRAWS // max(self.planar_workflow), 1)
+        for start in range(0, runs, chunk_runs):
+            chunk = min(chunk_runs, runs - start)
+
+            # Relative seeding of each run (1 if the previous passage yielded at least the expected cells)
+            seeding = np.ones(chunk)
+            for surfaces in self.planar_workflow:
+                confluencies = np.clip(nprand.normal(surface_confluency, confluency_std, (chunk, surfaces)), 0, None)
+                harvested_cells = seeding * confluencies.sum(axis=1)
+                seeding = np.minimum(harvested_cells / (surfaces * surface_confluency), 1)
+
+            inoc_cells_pd[start:start+chunk] = np.clip(harvested_cells - INI_QC_CELLS, 0, self.inoc_cells)
+
+        instrumentation.count("Planar Confluency Samples", runs * self.total_surfaces)
+        return inoc_cells_pd
+
 
     # Function for determining planar expansion cost
     def determine_planar_expansion_cost(self, db_data, d_facility_cost, d_labor_cost):
@@ -149,15 +207,50 @@ class PlanarExpansion():
 # Define class for simulation of bioreactor expansion
 class BioreactorExpansion():
     # Initializer of class object
-    def __init__(self, db_data, bio_params, d_facility_cost, d_labor_cost):
+    def __init__(self, db_data, bio_params, d_facility_cost, d_labor_cost, monte_carlo=None, progress=None,
+                 inoc_cells_pd=None, hint=None, engine=None, strict=False):
         # <>---------------- Class Constants ----------------<>        
         self.DISS_ENZ_VOL_RATIO = 0.2
         self.DECREASE_RATIO = 0.99
         self.FIN_QUAL_DURATION = 3 # days
         self.MIN_FINAL_VOLUME = 1.8 # L
-        self.SIMULATION_RUNS = int(1e5)
+        self.SIMULATION_RUNS = SIMULATION_RUNS
+        self.PROGRESS_RUNS = int(1e4) # simulation runs between progress checkpoints
 
         # <>---------- Important Object Attributes ----------<>
+        # Function called at each progress checkpoint of the Monte Carlo simulation, if any (see "report_progress")
+        self.progress = progress
+
+        # Streams of fold expansion and recovery efficiency variates read from draw pools (only used by the pooled
+        # Monte Carlo engine, see "sample_pooled_fold_increases")
+        self.draw_streams = None
+
+        # Ratio between the cells inoculated into the first bioreactor and the required cells (initial cells) in
+        # each simulation run, if a distribution of inoculated cells is given (see "PlanarExpansion.
+        # simulate_planar_expansion"). Fold increases of each run start at its ratio, so runs inoculated with less
+        # cells are less likely to reach the target cell number
+        self.inoculum_ratios = None
+
+        # Previous solution (required cycles, optimal fold increase) of a similar scenario, if any, from which the
+        # Monte Carlo search starts instead of starting from 1 cycle and from the average fold increase (see
+        # "simulate_bioreactor_expansion")
+        self.hint = hint
+
+        # Monte Carlo engine of the simulation (see "ENGINES", the module's ENGINE unless another engine is given)
+        self.engine = engine or ENGINE
+
+        # Whether the Monte Carlo searches are always run, even if a decision index is loaded (see "DECISION_INDEX")
+        self.strict = strict
+
+        # Samplers of the replicate measurements of the fold expansion and recovery efficiency of the Expansion and
+        # Recovery Simulations (only used by the empirical Monte Carlo engine, None for simulations without replicate
+        # measurements, see "sample_empirical_fold_increases")
+        self.replicate_samplers = (None, None)
+        if self.engine == "empirical":
+            self.replicate_samplers = (
+                replicates.get_sampler(db_data, "Fold Expansion", bio_params["Expansion Simulation"].item()),
+                replicates.get_sampler(db_data, "Recovery Efficiency", bio_params["Recovery Simulation"].item()))
+
         self.expansion_simulation = db_data["Expansion Simulations"].loc[bio_params["Expansion Simulation"]]
 
         self.recovery_simulation = db_data["Recovery Simulations"].loc[bio_params["Recovery Simulation"]]
@@ -177,8 +270,12 @@ class BioreactorExpansion():
         # Calculate desired total fold increase
         self.tfi = bio_params["Target Cell Number"].item() / self.initial_cells.item()
 
+        if inoc_cells_pd is not None:
+            self.inoculum_ratios = np.broadcast_to(inoc_cells_pd / self.initial_cells.item(), (self.SIMULATION_RUNS,))
+
         # Determine optimal bioreactor expansion workflow ([0] -> cycle medium volumes, [1] -> required bioreactors)
-        self.bioreactor_workflow = self.determine_bioreactor_workflow(bio_params)
+        # (a previously simulated Monte Carlo can be reused so that only the deterministic part is recomputed)
+        self.bioreactor_workflow = self.determine_bioreactor_workflow(bio_params, monte_carlo)
 
         # Determine bioreactor expansion duration
         self.duration = len(self.bioreactor_workflow[0]) * self.expansion_simulation["Bioreactor Culture Time"].item()
@@ -187,113 +284,30 @@ class BioreactorExpansion():
         self.duration += self.FIN_QUAL_DURATION
 
         # Determine bioreactor expansion cost
-        self.determine_bioreactor_expansion_cost(db_data, d_facility_cost, d_labor_cost)
+        with instrumentation.span("Bioreactor Expansion Cost"):
+            self.determine_bioreactor_expansion_cost(db_data, d_facility_cost, d_labor_cost)
 
 
     # Function for determining the optimal bioreactor expansion workflow
-    def determine_bioreactor_workflow(self, bio_params):
-        # Calculate std of fold expansion and recovery efficiency distributions
-        self.fold_exp_std = utils.sem_to_std(self.expansion_simulation["Fold Expansion SEM"].item(),
-                                                    self.expansion_simulation["Experiment Sample Size"].item())
-        
-        self.recovery_eff_std = utils.sem_to_std(self.recovery_simulation["Recovery Efficiency SEM"].item(),
-                                                        self.recovery_simulation["Experiment Sample Size"].item())
-        
-        # !!! Recovery efficiency std was divided by 3 in order to create a beta distribution that makes sense
-        # (not overly weighted towards 1). This was done after observing that the original paper reports a sem
-        # which is too high when considering the reported average and that the possible values range from 0 to 1. If
-        # other data is used the following line of code should not be replicated:
-        self.recovery_eff_std /= 3    
-        
-        # Calculate alpha and beta parameters of recovery efficiency beta distribution
-        (alpha, beta) = utils.alpha_beta(self.recovery_simulation["Recovery Efficiency AVG"].item(),
-                                                self.recovery_eff_std)
+    def determine_bioreactor_workflow(self, bio_params, monte_carlo=None):
+        # Simulate bioreactor expansion if no previous Monte Carlo results were provided
+        # ([0] -> required cycles, [1] -> optimal fold increase, [2] -> fold increase distributions)
+        if monte_carlo is None:
+            monte_carlo = self.simulate_bioreactor_expansion(bio_params)
+        else:
+            instrumentation.count("Monte Carlo Reuses")
 
-        # Check how many bioreactor expansion cycles are required to obtain the target cell number
-        # while respecting the minimum threshold
-        required_cycles = 1
-        while True:
-            fold_increase_pd = []
-            # Simulate total fold increase for the stipulated number of simulation runs
-            for s in range(0, self.SIMULATION_RUNS):
-                fold_increase = 1
-                for cycle in range(1, required_cycles+1):
-                    # For each cycle draw random samples for fold expansion and recovery efficiency and calculate
-                    # cycle fold increase (fold expansion x recovery efficiency)
-                    fold_exp = nprand.normal(self.expansion_simulation["Fold Expansion AVG"].item(), self.fold_exp_std)
-                    recovery_eff = nprand.beta(alpha, beta)
-                    fold_increase *= fold_exp * recovery_eff
-                
-                fold_increase_pd.append(fold_increase)
-
-            # Create numpy array with distribution of simulated fold increases
-            fold_increase_pd = np.array(fold_increase_pd)
-
-            # End while loop if minimum threshold is respected
-            if np.percentile(fold_increase_pd, (1 - bio_params["Minimum Threshold"]) * 100) >= self.tfi:
-                break
-
-            # Increment number of bioreactor expansion cycles in workflow if minimum threshold is not respected
-            required_cycles += 1
+        # Save Monte Carlo results as object attributes for future reference
+        self.monte_carlo = monte_carlo
+        (required_cycles, optimal_fold_increase, self.fold_increase_pds) = monte_carlo
 
-        # Optimize the volume of medium used in each bioreactor expansion cycle by avoiding the production
-        # of surplus cells (limiting the target fold increase of each cycle), for as long as the minimum
-        # threshold continues to be respected
+        # Determine bioreactors required by each cycle
+        with instrumentation.span("Bioreactor Assignment"):
+            return self.assign_bioreactors(required_cycles, optimal_fold_increase)
 
-        # Consider the initial optimal fold increase to be the average of the fold increase distribution
-        optimal_fold_increase = (self.expansion_simulation["Fold Expansion AVG"].item()
-                                 * self.recovery_simulation["Recovery Efficiency AVG"].item())
-        
-        # Establish a minimum fold increase if a minimum final volume is desired (this is to ensure that
-        # the final expansion cycle takes place in a desired bioreactor type, for example)
-        min_fold_increase = (self.MIN_FINAL_VOLUME /
-                                 self.bioreactors["Min Volume"].min())**(1/(required_cycles-1))
-        
-        self.fold_increase_pds = []
-        while True:
-            fold_increase_pd = []
-            # Simulate total fold increase for the stipulated number of simulation runs
-            for s in range(0, self.SIMULATION_RUNS):
-                fold_increase = 1
-                for cycle in range(1, required_cycles+1):
-                    # For each cycle draw random samples for fold expansion and recovery efficiency and calculate
-                    # cycle fold increase (fold expansion x recovery efficiency)
-                    fold_exp = nprand.normal(self.expansion_simulation["Fold Expansion AVG"].item(), self.fold_exp_std)
-                    recovery_eff = nprand.beta(alpha, beta)
-                    fold_increase *= fold_exp * recovery_eff
-                    
-                    # Limit fold increase of a cycle if it surpasses the established optimal fold increase
-                    # (reduce medium usage of next cycle). This does not apply to the last cycle
-                    if cycle != required_cycles and fold_increase >= optimal_fold_increase**cycle:
-                        fold_increase = optimal_fold_increase**cycle
-                
-                fold_increase_pd.append(fold_increase)
-
-            # Create numpy array with distribution of simulated fold increases
-            fold_increase_pd = np.array(fold_increase_pd)
-
-            # End while loop if minimum threshold is disrespected
-            if np.percentile(fold_increase_pd, (1 - bio_params["Minimum Threshold"]) * 100) < self.tfi:
-                # Undo decrease of optimal fold increase since this has led to disrespecting the minimum threshold
-                optimal_fold_increase *= 1/self.DECREASE_RATIO
-                break
-
-            # Save fold increase probability distribution as an object attribute for future reference
-            self.fold_increase_pds.append(fold_increase_pd)
-
-            # End while loop once minimum fold increase is simulated
-            if optimal_fold_increase == min_fold_increase:
-                break
-
-            # Decrease optimal fold increase by the decrease ratio if minimum threshold is still respected (which means
-            # that medium usage can be reduced even lower)
-            optimal_fold_increase *= self.DECREASE_RATIO
-
-            # Limit optimal fold increase to minimum fold increase
-            if optimal_fold_increase < min_fold_increase:
-                optimal_fold_increase = min_fold_increase
-            
 
+    # Function for assigning bioreactors to each expansion cycle (deterministic part of the bioreactor workflow)
+    def assign_bioreactors(self, required_cycles, optimal_fold_increase):
         # Determine optimal medium volume of each cycle
         cycle_medium_volumes = []
         for cycle in range(1, required_cycles+1):
@@ -322,7 +336,7 @@ class BioreactorExpansion():
             aux_table = aux_table[aux_table["Max Volume"] == aux_table["Max Volume"].min()]
 
             # Save bioreactor required by the current cycle in the respective table
-            required_bioreactors.at[cycle+1, aux_table.index[0]] = aux_table["Max Volume"]
+            required_bioreactors.at[cycle+1, aux_table.index[0]] = aux_table["Max Volume"].item()
 
             # Calculate minimum volume required to use the required bioreactors
             min_volume = self.bioreactors.loc[aux_table.index[0], "Min Volume"].item() * aux_table["Max Volume"].item()
@@ -337,7 +351,326 @@ class BioreactorExpansion():
                     cycle_medium_volumes[index] = cycle_medium_volumes[index-1] * corrected_fold_increase
 
         return cycle_medium_volumes, required_bioreactors
+
+
+    # Function for simulating bioreactor expansion (Monte Carlo search for the required number of cycles and
+    # for the optimal fold increase of each cycle). Fold increase distributions are sampled by the selected Monte
+    # Carlo engine (see "ENGINES"). If a hint is given, both searches start from the hinted solution and search
+    # outward only when needed (the fold increase cap is only hinted if the required cycles match the hint), so
+    # only the hinted solution and its neighbours are simulated when it is still the solution. The solution is
+    # the same as without a hint (the fewest cycles and the lowest cap of the sequence of caps respecting the
+    # minimum threshold), but the accepted fold increase distributions only start at the hinted cap
+    def simulate_bioreactor_expansion(self, bio_params):
+        sample_fold_increases = ENGINES[self.engine]
+
+        # Calculate std of fold expansion and recovery efficiency distributions
+        self.fold_exp_std = utils.sem_to_std(self.expansion_simulation["Fold Expansion SEM"].item(),
+                                                    self.expansion_simulation["Experiment Sample Size"].item())
+        
+        self.recovery_eff_std = utils.sem_to_std(self.recovery_simulation["Recovery Efficiency SEM"].item(),
+                                                        self.recovery_simulation["Experiment Sample Size"].item())
+        
+        # !!! Recovery efficiency std was divided by 3 in order to create a beta distribution that makes sense
+        # (not overly weighted towards 1). This was done after observing that the original paper reports a sem
+        # which is too high when considering the reported average and that the possible values range from 0 to 1. If
+        # other data is used the following line of code should not be replicated:
+        self.recovery_eff_std /= 3    
         
+        # Calculate alpha and beta parameters of recovery efficiency beta distribution
+        (self.recovery_eff_alpha, self.recovery_eff_beta) = utils.alpha_beta(
+            self.recovery_simulation["Recovery Efficiency AVG"].item(), self.recovery_eff_std)
+
+        # Look up the required cycles and optimal fold increase in the decision index, if any, so that only the
+        # distribution of total fold increases of the decision is simulated (unless in strict mode, or if runs are
+        # inoculated with a distribution of cells or drawn from replicate measurements, which the index does not
+        # cover). Queries the index does not cover are searched as usual, and decisions whose simulated distribution
+        # disrespects the minimum threshold are searched from the decision (as from a hint)
+        hint = self.hint
+        if (DECISION_INDEX is not None and not self.strict and self.inoculum_ratios is None
+                and self.replicate_samplers == (None, None)):
+            decision = DECISION_INDEX.lookup(self.expansion_simulation["Fold Expansion AVG"].item(), self.fold_exp_std,
+                                             self.recovery_eff_alpha, self.recovery_eff_beta, self.tfi,
+                                             bio_params["Minimum Threshold"].item(),
+                                             self.bioreactors["Min Volume"].min())
+            if decision is not None:
+                (required_cycles, optimal_fold_increase, _) = decision
+                fold_increase_pd = sample_fold_increases(self, required_cycles, optimal_fold_increase, None)
+                instrumentation.count("Monte Carlo Samples", 2 * self.SIMULATION_RUNS * required_cycles)
+                if np.percentile(fold_increase_pd, (1 - bio_params["Minimum Threshold"]) * 100) >= self.tfi:
+                    instrumentation.count("Decision Index Hits")
+                    return required_cycles, optimal_fold_increase, [fold_increase_pd]
+                instrumentation.count("Decision Index Fallbacks")
+                hint = (required_cycles, optimal_fold_increase)
+            else:
+                instrumentation.count("Decision Index Misses")
+
+        # Check how many bioreactor expansion cycles are required to obtain the target cell number
+        # while respecting the minimum threshold
+        with instrumentation.span("Cycle Search"):
+            required_cycles = 1 if hint is None else max(int(hint[0]), 1)
+            direction = None # 1 once a number of cycles disrespected the threshold, -1 once a hint respected it
+            while True:
+                # Simulate total fold increase for the stipulated number of simulation runs
+                checkpoint = None
+                if self.progress is not None:
+                    checkpoint = lambda s: self.report_progress("Required Cycles", required_cycles, s)
+                fold_increase_pd = sample_fold_increases(self, required_cycles, None, checkpoint)
+                instrumentation.count("Cycle Search Iterations")
+                instrumentation.count("Monte Carlo Samples", 2 * self.SIMULATION_RUNS * required_cycles)
+
+                # End while loop if minimum threshold is respected, unless the search started from a hint (in
+                # which case fewer cycles are checked until the threshold is disrespected)
+                if np.percentile(fold_increase_pd, (1 - bio_params["Minimum Threshold"]) * 100) >= self.tfi:
+                    if direction == 1 or required_cycles == 1:
+                        break
+                    direction = -1
+                    required_cycles -= 1
+                    continue
+
+                # End while loop if a hinted search finds the most cycles disrespecting the threshold
+                if direction == -1:
+                    required_cycles += 1
+                    break
+
+                # Increment number of bioreactor expansion cycles in workflow if minimum threshold is not respected
+                direction = 1
+                required_cycles += 1
+
+        # Optimize the volume of medium used in each bioreactor expansion cycle by avoiding the production
+        # of surplus cells (limiting the target fold increase of each cycle), for as long as the minimum
+        # threshold continues to be respected
+
+        # Consider the initial optimal fold increase to be the average of the fold increase distribution
+        optimal_fold_increase = (self.expansion_simulation["Fold Expansion AVG"].item()
+                                 * self.recovery_simulation["Recovery Efficiency AVG"].item())
+        
+        # Establish a minimum fold increase if a minimum final volume is desired (this is to ensure that
+        # the final expansion cycle takes place in a desired bioreactor type, for example)
+        min_fold_increase = (self.MIN_FINAL_VOLUME /
+                                 self.bioreactors["Min Volume"].min())**(1/(required_cycles-1))
+
+        # Start from the hinted fold increase cap (rounded to the nearest of the sequence of caps), if any
+        max_fold_increase = optimal_fold_increase
+        cap_step = 0
+        if hint is not None and int(hint[0]) == required_cycles and hint[1] < max_fold_increase:
+            cap_step = round(math.log(hint[1] / max_fold_increase) / math.log(self.DECREASE_RATIO))
+            optimal_fold_increase = max(max_fold_increase * self.DECREASE_RATIO**cap_step, min_fold_increase)
+
+        with instrumentation.span("Cap Search"):
+            fold_increase_pds = []
+            accepted_fold_increase = None
+            increasing_cap = False
+            while True:
+                # Simulate total fold increase for the stipulated number of simulation runs, limiting the fold
+                # increase of each cycle to the optimal fold increase
+                checkpoint = None
+                if self.progress is not None:
+                    checkpoint = lambda s: self.report_progress("Fold Increase Cap", required_cycles, s,
+                                                                optimal_fold_increase, min_fold_increase,
+                                                                fold_increase_pds, accepted_fold_increase)
+                fold_increase_pd = sample_fold_increases(self, required_cycles, optimal_fold_increase, checkpoint)
+                instrumentation.count("Cap Search Iterations")
+                instrumentation.count("Monte Carlo Samples", 2 * self.SIMULATION_RUNS * required_cycles)
+
+                # End while loop if minimum threshold is disrespected
+                if np.percentile(fold_increase_pd, (1 - bio_params["Minimum Threshold"]) * 100) < self.tfi:
+                    # Increase the fold increase cap if the hinted cap (or a higher cap) disrespected the threshold
+                    if accepted_fold_increase is None and cap_step > 0:
+                        increasing_cap = True
+                        cap_step -= 1
+                        optimal_fold_increase = max(max_fold_increase * self.DECREASE_RATIO**cap_step,
+                                                    min_fold_increase)
+                        continue
+
+                    # Undo decrease of optimal fold increase since this has led to disrespecting the minimum threshold
+                    optimal_fold_increase *= 1/self.DECREASE_RATIO
+                    break
+
+                # Save fold increase probability distribution as an object attribute for future reference
+                fold_increase_pds.append(fold_increase_pd)
+                accepted_fold_increase = optimal_fold_increase
+
+                # End while loop once minimum fold increase is simulated (or once a higher cap than the hinted cap
+                # respects the threshold, since the cap below it disrespected the threshold)
+                if optimal_fold_increase == min_fold_increase or increasing_cap:
+                    break
+
+                # Decrease optimal fold increase by the decrease ratio if minimum threshold is still respected (which
+                # means that medium usage can be reduced even lower)
+                optimal_fold_increase *= self.DECREASE_RATIO
+
+                # Limit optimal fold increase to minimum fold increase
+                if optimal_fold_increase < min_fold_increase:
+                    optimal_fold_increase = min_fold_increase
+
+        return required_cycles, optimal_fold_increase, fold_increase_pds
+
+
+    # Function for sampling the distribution of total fold increases of a number of cycles, one simulation run at a
+    # time (legacy Monte Carlo engine). If an optimal fold increase is given, the fold increase of each cycle but the
+    # last is limited to it. The checkpoint function, if any, is called with the number of completed runs at every
+    # progress checkpoint
+    def sample_fold_increases(self, required_cycles, optimal_fold_increase=None, checkpoint=None):
+        fold_increase_pd = []
+        for s in range(0, self.SIMULATION_RUNS):
+            if checkpoint is not None and s % self.PROGRESS_RUNS == 0:
+                checkpoint(s)
+
+            fold_increase = 1 if self.inoculum_ratios is None else self.inoculum_ratios[s]
+            for cycle in range(1, required_cycles+1):
+                # For each cycle draw random samples for fold expansion and recovery efficiency and calculate
+                # cycle fold increase (fold expansion x recovery efficiency)
+                fold_exp = nprand.normal(self.expansion_simulation["Fold Expansion AVG"].item(), self.fold_exp_std)
+                recovery_eff = nprand.beta(self.recovery_eff_alpha, self.recovery_eff_beta)
+                fold_increase *= fold_exp * recovery_eff
+
+                # Limit fold increase of a cycle if it surpasses the established optimal fold increase
+                # (reduce medium usage of next cycle). This does not apply to the last cycle
+                if (optimal_fold_increase is not None and cycle != required_cycles
+                        and fold_increase >= optimal_fold_increase**cycle):
+                    fold_increase = optimal_fold_increase**cycle
+
+            fold_increase_pd.append(fold_increase)
+
+        # Create numpy array with distribution of simulated fold increases
+        return np.array(fold_increase_pd)
+
+
+    # Function for sampling the distribution of total fold increases of a number of cycles from pre-generated draw
+    # pools (pooled Monte Carlo engine, see "drawpools.py"). Same as "sample_fold_increases", but the variates of each
+    # chunk of runs are read from memory-mapped pools and combined as arrays, so no variates are generated once the
+    # pools of the Expansion and Recovery Simulations exist
+    def sample_pooled_fold_increases(self, required_cycles, optimal_fold_increase=None, checkpoint=None):
+        if self.draw_streams is None:
+            self.draw_streams = (drawpools.DrawStream("normal", (self.expansion_simulation["Fold Expansion AVG"].item(),
+                                                                 self.fold_exp_std)),
+                                 drawpools.DrawStream("beta", (self.recovery_eff_alpha, self.recovery_eff_beta)))
+        (fold_exp_stream, recovery_eff_stream) = self.draw_streams
+
+        fold_increase_pd = np.empty(self.SIMULATION_RUNS)
+        for start in range(0, self.SIMULATION_RUNS, self.PROGRESS_RUNS):
+            if checkpoint is not None:
+                checkpoint(start)
+
+            # Read variates of each cycle (rows) and run (columns) of the chunk
+            runs = min(self.PROGRESS_RUNS, self.SIMULATION_RUNS - start)
+            fold_exps = fold_exp_stream.draw(required_cycles * runs).reshape(required_cycles, runs)
+            recovery_effs = recovery_eff_stream.draw(required_cycles * runs).reshape(required_cycles, runs)
+
+            fold_increase = (np.ones(runs) if self.inoculum_ratios is None
+                             else np.array(self.inoculum_ratios[start:start+runs]))
+            for cycle in range(1, required_cycles+1):
+                fold_increase *= fold_exps[cycle-1] * recovery_effs[cycle-1]
+
+                # Limit fold increase of a cycle to the optimal fold increase (except for the last cycle)
+                if optimal_fold_increase is not None and cycle != required_cycles:
+                    np.minimum(fold_increase, optimal_fold_increase**cycle, out=fold_increase)
+
+            fold_increase_pd[start:start+runs] = fold_increase
+
+        return fold_increase_pd
+
+
+    # Function for sampling the distribution of total fold increases of a number of cycles from cached variates of
+    # the fold increase of each cycle (cached Monte Carlo engine). Same as "sample_pooled_fold_increases", but the
+    # fold increase of each cycle of each run is only drawn once for each Expansion and Recovery Simulation (more
+    # cycles are drawn when needed), so every iteration of the searches, and every bioprocess using the same
+    # simulations (e.g., with different target cell numbers), combines the same variates (common random numbers).
+    # Variates are cached by each process, so seeded simulations are only reproducible with the same cache (unless
+    # variates are common, see "sample_common_fold_increases"), which is cleared before each task of sweeps and batch
+    # runs (see "clear_cached_variates")
+    def sample_cached_fold_increases(self, required_cycles, optimal_fold_increase=None, checkpoint=None,
+                                     common=False, empirical=False):
+        key = (self.expansion_simulation["Fold Expansion AVG"].item(), self.fold_exp_std, self.recovery_eff_alpha,
+               self.recovery_eff_beta, self.SIMULATION_RUNS, common)
+        if empirical:
+            key += tuple(None if sampler is None else sampler.key for sampler in self.replicate_samplers)
+        variates = cycle_fold_increases.pop(key, np.empty((0, self.SIMULATION_RUNS)))
+        if len(variates) < required_cycles:
+            new_cycles = range(len(variates), required_cycles)
+            if common:
+                # Transform the standardized variates of each cycle through the quantile functions of the fold
+                # expansion (normal) and recovery efficiency (beta) distributions
+                new_variates = [(key[0] + key[1] * z) * utils.beta_quantiles(u, key[2], key[3])
+                                for (z, u) in (draw_common_variates(cycle, self.SIMULATION_RUNS)
+                                               for cycle in new_cycles)]
+            elif empirical:
+                # Draw the fold expansion and recovery efficiency variates of all new cycles at once from the
+                # replicate measurements (or from the parametric distributions of simulations without them)
+                shape = (len(new_cycles), self.SIMULATION_RUNS)
+                (fold_exp_sampler, recovery_eff_sampler) = self.replicate_samplers
+                new_variates = ((nprand.normal(key[0], key[1], shape) if fold_exp_sampler is None
+                                 else fold_exp_sampler.draw(shape))
+                                * (nprand.beta(key[2], key[3], shape) if recovery_eff_sampler is None
+                                   else recovery_eff_sampler.draw(shape)))
+            else:
+                new_variates = (nprand.normal(key[0], key[1], (len(new_cycles), self.SIMULATION_RUNS))
+                                * nprand.beta(key[2], key[3], (len(new_cycles), self.SIMULATION_RUNS)))
+            variates = np.vstack([variates, np.reshape(new_variates, (len(new_cycles), self.SIMULATION_RUNS))])
+            instrumentation.count("Cached Cycle Variates", len(new_cycles) * self.SIMULATION_RUNS)
+
+        # Keep variates of the most recently used simulations only
+        cycle_fold_increases[key] = variates
+        while len(cycle_fold_increases) > CACHED_VARIATES:
+            del cycle_fold_increases[next(iter(cycle_fold_increases))]
+
+        fold_increase_pd = np.empty(self.SIMULATION_RUNS)
+        for start in range(0, self.SIMULATION_RUNS, self.PROGRESS_RUNS):
+            if checkpoint is not None:
+                checkpoint(start)
+
+            runs = min(self.PROGRESS_RUNS, self.SIMULATION_RUNS - start)
+            fold_increase = (np.ones(runs) if self.inoculum_ratios is None
+                             else np.array(self.inoculum_ratios[start:start+runs]))
+            for cycle in range(1, required_cycles+1):
+                fold_increase *= variates[cycle-1, start:start+runs]
+
+                # Limit fold increase of a cycle to the optimal fold increase (except for the last cycle)
+                if optimal_fold_increase is not None and cycle != required_cycles:
+                    np.minimum(fold_increase, optimal_fold_increase**cycle, out=fold_increase)
+
+            fold_increase_pd[start:start+runs] = fold_increase
+
+        return fold_increase_pd
+
+
+    # Function for sampling the distribution of total fold increases of a number of cycles from common random
+    # numbers (common Monte Carlo engine). Same as "sample_cached_fold_increases", but the fold increases of each
+    # cycle are transformed from standardized variates shared by all simulations (see "draw_common_variates"), so
+    # every scenario is simulated with the same random numbers and the differences between scenarios are mostly
+    # free of Monte Carlo noise (paired comparisons, see "outputs.paired_differences")
+    def sample_common_fold_increases(self, required_cycles, optimal_fold_increase=None, checkpoint=None):
+        return self.sample_cached_fold_increases(required_cycles, optimal_fold_increase, checkpoint, common=True)
+
+
+    # Function for sampling the distribution of total fold increases of a number of cycles from replicate
+    # measurements (empirical Monte Carlo engine). Same as "sample_cached_fold_increases", but the fold expansion and
+    # recovery efficiency variates of each cycle are bootstrapped from (or drawn from kernel density estimates of) the
+    # replicate measurements of the Expansion and Recovery Simulations (see "replicates.py"), rather than drawn from
+    # distributions fitted to their average and SEM. Simulations without replicate measurements keep their parametric
+    # distributions
+    def sample_empirical_fold_increases(self, required_cycles, optimal_fold_increase=None, checkpoint=None):
+        return self.sample_cached_fold_increases(required_cycles, optimal_fold_increase, checkpoint, empirical=True)
+
+
+    # Function for reporting the progress of the Monte Carlo simulation at a checkpoint. The progress function
+    # may raise an exception to cancel the simulation (e.g., "jobs.JobCancelled"), in which case the last reported
+    # "Monte Carlo" results (if the fold increase cap search already accepted a cap) can be used as partial results
+    def report_progress(self, stage, required_cycles, runs, optimal_fold_increase=None, min_fold_increase=None,
+                        fold_increase_pds=(), accepted_fold_increase=None):
+        event = {"Stage": stage, "Required Cycles": required_cycles, "Cap Step": len(fold_increase_pds),
+                 "Runs": runs, "Simulation Runs": self.SIMULATION_RUNS, "Chunk Runs": self.PROGRESS_RUNS,
+                 "Max Cap Steps": None, "Monte Carlo": None}
+
+        if stage == "Fold Increase Cap":
+            # Maximum number of caps tested (the search stops earlier once the minimum threshold is disrespected)
+            event["Max Cap Steps"] = max(math.ceil(math.log(min_fold_increase / optimal_fold_increase)
+                                                   / math.log(self.DECREASE_RATIO)), 0) + len(fold_increase_pds) + 1
+            if accepted_fold_increase is not None:
+                event["Monte Carlo"] = (required_cycles, accepted_fold_increase, list(fold_increase_pds))
+
+        self.progress(event)
+
 
     # Function for determining bioreactor expansion cost
     def determine_bioreactor_expansion_cost(self, db_data, d_facility_cost, d_labor_cost):
@@ -369,6 +702,47 @@ class BioreactorExpansion():
         self.T_medium_cost = T_medium_volume * db_data["Reagents"].loc[self.culture_medium].item()
 
         # <>-------- Quality Control Costs (Subcategory of Reagent Costs)--------<>
+        # Calculate cost of initial and final quality controls, and of flow cytometry after each intermediate cycle
+        (ini_qual_cost, flow_cytometry_cost, fin_qual_cost) = self.determine_quality_control_costs(
+            db_data, self.culture_medium, self.coating_substrate)
+        int_qual_cost = flow_cytometry_cost * (len(self.bioreactor_workflow[0])-1)
+
+        # Calculate total quality control cost
+        T_qual_ctrl_cost = ini_qual_cost + int_qual_cost + fin_qual_cost
+
+        # <>----------------- Facility Costs ----------------<>
+        # Calculate daily bioreactor depreciation
+        bioreactor_acquisition_costs = N_bioreactors * self.bioreactors["Acquisition Cost"]
+
+        T_bioreactor_acquisition_cost = bioreactor_acquisition_costs.sum()
+
+        self.d_bioreactor_depreciation = (T_bioreactor_acquisition_cost /
+                                          (db_data["Facility Specifications"].loc["Equipment Lifespan"].item() * YEAR_TO_DAYS))
+        
+        # Calculate total bioreactor energy cost
+        bioreactor_energy_consumptions = (N_bioreactors * self.bioreactors["Energy Consumption"]
+                                          * self.expansion_simulation["Bioreactor Culture Time"].item())
+
+        T_bioreactor_energy_consumption = bioreactor_energy_consumptions.sum()
+
+        T_bioreactor_energy_cost = (T_bioreactor_energy_consumption
+                                    * db_data["Facility Specifications"].loc["Energy Cost"].item())
+
+        # <>--------------- Costs by Category ---------------<>
+        # Calculate total category costs of bioreactor expansion
+        self.T_consumables_cost = T_bioreactor_use_cost
+        self.T_reagents_cost = T_diss_enz_cost + T_ROCKi_cost + self.T_medium_cost + T_qual_ctrl_cost
+        self.T_facility_cost = d_facility_cost * self.duration + T_bioreactor_energy_cost
+        self.T_labor_cost = d_labor_cost * self.duration
+
+        # Calculate overall bioreactor expansion cost
+        self.overall_cost = self.T_consumables_cost + self.T_reagents_cost + self.T_facility_cost + self.T_labor_cost
+
+
+    # Function for determining the cost of the initial and final quality controls and of each flow cytometry (also
+    # performed after each intermediate expansion cycle)
+    @staticmethod
+    def determine_quality_control_costs(db_data, culture_medium, coating_substrate):
         # Calculate flow cytometry cost
         flow_cytometry_cost = db_data["Quality Controls"].loc["Intracellular FC"].item() * (len(INT_FC_ANTIBODIES)+1)
         flow_cytometry_cost += db_data["Quality Controls"].loc["Surface FC"].item() * (len(SUR_FC_ANTIBODIES)+1)
@@ -385,10 +759,10 @@ class BioreactorExpansion():
         diff_platform_cost = diff_planar_platform_data["Cost"]
 
         diff_coating_volume = diff_planar_platform_data["Coating Volume"].item() * diff_total_surfaces
-        diff_coating_cost = diff_coating_volume * db_data["Reagents"].loc[self.coating_substrate].item()
+        diff_coating_cost = diff_coating_volume * db_data["Reagents"].loc[coating_substrate].item()
 
         diff_hiPSC_medium_volume = diff_planar_platform_data["Culture Volume"] * diff_total_surfaces
-        diff_hiPSC_medium_cost = diff_hiPSC_medium_volume * db_data["Reagents"].loc[self.culture_medium].item()
+        diff_hiPSC_medium_cost = diff_hiPSC_medium_volume * db_data["Reagents"].loc[culture_medium].item()
         diff_ROCKi_cost = diff_hiPSC_medium_volume * db_data["Reagents"].loc[ROCKI].item()
 
         diff_kit_medium_cost = db_data["Quality Controls"].loc["Trilineage Differentiation"].item()
@@ -419,58 +793,37 @@ class BioreactorExpansion():
 
         # Calculate cost of each type of quality control
         ini_qual_cost = flow_cytometry_cost + trilineage_differentiation_cost
-        int_qual_cost = flow_cytometry_cost * (len(self.bioreactor_workflow[0])-1)
         fin_qual_cost = (flow_cytometry_cost + trilineage_differentiation_cost + immuno_cost
                          + RT_PCR_cost + karyotyping_cost + genetic_analysis_cost)
-        
-        # Calculate total quality control cost
-        T_qual_ctrl_cost = ini_qual_cost + int_qual_cost + fin_qual_cost
-
-        # <>----------------- Facility Costs ----------------<>
-        # Calculate daily bioreactor depreciation
-        bioreactor_acquisition_costs = N_bioreactors * self.bioreactors["Acquisition Cost"]
-
-        T_bioreactor_acquisition_cost = bioreactor_acquisition_costs.sum()
-
-        self.d_bioreactor_depreciation = (T_bioreactor_acquisition_cost /
-                                          (db_data["Facility Specifications"].loc["Equipment Lifespan"].item() * YEAR_TO_DAYS))
-        
-        # Calculate total bioreactor energy cost
-        bioreactor_energy_consumptions = (N_bioreactors * self.bioreactors["Energy Consumption"]
-                                          * self.expansion_simulation["Bioreactor Culture Time"].item())
 
-        T_bioreactor_energy_consumption = bioreactor_energy_consumptions.sum()
-
-        T_bioreactor_energy_cost = (T_bioreactor_energy_consumption
-                                    * db_data["Facility Specifications"].loc["Energy Cost"].item())
-
-        # <>--------------- Costs by Category ---------------<>
-        # Calculate total category costs of bioreactor expansion
-        self.T_consumables_cost = T_bioreactor_use_cost
-        self.T_reagents_cost = T_diss_enz_cost + T_ROCKi_cost + self.T_medium_cost + T_qual_ctrl_cost
-        self.T_facility_cost = d_facility_cost * self.duration + T_bioreactor_energy_cost
-        self.T_labor_cost = d_labor_cost * self.duration
-
-        # Calculate overall bioreactor expansion cost
-        self.overall_cost = self.T_consumables_cost + self.T_reagents_cost + self.T_facility_cost + self.T_labor_cost
+        return ini_qual_cost, flow_cytometry_cost, fin_qual_cost
 
 
 # Define composite class for bioprocess simulation and computation of costs
 class Bioprocess():
     # Initializer of class object
-    def __init__(self, db_data, bio_params):
+    def __init__(self, db_data, bio_params, monte_carlo=None, progress=None, hint=None, engine=None, strict=False):
         # <>------------------- Main Body -------------------<>
-        # Determine daily facility cost
-        self.d_facility_cost = self.determine_daily_facility_cost(db_data)
+        instrumentation.count("Bioprocess Simulations")
+
+        with instrumentation.span("Daily Costs"):
+            # Determine daily facility cost
+            self.d_facility_cost = self.determine_daily_facility_cost(db_data)
 
-        # Determine daily labor cost
-        self.d_labor_cost = self.determine_daily_labor_cost(db_data)
+            # Determine daily labor cost
+            self.d_labor_cost = self.determine_daily_labor_cost(db_data)
 
         # Create instance of Planar Expansion Class
-        self.planar_expansion = PlanarExpansion(db_data, bio_params, self.d_facility_cost, self.d_labor_cost)
+        with instrumentation.span("Planar Expansion"):
+            self.planar_expansion = PlanarExpansion(db_data, bio_params, self.d_facility_cost, self.d_labor_cost)
 
-        # Create instance of Bioreactor Expansion Class
-        self.bioreactor_expansion = BioreactorExpansion(db_data, bio_params, self.d_facility_cost, self.d_labor_cost)
+        # Create instance of Bioreactor Expansion Class (inoculated with the simulated cells of the planar expansion,
+        # in stochastic planar mode)
+        with instrumentation.span("Bioreactor Expansion"):
+            self.bioreactor_expansion = BioreactorExpansion(db_data, bio_params, self.d_facility_cost,
+                                                            self.d_labor_cost, monte_carlo, progress,
+                                                            self.planar_expansion.inoc_cells_pd, hint, engine,
+                                                            strict)
 
         # Adjust the facility cost of both phases by taking into account bioreactor depreciation 
         # (this can only be done after determining the optimal workflow)
@@ -497,9 +850,29 @@ class Bioprocess():
         # Calculate overall bioprocess cost
         self.bioprocess_overall_cost = self.planar_expansion.overall_cost + self.bioreactor_expansion.overall_cost
 
+        # <>--------------- Bioprocess Summary --------------<>
+        # Calculate overall bioprocess duration
+        self.bioprocess_duration = self.planar_expansion.duration + self.bioreactor_expansion.duration
+
+        # Calculate the distribution of final cell numbers and its average, along with the confidence level
+        # (percentage of simulation runs reaching the target cell number). Bioprocesses whose first fold increase cap
+        # already disrespects the minimum threshold have no accepted distribution (infeasible), in which case the
+        # average final cell number is unknown and the confidence level is 0%
+        if self.bioreactor_expansion.fold_increase_pds:
+            self.fin_cell_number_pd = (self.bioreactor_expansion.fold_increase_pds[-1]
+                                       * self.planar_expansion.inoc_cells)
+            self.avg_fin_cell_number = np.average(self.fin_cell_number_pd)
+            self.confidence_level = ((self.fin_cell_number_pd >= bio_params["Target Cell Number"].item()).sum()
+                                     / len(self.fin_cell_number_pd)) * 100
+        else:
+            self.fin_cell_number_pd = np.empty(0)
+            self.avg_fin_cell_number = np.nan
+            self.confidence_level = 0.0
+
 
     # Function for determining daily facility cost
-    def determine_daily_facility_cost(self, db_data):        
+    @staticmethod
+    def determine_daily_facility_cost(db_data):        
         # Calculate facility construction cost
         standard_rooms_cost = (db_data["Construction Costs"].loc["Standard Rooms", "Area"]
                                * db_data["Construction Costs"].loc["Standard Rooms", "Cost"])
@@ -537,9 +910,52 @@ class Bioprocess():
 
 
     # Function for determining daily labor cost
-    def determine_daily_labor_cost(self, db_data):        
+    @staticmethod
+    def determine_daily_labor_cost(db_data):        
         # Calculate daily labor cost (taking into account number of parallel bioprocesse)
         d_labor_cost = ((db_data["Labor Costs"].loc[:, "Number"] * db_data["Labor Costs"].loc[:, "Salary"]).sum()
                         / YEAR_TO_DAYS / db_data["Facility Specifications"].loc["Parallel Processes"].item())
 
-        return d_labor_cost
\ No newline at end of file
+        return d_labor_cost
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for drawing the standardized variates of a cycle shared by all simulations (standard normal variates of
+# fold expansion and uniform variates of recovery efficiency), which only depend on the cycle, the number of runs and
+# COMMON_RANDOM_SEED (not on numpy's global random state)
+def draw_common_variates(cycle, runs):
+    if (cycle, runs) not in common_variates:
+        generator = np.random.default_rng([COMMON_RANDOM_SEED, cycle])
+        common_variates[(cycle, runs)] = (generator.standard_normal(runs), generator.random(runs))
+
+    return common_variates[(cycle, runs)]
+
+
+# Function for clearing the cached variates drawn from numpy's global random state (see "BioreactorExpansion.
+# sample_cached_fold_increases"), so a seeded simulation does not depend on the simulations run before it by the same
+# process. Common variates do not depend on the random state and are kept
+def clear_cached_variates():
+    for key in [key for key in cycle_fold_increases if not key[5]]:
+        del cycle_fold_increases[key]
+
+
+# -----------------------------------------------------------------------------
+#    MONTE CARLO ENGINES
+# -----------------------------------------------------------------------------
+# Monte Carlo engines which can sample the fold increase distributions of bioreactor expansions, each called with a
+# BioreactorExpansion object, the number of cycles, the optimal fold increase (None if not limited) and a checkpoint
+# function (see "BioreactorExpansion.sample_fold_increases"). New engines must reproduce the results of the legacy
+# engine (see "golden.py"), except for the empirical engine with replicate measurements, which samples other
+# distributions. Engines drawing other variates than the legacy engine can still differ from its reference outputs in
+# borderline decisions, and then fail the KS check of the last accepted cap's distribution: e.g., the pooled engine
+# accepts 21 cap steps for "B8 (0.75x)" rather than 22, as the legacy engine itself does with seeds 4 to 6. The
+# common engine draws the same variates for every seed, so its borderline decisions cannot be matched by reseeding:
+# it accepts 26 cap steps for "Default" and "B8 (1x)" rather than 27 (e.g., an overall cost of 34,665.74 € rather
+# than 34,334.26 € for "Default")
+ENGINES = {"legacy": BioreactorExpansion.sample_fold_increases,
+           "pooled": BioreactorExpansion.sample_pooled_fold_increases,
+           "cached": BioreactorExpansion.sample_cached_fold_increases,
+           "common": BioreactorExpansion.sample_common_fold_increases,
+           "empirical": BioreactorExpansion.sample_empirical_fold_increases}
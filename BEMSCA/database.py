@@ -32,6 +32,33 @@ import sqlite3
 # -----------------------------------------------------------------------------
 #    FUNCTIONS
 # -----------------------------------------------------------------------------
+# Function for creating a unique index on the "Name" column of every table (if it does not already exist),
+# which speeds up lookups of entries by name and rejects duplicate entries
+def create_name_indexes(cursor):
+    cursor.execute('SELECT Name FROM sqlite_master WHERE TYPE = "table"')
+    for table in [name[0] for name in cursor.fetchall()]:
+        cursor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS "{table} Name" ON "{table}" ("Name")')
+
+
+# Function for creating the tables of replicate measurements of Expansion and Recovery Simulations (if they do not
+# already exist, so databases created before these tables are migrated), i.e. the fold expansion or recovery efficiency
+# measured by each replicate of the experiments summarized by a simulation (see "replicates.py")
+def create_replicate_tables(cursor):
+    # <>----------- Expansion Replicates Table -----------<>
+    cursor.execute('''CREATE TABLE IF NOT EXISTS "Expansion Replicates" (
+                    "Name" text,
+                    "Expansion Simulation" text,
+                    "Fold Expansion" real
+                   )''')
+
+    # <>----------- Recovery Replicates Table ------------<>
+    cursor.execute('''CREATE TABLE IF NOT EXISTS "Recovery Replicates" (
+                    "Name" text,
+                    "Recovery Simulation" text,
+                    "Recovery Efficiency" real
+                   )''')
+
+
 # Function for initializing BEMSCA's default database (if database does not already exist)
 def initialize_database():
     
@@ -253,7 +280,7 @@ def initialize_database():
 
     # ||-------------------[ BIOPROCESS VARIABLES TABLES ]-------------------||
     # Biologic Variables Tables Index (in order of appearence in code)
-    # [Bioprocess Parameters, Expansion Simulations, Recovery Simulations]
+    # [Bioprocess Parameters, Expansion Simulations, Recovery Simulations, Expansion Replicates, Recovery Replicates]
 
     # <>---------- Bioprocess Parameters Table ----------<>    
     # Create Bioprocess Parameters Table
@@ -327,8 +354,16 @@ def initialize_database():
                     ("Borys2021", 0.952, 0.040, 4)
                    ''')
 
+    # <>------- Expansion and Recovery Replicates --------<>
+    # Create tables of replicate measurements (empty by default, since the default simulations only report the
+    # average, SEM and sample size of their experiments)
+    create_replicate_tables(cursor)
+
     # ||----------------[ END OF BIOPROCESS VARIABLES TABLES ]---------------||
 
+    # Create indexes on the names of table entries
+    create_name_indexes(cursor)
+
     # Commit database changes (save initialized database)
     connection.commit()
 
@@ -0,0 +1,347 @@
+import argparse
+import bisect
+import itertools
+import json
+import math
+import os
+import time
+import numpy as np
+import numpy.random as nprand
+import bioprocess
+import stacked
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+INDEX_DIRECTORY = "results/decision_indexes"
+INDEX_FILE = os.path.join(INDEX_DIRECTORY, "decision_index.npz")
+
+# Parameters of the distributions of the Monte Carlo searches (see "stacked.compile_scenarios")
+DISTRIBUTION_COLUMNS = ["Fold Expansion AVG", "Fold Expansion STD", "Recovery Efficiency Alpha",
+                        "Recovery Efficiency Beta"]
+
+# Axes of the grid of the index (the fold expansion mean, which usually spans orders of magnitude, is spaced and
+# interpolated in logarithmic scale, and the fold expansion std is indexed relative to the mean, as its coefficient of
+# variation, so the grid does not cover implausible distributions). The target total fold increase (tfi) is not an
+# axis of the grid: decisions are indexed along the tfi interval of each number of cycles instead (see "build_index")
+AXES = ["Fold Expansion AVG", "Fold Expansion CV", "Recovery Efficiency Alpha", "Recovery Efficiency Beta",
+        "Minimum Threshold"]
+AXIS_POINTS = {"Fold Expansion AVG": 17, "Fold Expansion CV": 3, "Recovery Efficiency Alpha": 3,
+               "Recovery Efficiency Beta": 3, "Minimum Threshold": 4} # grid points of each axis
+CAP_POINTS = 17 # points of the tfi interval of each number of cycles at which the fold increase cap is searched
+AXIS_MARGIN = 0.25 # relative margin of the distribution axes around the database's values
+TFI_SPAN = 4 # ratio between the ends of the covered tfi range and the database's extreme values
+THRESHOLD_MARGIN = 0.04 # margin of the minimum threshold axis around the database's values
+
+# Bound of the interpolation errors of the index, relative to the spread of the values at the corners of a grid cell
+# (the logarithms of thresholds and caps are nearly linear within a cell, see "check_index")
+INTERPOLATION_ERROR = 0.25
+
+# Largest error bound of the fold increase cap of a query (see "DecisionIndex.lookup") accepted by default
+MAX_ERROR = 0.05
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for looking up Monte Carlo decisions in a precomputed index
+class DecisionIndex():
+    # Initializer of class object
+    def __init__(self, index_file=INDEX_FILE, max_error=MAX_ERROR):
+        # <>---------- Important Object Attributes ----------<>
+        with np.load(index_file) as index:
+            # Grid points of each axis (in the order of AXES, the fold expansion mean in logarithmic scale)
+            self.axes = [index[axis] for axis in AXES]
+            self.axes[0] = np.log(self.axes[0])
+
+            # Range of target total fold increases covered by the index
+            self.tfi_range = tuple(index["TFI"])
+
+            # Minimum volumes of the bioreactors covered by the index (looked up exactly)
+            self.min_volumes = index["Min Volume"]
+
+            # Logarithm of the threshold fold increase of each number of cycles at each grid point (the percentile
+            # of the total fold increases of the cycles, so a tfi requires the first number of cycles whose threshold
+            # reaches it). Thresholds which are not positive (distributions drawing negative fold expansions) never
+            # reach a tfi
+            thresholds = index["Fold Increase Thresholds"]
+            self.log_thresholds = np.full(thresholds.shape, -np.inf)
+            np.log(thresholds, out=self.log_thresholds, where=thresholds > 0)
+
+            # Logarithm of the optimal fold increase at each grid point, minimum volume, number of cycles and point of
+            # the tfi interval of the number of cycles (not a number if not searched)
+            self.log_fold_increases = np.log(index["Optimal Fold Increase"])
+
+            # Simulation runs of the Monte Carlo searches of the index
+            self.runs = int(index["Runs"])
+
+        # Largest error bound of the fold increase cap of an accepted query
+        self.max_error = max_error
+
+        # Offsets of the corners of a grid cell (one column per corner)
+        self.corners = np.array(list(itertools.product([0, 1], repeat=len(AXES)))).T
+
+        # Last point of each axis (corners are limited to it along axes of a single point)
+        self.last_points = np.array([len(axis) - 1 for axis in self.axes])[:, np.newaxis]
+
+
+    # Function for looking up the required cycles and optimal fold increase of a query, returns them along with the
+    # error bound of the fold increase, or None if the query is not covered by the index (in which case the full
+    # Monte Carlo searches are run). The thresholds of the query are interpolated from those of the corners of its
+    # grid cell (multilinear interpolation in logarithmic scale), and its required cycles are only accepted if its tfi
+    # is further from the thresholds around it than their interpolation error (INTERPOLATION_ERROR times the spread of
+    # the corners' thresholds). The fold increase cap of each corner at the query's position in the tfi interval of its
+    # number of cycles is interpolated between its searched points, and the optimal fold increase is interpolated from
+    # the caps of the corners. Its error bound is the interpolation error of the caps (relative to the spread of the
+    # searched caps around the query, which include the kink of caps reaching the minimum fold increase) plus a step
+    # of the sequence of caps (the searches only decide between caps "stacked.DECREASE_RATIO" apart). Queries whose
+    # error bound exceeds the maximum error are not covered either. The error bound is a heuristic, so decisions are
+    # still checked against the minimum threshold once simulated (see "BioreactorExpansion.
+    # simulate_bioreactor_expansion")
+    def lookup(self, fold_exp_avg, fold_exp_std, recovery_eff_alpha, recovery_eff_beta, tfi, min_threshold,
+               min_volume):
+        volume = np.flatnonzero(self.min_volumes == min_volume)
+        if not len(volume) or fold_exp_avg <= 0 or not self.tfi_range[0] <= tfi <= self.tfi_range[1]:
+            return None
+
+        # Locate the cell of the query and its position within the cell along each axis
+        lower = []
+        position = []
+        for axis, value in zip(self.axes, (math.log(fold_exp_avg), fold_exp_std / fold_exp_avg, recovery_eff_alpha,
+                                           recovery_eff_beta, min_threshold)):
+            if not axis[0] <= value <= axis[-1]:
+                return None
+            i = min(bisect.bisect_right(axis, value) - 1, max(len(axis) - 2, 0))
+            lower.append(i)
+            position.append(0.0 if len(axis) == 1 else (value - axis[i]) / (axis[i+1] - axis[i]))
+
+        position = np.array(position)[:, np.newaxis]
+        weights = np.where(self.corners == 1, position, 1 - position).prod(axis=0)
+        corners = self.corners[:, weights > 0]
+        weights = weights[weights > 0]
+        points = tuple(np.minimum(np.array(lower)[:, np.newaxis] + corners, self.last_points))
+
+        # Required cycles (the first number of cycles whose threshold reaches the tfi)
+        log_tfi = math.log(tfi)
+        log_thresholds = self.log_thresholds[points]
+        interpolated_thresholds = np.dot(weights, log_thresholds)
+        required_cycles = int((interpolated_thresholds < log_tfi).sum()) + 1
+        if not 2 <= required_cycles <= len(interpolated_thresholds):
+            return None
+        interval = slice(required_cycles - 2, required_cycles)
+        (log_lower, log_upper) = interpolated_thresholds[interval]
+        (lower_error, upper_error) = INTERPOLATION_ERROR * np.ptp(log_thresholds[:, interval], axis=0)
+        if not math.isfinite(log_lower) or log_tfi - log_lower <= lower_error or log_upper - log_tfi < upper_error:
+            return None
+
+        # Position of the query in the tfi interval of its number of cycles
+        interval_position = min(max((log_tfi - log_lower) / (log_upper - log_lower), 0.0), 1.0) * (CAP_POINTS - 1)
+        j = min(int(interval_position), CAP_POINTS - 2)
+        t = interval_position - j
+
+        searched_caps = self.log_fold_increases[points + (volume[0], required_cycles - 1)][:, j:j+2]
+        if not np.isfinite(searched_caps).all():
+            return None
+        log_caps = (1 - t) * searched_caps[:, 0] + t * searched_caps[:, 1]
+
+        error = INTERPOLATION_ERROR * (math.exp(np.ptp(searched_caps)) - 1) + (1 / stacked.DECREASE_RATIO - 1)
+        if error > self.max_error:
+            return None
+
+        return required_cycles, math.exp(np.dot(weights, log_caps)), error
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for determining the default axes of an index covering the database's bioprocess parameters: the
+# distribution axes span their values with a relative margin of AXIS_MARGIN (the fold expansion mean in geometric
+# progression), the minimum threshold axis spans their values with a margin of THRESHOLD_MARGIN and the covered tfi
+# range spans TFI_SPAN times their extreme values. Minimum volumes are those of the database's sets of bioreactors
+def default_axes(db_data, points=AXIS_POINTS):
+    parameters = stacked.compile_scenarios(db_data, db_data["Bioprocess Parameters"])
+    parameters["Fold Expansion CV"] = parameters["Fold Expansion STD"] / parameters["Fold Expansion AVG"]
+    thresholds = db_data["Bioprocess Parameters"]["Minimum Threshold"].to_numpy(float)
+
+    axes = {}
+    for axis in AXES[:4]:
+        space = np.geomspace if axis == "Fold Expansion AVG" else np.linspace
+        axes[axis] = np.unique(space(parameters[axis].min() * (1 - AXIS_MARGIN),
+                                     parameters[axis].max() * (1 + AXIS_MARGIN), points[axis]))
+    axes["Minimum Threshold"] = np.unique(np.linspace(max(thresholds.min() - THRESHOLD_MARGIN, 0),
+                                                      min(thresholds.max() + THRESHOLD_MARGIN, 1 - 1e-3),
+                                                      points["Minimum Threshold"]))
+    axes["TFI"] = np.array([parameters["TFI"].min() / TFI_SPAN, parameters["TFI"].max() * TFI_SPAN])
+    axes["Min Volume"] = np.unique(parameters["Min Volume"])
+
+    return axes
+
+
+# Function for determining the threshold fold increase of each distribution (rows of fold expansion mean and std and
+# recovery efficiency alpha and beta), percentile and number of cycles (up to "stacked.MAX_CYCLES"), i.e. the
+# percentile of the total fold increases of the cycles drawn from the common random numbers of "runs" simulation runs,
+# so that a tfi respects the minimum threshold with a number of cycles if the threshold reaches it (as in the cycle
+# search of "stacked.search_block")
+def determine_thresholds(distributions, percentiles, runs):
+    thresholds = np.empty((len(distributions), len(percentiles), stacked.MAX_CYCLES))
+    block = max(stacked.BLOCK_VARIATES // runs, 1)
+    for start in range(0, len(distributions), block):
+        fold_increase = np.ones((len(distributions[start:start+block]), runs))
+        for cycle in range(stacked.MAX_CYCLES):
+            fold_increase *= stacked.draw_cycle_variates(distributions[start:start+block], cycle, runs)
+            thresholds[start:start+block, :, cycle] = np.percentile(fold_increase, percentiles, axis=1).T
+
+    return thresholds
+
+
+# Function for building an index of the Monte Carlo decisions over a grid (dictionary of the grid points of each axis
+# of AXES, of the minimum volumes and of the covered "TFI" range), with the common random numbers of "runs"
+# simulation runs (so the decisions at grid points are those of the common Monte Carlo engine). The threshold fold
+# increase of each number of cycles is determined at each grid point, and the fold increase cap of each number of
+# cycles whose tfi interval (between the thresholds of one cycle less and of the number of cycles) overlaps the
+# covered range is searched at CAP_POINTS evenly spaced points of the interval (in logarithmic scale) by "stacked.
+# search_block", in blocks of searches sharing as few distributions as possible
+def build_index(axes, runs=None):
+    runs = runs or bioprocess.SIMULATION_RUNS
+    shape = tuple(len(axes[axis]) for axis in AXES)
+    grid = dict(zip(AXES, [values.reshape(-1) for values in np.meshgrid(*[np.asarray(axes[axis], float)
+                                                                          for axis in AXES], indexing="ij")]))
+    percentiles = (1 - np.asarray(axes["Minimum Threshold"], float)) * 100
+
+    # Threshold fold increases of each grid point (grid points of a distribution only differ in their threshold)
+    grid["Fold Expansion STD"] = grid["Fold Expansion CV"] * grid["Fold Expansion AVG"]
+    distributions = np.stack([grid[axis][::len(percentiles)] for axis in DISTRIBUTION_COLUMNS], axis=1)
+    thresholds = determine_thresholds(distributions, percentiles, runs).reshape(-1, stacked.MAX_CYCLES)
+
+    # Searches of the fold increase cap of each grid point, minimum volume, number of cycles and point of its interval
+    interval_points = np.linspace(0, 1, CAP_POINTS)
+    searches = []
+    for point in range(len(thresholds)):
+        for cycles in range(2, stacked.MAX_CYCLES + 1):
+            (lower, upper) = thresholds[point, cycles-2:cycles]
+            if 0 < lower < upper and lower < axes["TFI"][1] and upper > axes["TFI"][0]:
+                for volume in range(len(axes["Min Volume"])):
+                    for j, interval_point in enumerate(interval_points):
+                        # (the tfi at the lower end of the interval is just above the threshold of one cycle less)
+                        tfi = lower**(1 - interval_point) * upper**interval_point if j else np.nextafter(lower, np.inf)
+                        searches.append((point, volume, cycles, j, tfi))
+    searches = np.array(searches).T
+    (point, volume, cycles, j) = searches[:4].astype(int)
+
+    parameters = {axis: grid[axis][point] for axis in DISTRIBUTION_COLUMNS}
+    parameters["Min Volume"] = np.asarray(axes["Min Volume"], float)[volume]
+    parameters["TFI"] = searches[4]
+    parameters["Average Fold Increase"] = (parameters["Fold Expansion AVG"] * parameters["Recovery Efficiency Alpha"]
+                                           / (parameters["Recovery Efficiency Alpha"]
+                                              + parameters["Recovery Efficiency Beta"]))
+    parameters["Percentile"] = (1 - grid["Minimum Threshold"][point]) * 100
+
+    optimal_fold_increases = np.full((len(thresholds), len(axes["Min Volume"]), stacked.MAX_CYCLES, CAP_POINTS),
+                                     np.nan)
+    block = max(stacked.BLOCK_VARIATES // runs, 1)
+    for start in range(0, len(point), block):
+        rows = slice(start, start + block)
+        (block_cycles, block_fold_increases, _, valid) = stacked.search_block(
+            {name: values[rows] for name, values in parameters.items()}, runs)
+        # (searches finding another number of cycles, if the thresholds are not increasing, are not indexed)
+        valid &= block_cycles == cycles[rows]
+        optimal_fold_increases[point[rows][valid], volume[rows][valid], cycles[rows][valid] - 1,
+                               j[rows][valid]] = block_fold_increases[valid]
+
+    return {**{name: np.asarray(axes[name], float) for name in AXES + ["TFI", "Min Volume"]},
+            "Fold Increase Thresholds": thresholds.reshape(shape + (stacked.MAX_CYCLES,)),
+            "Optimal Fold Increase": optimal_fold_increases.reshape(shape + optimal_fold_increases.shape[1:]),
+            "Runs": runs}
+
+
+# Function for saving an index to a compressed NumPy file
+def save_index(index, index_file=INDEX_FILE):
+    os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+    np.savez_compressed(index_file, **index)
+
+
+# Function for enabling the lookup of the Monte Carlo decisions of simulations in the given index file (see
+# "bioprocess.DECISION_INDEX")
+def enable(index_file=INDEX_FILE, max_error=MAX_ERROR):
+    bioprocess.DECISION_INDEX = DecisionIndex(index_file, max_error)
+
+
+# Function for checking an index against full Monte Carlo searches at random queries within the covered region
+# (uniform along every axis, in logarithmic scale for the fold expansion mean and tfi), returns a record with the
+# share of queries covered by the index, the share of covered queries whose required cycles match, the mean and
+# largest relative error of their optimal fold increase, the share of them within their error bound and the average
+# lookup time
+def check_index(decision_index, samples=200, seed=0):
+    rng = nprand.default_rng(seed)
+    queries = {axis: rng.uniform(values[0], values[-1], samples) for axis, values in zip(AXES, decision_index.axes)}
+    queries["Fold Expansion AVG"] = np.exp(queries["Fold Expansion AVG"])
+    queries["Fold Expansion STD"] = queries["Fold Expansion CV"] * queries["Fold Expansion AVG"]
+    queries["TFI"] = np.exp(rng.uniform(*np.log(decision_index.tfi_range), samples))
+    queries["Min Volume"] = rng.choice(decision_index.min_volumes, samples)
+
+    start_time = time.perf_counter()
+    decisions = [decision_index.lookup(*(queries[name][i] for name in DISTRIBUTION_COLUMNS
+                                         + ["TFI", "Minimum Threshold", "Min Volume"]))
+                 for i in range(samples)]
+    lookup_time = (time.perf_counter() - start_time) / samples
+
+    parameters = {name: queries[name] for name in DISTRIBUTION_COLUMNS + ["TFI", "Min Volume"]}
+    parameters["Average Fold Increase"] = (queries["Fold Expansion AVG"] * queries["Recovery Efficiency Alpha"]
+                                           / (queries["Recovery Efficiency Alpha"]
+                                              + queries["Recovery Efficiency Beta"]))
+    parameters["Percentile"] = (1 - queries["Minimum Threshold"]) * 100
+    (required_cycles, optimal_fold_increases, _, valid) = stacked.search_block(parameters, decision_index.runs)
+
+    covered = [i for i, decision in enumerate(decisions) if decision is not None and valid[i]]
+    matching = [i for i in covered if decisions[i][0] == required_cycles[i]]
+    errors = np.array([abs(decisions[i][1] / optimal_fold_increases[i] - 1) for i in matching])
+    bounded = [error <= decisions[i][2] * (1 + 1e-9) for error, i in zip(errors, matching)]
+    return {"Queries": samples, "Valid": float(valid.mean()), "Covered": len(covered) / max(valid.sum(), 1),
+            "Matching Cycles": len(matching) / max(len(covered), 1),
+            "Mean Fold Increase Error": float(errors.mean()) if len(errors) else 0.0,
+            "Max Fold Increase Error": float(errors.max(initial=0)),
+            "Within Error Bound": float(np.mean(bounded)) if bounded else 1.0, "Lookup Time": lookup_time}
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Build an index covering the database's bioprocess parameters, or check an index against full Monte Carlo searches,
+# e.g.: python3 decisionindex.py build --runs 10000 and python3 decisionindex.py check --samples 500
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="decisionindex.py", description="Precompute the required cycles and "
+                                                                          "optimal fold increase cap over a grid.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="build an index covering the database's parameters")
+    build_parser.add_argument("--output", default=INDEX_FILE, help="index file")
+    build_parser.add_argument("--runs", type=int, help="simulation runs of each search (default: SIMULATION_RUNS)")
+    build_parser.add_argument("--points", type=json.loads, default={},
+                              help='grid points of some axes, e.g. \'{"Fold Expansion AVG": 33}\'')
+
+    check_parser = subparsers.add_parser("check", help="check an index against full Monte Carlo searches")
+    check_parser.add_argument("index_file", nargs="?", default=INDEX_FILE)
+    check_parser.add_argument("--samples", type=int, default=200, help="random queries")
+    check_parser.add_argument("--max-error", type=float, default=MAX_ERROR, help="largest accepted error bound")
+    check_parser.add_argument("--seed", type=int, default=0, help="seed of the random queries")
+    options = parser.parse_args()
+
+    start_time = time.perf_counter()
+    if options.command == "build":
+        axes = default_axes(utils.get_database_data(), {**AXIS_POINTS, **options.points})
+        index = build_index(axes, options.runs)
+        save_index(index, options.output)
+        print(f'{index["Fold Increase Thresholds"][..., 0].size:,} grid points and '
+              f'{np.isfinite(index["Optimal Fold Increase"]).sum():,} cap searches indexed in '
+              f'{time.perf_counter() - start_time:.1f} s -> {options.output} '
+              f'({os.path.getsize(options.output) / 1e3:,.0f} kB)')
+    else:
+        record = check_index(DecisionIndex(options.index_file, options.max_error), options.samples, options.seed)
+        print(f'{record["Covered"] * 100:.1f}% of {record["Valid"] * record["Queries"]:.0f} valid queries covered, '
+              f'{record["Matching Cycles"] * 100:.1f}% with matching cycles, fold increase error '
+              f'{record["Mean Fold Increase Error"] * 100:.2f}% (mean) / '
+              f'{record["Max Fold Increase Error"] * 100:.2f}% (max), {record["Within Error Bound"] * 100:.1f}% within the error bound, '
+              f'{record["Lookup Time"] * 1e6:.1f} µs per lookup')
+        print(f'Checked in {time.perf_counter() - start_time:.1f} s')
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import os
+import numpy as np
+import numpy.random as nprand
+import instrumentation
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+DRAW_POOL_DIRECTORY = "results/draw_pools"
+DRAW_POOL_SEED = 0 # seed of the generation of every pool (simulations start reading pools at a random position)
+DRAW_POOL_SIZE = int(1e7) # variates of each pool segment (80 MB)
+MAX_DRAW_POOL_BYTES = int(2e9) # size of the pool directory above which the least recently used pools are deleted
+GENERATION_CHUNK = int(1e6) # variates generated (and written) at a time
+
+DISTRIBUTIONS = ["normal", "beta"]
+
+# Pools opened by this process (memory-mapped, so pages are shared by all processes reading the same pool)
+pools = {}
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for reading random variates of a distribution from its draw pool, as a stream starting at a random
+# position of the pool's first segment (drawn from numpy's global random state, so seeded simulations remain
+# reproducible). The stream never wraps around: once a segment is read to its end, it continues from a random position
+# of the next segment (an independent pool, generated when first needed), so a simulation never reuses variates
+class DrawStream():
+    # Initializer of class object
+    def __init__(self, distribution, parameters, size=DRAW_POOL_SIZE, seed=DRAW_POOL_SEED,
+                 directory=DRAW_POOL_DIRECTORY):
+        # <>---------- Important Object Attributes ----------<>
+        self.distribution = distribution
+        self.parameters = parameters
+        self.size = size
+        self.seed = seed
+        self.directory = directory
+
+        self.segment = 0
+        self.pool = get_pool(distribution, parameters, size, seed, directory)
+        self.position = nprand.randint(len(self.pool))
+
+
+    # Function for drawing a number of variates, returns a read-only view of the pool (only variates that continue
+    # in the next segments are copied)
+    def draw(self, number):
+        instrumentation.count("Pooled Variates", number)
+        if self.position + number <= len(self.pool):
+            self.position += number
+            return self.pool[self.position-number:self.position]
+
+        variates = []
+        while number > 0:
+            if self.position == len(self.pool):
+                self.segment += 1
+                self.pool = get_pool(self.distribution, self.parameters, self.size, self.seed, self.directory,
+                                     self.segment)
+                self.position = nprand.randint(len(self.pool))
+            chunk = min(number, len(self.pool) - self.position)
+            variates.append(self.pool[self.position:self.position+chunk])
+            self.position += chunk
+            number -= chunk
+
+        return np.concatenate(variates)
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for obtaining a segment of the draw pool of a distribution ("normal" with (mean, std) parameters or "beta"
+# with (alpha, beta) parameters), generating it once if it does not exist. Returns the pool as a read-only
+# memory-mapped array
+def get_pool(distribution, parameters, size=DRAW_POOL_SIZE, seed=DRAW_POOL_SEED, directory=DRAW_POOL_DIRECTORY,
+             segment=0):
+    pool_file = os.path.join(directory, pool_file_name(distribution, parameters, size, seed, segment))
+    if pool_file in pools:
+        instrumentation.count("Draw Pool Cache Hits")
+        return pools[pool_file]
+
+    generated = not os.path.exists(pool_file)
+    if generated:
+        with instrumentation.span("Draw Pool Generation"):
+            generate_pool(pool_file, distribution, parameters, size, seed, segment)
+
+    pools[pool_file] = np.load(pool_file, mmap_mode='r')
+    # Mark pool as recently used (see "evict_pools")
+    os.utime(pool_file)
+    if generated:
+        evict_pools(directory, keep=pool_file)
+
+    return pools[pool_file]
+
+
+# Function for deleting the least recently used pools of a directory (except the given pool) while its size exceeds
+# MAX_DRAW_POOL_BYTES, e.g. when sweeping the parameters of Expansion and Recovery Simulations. Pools deleted while
+# being read (by this or other processes) remain readable through their memory maps until these are closed
+def evict_pools(directory=DRAW_POOL_DIRECTORY, max_bytes=None, keep=None):
+    max_bytes = MAX_DRAW_POOL_BYTES if max_bytes is None else max_bytes
+    pool_files = []
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.npy'):
+            pool_file = os.path.join(directory, file_name)
+            try:
+                pool_files.append((os.path.getmtime(pool_file), os.path.getsize(pool_file), pool_file))
+            except OSError:
+                continue # (deleted by another process)
+
+    total_bytes = sum(size for (_, size, _) in pool_files)
+    for (_, size, pool_file) in sorted(pool_files):
+        if total_bytes <= max_bytes:
+            break
+        if pool_file == keep:
+            continue
+        try:
+            os.remove(pool_file)
+        except OSError:
+            continue # (deleted by another process, or still open on systems which cannot delete open files)
+        pools.pop(pool_file, None)
+        instrumentation.count("Draw Pools Evicted")
+        total_bytes -= size
+
+
+# Function for determining the key of a draw pool segment (a hash of its distribution, parameters, size, seed and
+# segment, so pools are shared by all simulations of the same Expansion and Recovery Simulations)
+def pool_key(distribution, parameters, size, seed, segment=0):
+    key = [distribution, [float(parameter) for parameter in parameters], int(size), int(seed)]
+    if segment:
+        key.append(int(segment))
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+
+
+# Function for determining the file name of a draw pool segment
+def pool_file_name(distribution, parameters, size, seed, segment=0):
+    return f'{distribution}_{pool_key(distribution, parameters, size, seed, segment)}.npy'
+
+
+# Function for generating a draw pool and saving it to a .npy file. The pool is written to a temporary file which
+# then replaces the pool's file, so processes generating the same pool concurrently never read a partial pool
+def generate_pool(pool_file, distribution, parameters, size, seed, segment=0):
+    if distribution not in DISTRIBUTIONS:
+        raise ValueError(f'Unknown distribution "{distribution}" (must be one of {DISTRIBUTIONS})')
+
+    os.makedirs(os.path.dirname(pool_file) or '.', exist_ok=True)
+    temporary_file = f'{pool_file}.{os.getpid()}.tmp'
+    # Seed generator with the pool's key as well, so pools of different distributions (and segments) are independent
+    generator = np.random.default_rng([seed, int(pool_key(distribution, parameters, size, seed, segment), 16)])
+    pool = np.lib.format.open_memmap(temporary_file, mode='w+', dtype=np.float64, shape=(size,))
+    try:
+        for start in range(0, size, GENERATION_CHUNK):
+            chunk = min(GENERATION_CHUNK, size - start)
+            if distribution == "normal":
+                pool[start:start+chunk] = generator.normal(*parameters, chunk)
+            else:
+                pool[start:start+chunk] = generator.beta(*parameters, chunk)
+        pool.flush()
+    except BaseException:
+        del pool
+        os.remove(temporary_file)
+        raise
+
+    del pool
+    os.replace(temporary_file, pool_file)
@@ -0,0 +1,179 @@
+import csv
+import json
+import os
+import sys
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+EXPORT_FORMATS = {".jsonl": "jsonl", ".csv": "csv", ".parquet": "parquet"}
+PARQUET_BATCH_ROWS = 1000 # records buffered before each row group is written to Parquet files
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for streaming records (see "sweep.summarize_results") to a JSON Lines, CSV or Parquet file, with the
+# format given by the file's extension. Records are written as they are received (Parquet records are written in
+# batches), so memory use does not depend on the number of exported records. Records may have different fields (e.g.
+# the records of simulation and sweep jobs of a batch), the columns of CSV and Parquet files are the union of the
+# fields of all records (the file is rewritten with the new columns when a record has fields not seen before)
+class RecordWriter():
+    # Initializer of class object
+    def __init__(self, file_name):
+        # <>---------- Important Object Attributes ----------<>
+        self.file_name = file_name
+        extension = os.path.splitext(file_name)[1].lower()
+        if extension not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format "{extension}" (must be one of {list(EXPORT_FORMATS)})')
+        self.format = EXPORT_FORMATS[extension]
+
+        self.records = 0
+
+        # File and format specific writers (CSV and Parquet writers are created when the first record is written,
+        # and recreated when later records have new fields)
+        self.file = None
+        self.fields = []
+        self.csv_writer = None
+        self.parquet_writer = None
+        self.batch = []
+
+        # <>------------------- Main Body -------------------<>
+        # Check optional dependency of Parquet files before any record is received
+        if self.format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                raise ImportError('Exporting to Parquet files requires pyarrow (pip install pyarrow)') from None
+            self.pyarrow = pyarrow
+        else:
+            os.makedirs(os.path.dirname(file_name) or '.', exist_ok=True)
+            self.file = open(file_name, 'w', newline='')
+
+
+    # Function for writing a record
+    def write(self, record):
+        if self.format == "jsonl":
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+
+        elif self.format == "csv":
+            new_fields = [field for field in record if field not in self.fields]
+            if self.csv_writer is None or new_fields:
+                self.extend_csv_fields(new_fields)
+            self.csv_writer.writerow(flatten_record(record))
+            self.file.flush()
+
+        else:
+            self.batch.append(flatten_record(record))
+            if len(self.batch) >= PARQUET_BATCH_ROWS:
+                self.write_parquet_batch()
+
+        self.records += 1
+
+
+    # Function for adding fields to the header of the CSV file (the rows already written are copied to a new file
+    # with the extended header, leaving the new fields empty)
+    def extend_csv_fields(self, new_fields):
+        self.fields += new_fields
+        self.file.close()
+
+        if self.csv_writer is not None:
+            os.replace(self.file_name, self.file_name + '.tmp')
+        self.file = open(self.file_name, 'w', newline='')
+        self.csv_writer = csv.DictWriter(self.file, fieldnames=self.fields)
+        self.csv_writer.writeheader()
+
+        if os.path.exists(self.file_name + '.tmp'):
+            with open(self.file_name + '.tmp', newline='') as previous_file:
+                self.csv_writer.writerows(csv.DictReader(previous_file))
+            os.remove(self.file_name + '.tmp')
+
+
+    # Function for writing the buffered records to the Parquet file as a row group (when the records have fields or
+    # types not in the schema of the file, the row groups already written are copied to a new file with the unified
+    # schema, leaving the new fields empty)
+    def write_parquet_batch(self):
+        if not self.batch:
+            return
+
+        # Columns of the batch are the union of the fields of its records (missing fields are empty)
+        self.fields += [field for row in self.batch for field in row if field not in self.fields]
+        table = self.pyarrow.Table.from_pydict({field: [row.get(field) for row in self.batch] for field in self.fields})
+
+        if self.parquet_writer is None:
+            os.makedirs(os.path.dirname(self.file_name) or '.', exist_ok=True)
+            self.parquet_writer = self.pyarrow.parquet.ParquetWriter(self.file_name, table.schema)
+        else:
+            schema = self.pyarrow.unify_schemas([self.parquet_writer.schema, table.schema],
+                                                promote_options="permissive")
+            if not schema.equals(self.parquet_writer.schema):
+                self.parquet_writer.close()
+                os.replace(self.file_name, self.file_name + '.tmp')
+                self.parquet_writer = self.pyarrow.parquet.ParquetWriter(self.file_name, schema)
+                previous_file = self.pyarrow.parquet.ParquetFile(self.file_name + '.tmp')
+                for row_group in range(previous_file.num_row_groups):
+                    rows = previous_file.read_row_group(row_group).to_pylist()
+                    self.parquet_writer.write_table(self.pyarrow.Table.from_pylist(rows, schema=schema))
+                os.remove(self.file_name + '.tmp')
+            table = self.pyarrow.Table.from_pylist(table.to_pylist(), schema=self.parquet_writer.schema)
+
+        self.parquet_writer.write_table(table)
+        self.batch = []
+
+
+    # Function for writing all buffered records and closing the file
+    def close(self):
+        if self.format == "parquet":
+            self.write_parquet_batch()
+            if self.parquet_writer is not None:
+                self.parquet_writer.close()
+        else:
+            self.file.close()
+
+
+    # Functions for using the writer in a "with" statement (the file is closed even if an error occurs)
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for flattening a record into a row of plain values (nested values, such as workflows or the overrides of
+# sweep tasks, are converted to JSON text)
+def flatten_record(record):
+    return {field: json.dumps(value) if isinstance(value, (list, dict, tuple)) else value
+            for field, value in record.items()}
+
+
+# Function for exporting the completed tasks of a sweep, returns the number of exported records (the sweep's
+# journal is read one record at a time, skipping the records of failed tasks, see "sweep.run_sweep")
+def export_sweep(sweep_name, file_name, directory="results/sweeps"):
+    journal_file = os.path.join(directory, f'{sweep_name}.jsonl')
+    with open(journal_file) as journal, RecordWriter(file_name) as writer:
+        for line in journal:
+            # Ignore a partially written last line (if the sweep was interrupted while writing it)
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "Error" not in record:
+                writer.write(record)
+
+        return writer.records
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Export completed tasks of a sweep, e.g.: python3 export.py "Sweep Name" results/sweep.parquet
+if __name__ == "__main__":
+    records = export_sweep(sys.argv[1], sys.argv[2])
+    print(f'Exported {records} records of sweep "{sys.argv[1]}" to "{sys.argv[2]}"')
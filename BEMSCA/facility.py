@@ -0,0 +1,199 @@
+import argparse
+import math
+import sys
+import time
+import numpy as np
+import numpy.random as nprand
+import bioprocess
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+# Sized quantities of a facility configuration besides its number of parallel processes (entries of the "Equipment"
+# and "Labor Costs" tables)
+SIZED_EQUIPMENT = ["Incubator", "Biosafety Cabinet"]
+SIZED_STAFF = ["Lab Technician", "Supervisors"]
+
+MAX_PARALLEL_PROCESSES = 24 # upper bound of the search of the number of parallel processes (if not given)
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for determining the cost model of facility configurations from database data, as a dictionary with
+# the daily "Fixed Cost" of the whole facility (construction, operating costs and equipment and staff which are not
+# sized), the daily "Unit Costs" of each sized quantity (depreciation and energy of equipment, salary of staff) and
+# the "Requirements" of each sized quantity per parallel process (the ratio of the database's current facility, e.g.
+# 12 incubators for 6 parallel processes require 2 incubators per process). Costs match "Bioprocess.
+# determine_daily_facility_cost" and "Bioprocess.determine_daily_labor_cost" for the database's configuration.
+# The fixed cost does not grow with the number of parallel processes: the construction and operating costs of the
+# current facility are assumed to cover any number of parallel processes searched (so larger facilities spread them
+# over more batches, see "optimize_facility")
+def determine_cost_model(db_data):
+    facility_specs = db_data["Facility Specifications"]
+    equipment = db_data["Equipment"]
+    labor_costs = db_data["Labor Costs"]
+    parallel_processes = facility_specs.loc["Parallel Processes"].item()
+
+    unit_costs = {}
+    requirements = {}
+    for name in SIZED_EQUIPMENT:
+        unit_costs[name] = (equipment.at[name, "Acquisition Cost"]
+                            / (facility_specs.loc["Equipment Lifespan"].item() * bioprocess.YEAR_TO_DAYS)
+                            + equipment.at[name, "Energy Consumption"] * equipment.at[name, "Use Factor"]
+                            * facility_specs.loc["Energy Cost"].item())
+        requirements[name] = equipment.at[name, "Amount"] / parallel_processes
+    for name in SIZED_STAFF:
+        unit_costs[name] = labor_costs.at[name, "Salary"] / bioprocess.YEAR_TO_DAYS
+        requirements[name] = labor_costs.at[name, "Number"] / parallel_processes
+
+    # Fixed cost is the daily cost of the current facility (as a whole) without its sized quantities
+    current_amounts = {name: equipment.at[name, "Amount"] for name in SIZED_EQUIPMENT}
+    current_amounts.update({name: labor_costs.at[name, "Number"] for name in SIZED_STAFF})
+    fixed_cost = ((bioprocess.Bioprocess.determine_daily_facility_cost(db_data)
+                   + bioprocess.Bioprocess.determine_daily_labor_cost(db_data)) * parallel_processes
+                  - sum(unit_costs[name] * amount for name, amount in current_amounts.items()))
+
+    return {"Fixed Cost": fixed_cost, "Unit Costs": unit_costs, "Requirements": requirements,
+            "Current Configuration": {"Parallel Processes": int(parallel_processes),
+                                      **{name: int(amount) for name, amount in current_amounts.items()}}}
+
+
+# Function for summarizing the workflow of a simulated bioprocess as the inputs of facility sizing (the workflow
+# does not depend on the facility configuration, so each set of bioprocess parameters is simulated only once): its
+# "Duration" (days), "Variable Cost" (all costs of a batch except the daily facility and labor costs shared by
+# parallel processes), "Confidence Level" (%) and "Target Cell Number"
+def summarize_workflow(simulation_results, bio_params):
+    shared_cost = ((simulation_results.d_facility_cost + simulation_results.d_labor_cost)
+                   * simulation_results.bioprocess_duration)
+    return {"Duration": float(simulation_results.bioprocess_duration),
+            "Variable Cost": float(simulation_results.bioprocess_overall_cost - shared_cost),
+            "Confidence Level": float(simulation_results.confidence_level),
+            "Target Cell Number": float(bio_params["Target Cell Number"].item())}
+
+
+# Function for evaluating facility configurations running a workflow, returns the cost per delivered batch of each
+# configuration (np.inf if infeasible). Configurations are given as arrays of the number of parallel processes and of
+# each sized quantity, which are broadcast against each other (so grids of configurations can be evaluated at
+# once). A configuration is feasible if it meets the requirements of its parallel processes and, if an annual demand
+# of (successful) batches is given, if it can run enough batches per year to deliver it. Facility and labor costs
+# are paid all year, so idle capacity increases the cost per batch, while without a demand every parallel process
+# is fully used (so the cost per batch run matches the overall cost of "bioprocess.Bioprocess", and the cost per
+# delivered batch also pays for the runs failing to reach the target cell number)
+def evaluate_configurations(cost_model, workflow, parallel_processes, quantities, demand=None):
+    parallel_processes = np.asarray(parallel_processes)
+    daily_cost = cost_model["Fixed Cost"]
+    feasible = parallel_processes > 0
+    for name, amounts in quantities.items():
+        daily_cost = daily_cost + cost_model["Unit Costs"][name] * np.asarray(amounts)
+        feasible = feasible & (np.asarray(amounts) >= np.ceil(cost_model["Requirements"][name]
+                                                             * parallel_processes - 1e-9))
+
+    success_rate = workflow["Confidence Level"] / 100
+    capacity = parallel_processes * bioprocess.YEAR_TO_DAYS / workflow["Duration"] # batches run per year
+    if demand is None:
+        runs = capacity
+    else:
+        runs = np.broadcast_to(demand / success_rate, np.shape(capacity))
+        feasible = feasible & (capacity >= runs)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cost_per_batch = ((runs * workflow["Variable Cost"] + daily_cost * bioprocess.YEAR_TO_DAYS)
+                          / (runs * success_rate))
+
+    return np.where(feasible, cost_per_batch, np.inf)
+
+
+# Function for searching the facility configuration which minimizes the cost per delivered batch of any of the given
+# workflows (dictionary of workflow summaries, see "summarize_workflow"), for an annual demand of batches or cells
+# (if neither is given, parallel processes are fully used). The cost per batch grows with every sized quantity, so
+# each number of parallel processes (up to "max_parallel_processes") is evaluated with the minimum quantities meeting
+# its requirements. Returns the best configuration along with its workflow, costs, the number of configurations
+# evaluated and whether it is "At Bound" (its number of parallel processes is the maximum searched, so larger
+# facilities may be cheaper). Without a demand, the fixed cost is spread over more batches as parallel processes are
+# added, so the best configuration is always at the bound
+def optimize_facility(cost_model, workflows, demand_batches=None, demand_cells=None,
+                      max_parallel_processes=MAX_PARALLEL_PROCESSES):
+    names = SIZED_EQUIPMENT + SIZED_STAFF
+    parallel_processes = np.arange(1, max_parallel_processes + 1)
+    quantities = {name: np.ceil(cost_model["Requirements"][name] * parallel_processes - 1e-9).astype(int)
+                  for name in names}
+
+    best = {"Cost per Batch": np.inf}
+    evaluated_configurations = 0
+    start_time = time.perf_counter()
+    for workflow_name, workflow in workflows.items():
+        demand = demand_batches
+        if demand_cells is not None:
+            demand = demand_cells / workflow["Target Cell Number"]
+
+        cost_per_batch = evaluate_configurations(cost_model, workflow, parallel_processes, quantities, demand)
+        evaluated_configurations += cost_per_batch.size
+
+        index = np.argmin(cost_per_batch)
+        if cost_per_batch[index] < best["Cost per Batch"]:
+            success_rate = workflow["Confidence Level"] / 100
+            capacity = parallel_processes[index] * bioprocess.YEAR_TO_DAYS / workflow["Duration"]
+            runs = capacity if demand is None else demand / success_rate
+            best = {"Workflow": workflow_name, "Parallel Processes": int(parallel_processes[index]),
+                    **{name: int(quantities[name][index]) for name in names},
+                    "Cost per Batch": float(cost_per_batch[index]),
+                    "Annual Cost": float(cost_per_batch[index] * runs * success_rate),
+                    "Batches per Year": float(runs), "Utilization": float(runs / capacity),
+                    "At Bound": bool(parallel_processes[index] == max_parallel_processes)}
+
+    best["Evaluated Configurations"] = evaluated_configurations
+    best["Search Time"] = time.perf_counter() - start_time
+    return best
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Size the facility for an annual demand of batches or cells, choosing between the workflows of the given sets of
+# bioprocess parameters, e.g.: python3 facility.py "Default" "B8 (1x)" --batches 200
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="facility.py", description="Size parallel processes, equipment and staff "
+                                                                     "for an annual demand.")
+    parser.add_argument("bioprocess_parameters", nargs="+", help="sets of bioprocess parameters (workflows)")
+    demand_group = parser.add_mutually_exclusive_group()
+    demand_group.add_argument("--batches", type=float, help="annual demand of successful batches")
+    demand_group.add_argument("--cells", type=float, help="annual demand of cells")
+    parser.add_argument("--max-parallel", type=int, default=MAX_PARALLEL_PROCESSES,
+                        help="maximum number of parallel processes")
+    parser.add_argument("--seed", type=int, help="seed of the random draws")
+    options = parser.parse_args()
+
+    db_data = utils.get_database_data()
+    cost_model = determine_cost_model(db_data)
+
+    workflows = {}
+    for bio_params_name in options.bioprocess_parameters:
+        if options.seed is not None:
+            nprand.seed(options.seed)
+        bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]]
+        workflows[bio_params_name] = summarize_workflow(bioprocess.Bioprocess(db_data, bio_params), bio_params)
+        print(f'[{bio_params_name}] {workflows[bio_params_name]["Duration"]:.0f} days, '
+              f'{workflows[bio_params_name]["Variable Cost"]:,.2f} € variable cost, '
+              f'{workflows[bio_params_name]["Confidence Level"]:.1f}% confidence')
+
+    best = optimize_facility(cost_model, workflows, options.batches, options.cells, options.max_parallel)
+    if math.isinf(best["Cost per Batch"]):
+        print(f'\nNo configuration with up to {options.max_parallel} parallel processes meets the demand')
+        sys.exit(1)
+
+    print(f'\nBest configuration ({best["Evaluated Configurations"]:,} configurations evaluated in '
+          f'{best["Search Time"]:.2f} s):')
+    for field in ["Workflow", "Parallel Processes"] + SIZED_EQUIPMENT + SIZED_STAFF:
+        print(f'  {field:<20} {best[field]}')
+    print(f'  {"Cost per Batch":<20} {best["Cost per Batch"]:,.2f} €')
+    print(f'  {"Annual Cost":<20} {best["Annual Cost"]:,.2f} €')
+    print(f'  {"Batches per Year":<20} {best["Batches per Year"]:.1f} ({best["Utilization"] * 100:.0f}% utilization)')
+    if best["At Bound"]:
+        # Without a demand, more parallel processes always spread the fixed cost over more batches
+        reason = ("" if options.batches is not None or options.cells is not None
+                  else ", as construction and operating costs are fixed")
+        print(f'\nThe best configuration has the maximum number of parallel processes searched '
+              f'({options.max_parallel}), larger facilities may be cheaper{reason} (see --max-parallel)')
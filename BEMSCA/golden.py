@@ -0,0 +1,175 @@
+import argparse
+import json
+import math
+import os
+import sys
+import numpy as np
+import numpy.random as nprand
+import bioprocess
+import sweep
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+GOLDEN_DIRECTORY = "golden"
+GOLDEN_FILE = "golden.json"
+GOLDEN_RUNS = int(1e4) # Monte Carlo simulation runs of the reference outputs (results depend on the number of runs)
+GOLDEN_SEED = 0 # seed of the first set of bioprocess parameters (each following set uses the next seed)
+
+# Tolerances of checks of engines against reference outputs
+COST_TOLERANCE = 1e-6 # relative difference of costs
+KS_SIGNIFICANCE = 0.01 # fold increase distributions differ if the p-value of the KS test is lower
+VOLUME_TOLERANCE = 1e-9 # relative difference of optimal fold increases and cycle medium volumes
+
+COST_FIELDS = ["Consumables Cost", "Reagents Cost", "Facility Cost", "Labor Cost", "Medium Cost", "Overall Cost"]
+DISCRETE_FIELDS = ["Required Cycles", "Cap Steps", "Planar Workflow", "Required Bioreactors", "Planar Duration",
+                   "Bioreactor Duration", "Overall Duration"]
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for simulating a set of bioprocess parameters with a Monte Carlo engine (see "bioprocess.ENGINES") under a
+# fixed seed and number of runs, returns its reference outputs and the first and last fold increase distributions
+def simulate_reference(db_data, bio_params_name, seed, runs, engine="legacy"):
+    (default_runs, default_engine) = (bioprocess.SIMULATION_RUNS, bioprocess.ENGINE)
+    (bioprocess.SIMULATION_RUNS, bioprocess.ENGINE) = (runs, engine)
+    try:
+        nprand.seed(seed)
+        simulation_results = bioprocess.Bioprocess(db_data, db_data["Bioprocess Parameters"].loc[[bio_params_name]])
+    finally:
+        (bioprocess.SIMULATION_RUNS, bioprocess.ENGINE) = (default_runs, default_engine)
+
+    record = sweep.summarize_results(simulation_results, workflows=True)
+    (cycle_medium_volumes, required_bioreactors) = simulation_results.bioreactor_expansion.bioreactor_workflow
+    fold_increase_pds = simulation_results.bioreactor_expansion.fold_increase_pds
+
+    outputs = {"Seed": seed, "Required Cycles": record["Required Cycles"], "Cap Steps": len(fold_increase_pds),
+               "Optimal Fold Increase": record["Optimal Fold Increase"],
+               "Planar Workflow": record["Planar Workflow"],
+               "Cycle Medium Volumes": [float(volume) for volume in cycle_medium_volumes],
+               "Required Bioreactors": {bioreactor: [int(number) for number in numbers]
+                                        for bioreactor, numbers in required_bioreactors.items()}}
+    for field in ["Planar Duration", "Bioreactor Duration", "Overall Duration"] + COST_FIELDS:
+        outputs[field] = record[field]
+
+    return outputs, fold_increase_pds[0], fold_increase_pds[-1]
+
+
+# Function for recording the reference outputs of the legacy engine for all sets of bioprocess parameters of the
+# database (outputs are saved to a JSON file and fold increase distributions to a compressed .npz file per set)
+def record_golden(runs=GOLDEN_RUNS, seed=GOLDEN_SEED, directory=GOLDEN_DIRECTORY):
+    db_data = utils.get_database_data()
+    os.makedirs(directory, exist_ok=True)
+
+    golden = {"Simulation Runs": runs, "Sets": {}}
+    for i, bio_params_name in enumerate(db_data["Bioprocess Parameters"].index):
+        (outputs, first_pd, last_pd) = simulate_reference(db_data, bio_params_name, seed + i, runs)
+        golden["Sets"][bio_params_name] = outputs
+        np.savez_compressed(os.path.join(directory, distributions_file_name(bio_params_name)),
+                            first=first_pd.astype(np.float32), last=last_pd.astype(np.float32))
+        print(f'[{bio_params_name}] recorded ({outputs["Required Cycles"]} cycles, {outputs["Cap Steps"]} cap steps)')
+
+    with open(os.path.join(directory, GOLDEN_FILE), 'w') as file:
+        json.dump(golden, file, indent=2)
+
+    return golden
+
+
+# Function for determining the file name of the fold increase distributions of a set of bioprocess parameters
+def distributions_file_name(bio_params_name):
+    return ''.join(character if character.isalnum() else '_' for character in bio_params_name) + '.npz'
+
+
+# Function for checking an engine against the reference outputs of the legacy engine, returns the list of failed
+# checks of each set of bioprocess parameters (an empty list if all checks passed). Discrete decisions (required
+# cycles, accepted caps, workflows and durations) must be identical, optimal fold increases, medium volumes and
+# costs must be within tolerance and fold increase distributions must pass a two-sample KS test
+def check_engine(engine="legacy", bio_params_names=None, directory=GOLDEN_DIRECTORY):
+    db_data = utils.get_database_data()
+    with open(os.path.join(directory, GOLDEN_FILE)) as file:
+        golden = json.load(file)
+
+    failures = {}
+    for bio_params_name in bio_params_names or golden["Sets"]:
+        reference = golden["Sets"][bio_params_name]
+        (outputs, first_pd, last_pd) = simulate_reference(db_data, bio_params_name, reference["Seed"],
+                                                          golden["Simulation Runs"], engine)
+        failures[bio_params_name] = []
+
+        for field in DISCRETE_FIELDS:
+            if outputs[field] != reference[field]:
+                failures[bio_params_name].append(f'{field}: {outputs[field]} != {reference[field]}')
+
+        for field in ["Optimal Fold Increase", "Cycle Medium Volumes"]:
+            if (np.shape(outputs[field]) != np.shape(reference[field])
+                    or not np.allclose(outputs[field], reference[field], rtol=VOLUME_TOLERANCE, atol=0)):
+                failures[bio_params_name].append(f'{field}: {outputs[field]} != {reference[field]}')
+
+        for field in COST_FIELDS:
+            if not math.isclose(outputs[field], reference[field], rel_tol=COST_TOLERANCE):
+                failures[bio_params_name].append(f'{field}: {outputs[field]:,.2f} != {reference[field]:,.2f}')
+
+        with np.load(os.path.join(directory, distributions_file_name(bio_params_name))) as distributions:
+            for (name, fold_increase_pd) in [("first", first_pd), ("last", last_pd)]:
+                (statistic, p_value) = ks_test(fold_increase_pd, distributions[name])
+                if p_value < KS_SIGNIFICANCE:
+                    failures[bio_params_name].append(f'Fold increase distribution ({name} cap): KS statistic '
+                                                     f'{statistic:.4f}, p-value {p_value:.2e}')
+
+    return failures
+
+
+# Function for performing a two-sample Kolmogorov-Smirnov test, returns the KS statistic (maximum distance between
+# the empirical distribution functions of both samples) and its asymptotic p-value (Kolmogorov distribution)
+def ks_test(sample_1, sample_2):
+    sample_1 = np.sort(sample_1)
+    sample_2 = np.sort(sample_2)
+    values = np.concatenate([sample_1, sample_2])
+    cdf_1 = np.searchsorted(sample_1, values, side='right') / len(sample_1)
+    cdf_2 = np.searchsorted(sample_2, values, side='right') / len(sample_2)
+    statistic = np.max(np.abs(cdf_1 - cdf_2))
+
+    # Asymptotic p-value, with the small sample correction of Stephens (1970)
+    effective_size = len(sample_1) * len(sample_2) / (len(sample_1) + len(sample_2))
+    ks_lambda = (math.sqrt(effective_size) + 0.12 + 0.11 / math.sqrt(effective_size)) * statistic
+    if ks_lambda < 1e-3:
+        return statistic, 1.0
+    k = np.arange(1, 101)
+    p_value = 2 * np.sum((-1)**(k-1) * np.exp(-2 * k**2 * ks_lambda**2))
+
+    return statistic, float(min(max(p_value, 0), 1))
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Record reference outputs of the legacy engine, e.g.: python3 golden.py record
+# or check an engine against them, e.g.: python3 golden.py check --engine legacy (exits with code 1 if any check fails)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="golden.py", description="Record or check golden results of Monte Carlo "
+                                                                   "engines.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    record_parser = subparsers.add_parser("record", help="record reference outputs of the legacy engine")
+    record_parser.add_argument("--runs", type=int, default=GOLDEN_RUNS, help="Monte Carlo simulation runs")
+    record_parser.add_argument("--seed", type=int, default=GOLDEN_SEED, help="seed of the first set")
+
+    check_parser = subparsers.add_parser("check", help="check an engine against the reference outputs")
+    check_parser.add_argument("bioprocess_parameters", nargs="*", help="sets to check (default: all)")
+    check_parser.add_argument("--engine", default="legacy", choices=list(bioprocess.ENGINES))
+    options = parser.parse_args()
+
+    if options.command == "record":
+        record_golden(options.runs, options.seed)
+        sys.exit(0)
+
+    failures = check_engine(options.engine, options.bioprocess_parameters)
+    for bio_params_name, set_failures in failures.items():
+        print(f'[{bio_params_name}] {"PASSED" if not set_failures else "FAILED"}')
+        for failure in set_failures:
+            print(f'    {failure}')
+
+    sys.exit(1 if any(failures.values()) else 0)
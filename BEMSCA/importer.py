@@ -0,0 +1,245 @@
+import csv
+import json
+import math
+import sqlite3
+import sys
+import database
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+# Tables into which entries can be imported (in order of insertion, so references are always inserted first)
+IMPORT_TABLES = ["Expansion Simulations", "Recovery Simulations", "Expansion Replicates", "Recovery Replicates",
+                 "Bioprocess Parameters"]
+MAX_REPORTED_ERRORS = 20
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for reading entries from a JSON file (object with table names as keys and lists of entries as values,
+# or a list of entries of the given table) or from a CSV file (entries of the given table, one per line)
+def read_import_file(file_name, table=None):
+    if file_name.lower().endswith(".json"):
+        with open(file_name) as file:
+            contents = json.load(file)
+        if isinstance(contents, list):
+            contents = {table: contents}
+    else:
+        with open(file_name, newline='') as file:
+            contents = {table: list(csv.DictReader(file))}
+
+    if None in contents:
+        raise ValueError(f'Table of entries in "{file_name}" must be specified')
+
+    return contents
+
+
+# Function for converting an imported value to the type of its database column
+def convert_value(value, column_type):
+    if column_type == "text":
+        return str(value)
+    if isinstance(value, str):
+        value = float(value)
+    if not math.isfinite(value):
+        raise ValueError
+    if column_type == "integer":
+        if value != math.floor(value):
+            raise ValueError
+        return int(value)
+    return float(value)
+
+
+# Function for validating imported entries (and converting their values) before they are written to the database,
+# all invalid values and foreign references are reported together
+def validate_entries(cursor, entries):
+    errors = []
+    rows = {}
+
+    # Get names of existing entries of all tables
+    cursor.execute("SELECT Name FROM sqlite_master WHERE TYPE = 'table'")
+    names = {}
+    for table in [name[0] for name in cursor.fetchall()]:
+        cursor.execute(f'SELECT Name FROM "{table}"')
+        names[table] = {name[0] for name in cursor.fetchall()}
+
+    # Check that entries are only imported into bioprocess variables tables
+    for table in entries:
+        if table not in IMPORT_TABLES:
+            errors.append(f'Entries cannot be imported into table "{table}"')
+
+    # Check imported entries against the columns of their table and convert them to rows of values (tables are
+    # checked in order of insertion so that references to imported simulations are also validated)
+    for table in [table for table in IMPORT_TABLES if table in entries]:
+        cursor.execute(f'PRAGMA table_info("{table}")')
+        columns = [(info[1], info[2].lower()) for info in cursor.fetchall()]
+        column_names = [column for (column, column_type) in columns]
+
+        rows[table] = []
+        imported_names = set()
+        for i, entry in enumerate(entries[table]):
+            location = f'{table} entry {i+1} ("{entry.get("Name")}")'
+            unknown_columns = set(entry) - set(column_names)
+            if unknown_columns:
+                errors.append(f'{location}: unknown columns {sorted(unknown_columns)}')
+                continue
+
+            row = []
+            for (column, column_type) in columns:
+                try:
+                    row.append(convert_value(entry[column], column_type))
+                except KeyError:
+                    errors.append(f'{location}: missing column "{column}"')
+                except (TypeError, ValueError):
+                    errors.append(f'{location}: invalid {column_type} "{entry[column]}" in column "{column}"')
+            if len(row) != len(columns):
+                continue
+
+            entry = dict(zip(column_names, row))
+            if not entry["Name"]:
+                errors.append(f'{location}: missing name')
+            elif entry["Name"] in names[table] or entry["Name"] in imported_names:
+                errors.append(f'{location}: an entry with this name already exists')
+            imported_names.add(entry["Name"])
+
+            errors += [f'{location}: {error}' for error in validate_entry(table, entry, names)]
+            rows[table].append(row)
+
+        names[table] |= imported_names
+
+    return rows, errors
+
+
+# Function for validating the values and references of an imported entry
+def validate_entry(table, entry, names):
+    errors = []
+
+    if table == "Expansion Simulations":
+        if entry["Culture Medium"] not in names["Reagents"]:
+            errors.append(f'unknown Culture Medium "{entry["Culture Medium"]}"')
+        if entry["Supplements"] != "n/a":
+            for supplement in entry["Supplements"].split(";"):
+                if supplement not in names["Reagents"]:
+                    errors.append(f'unknown Supplement "{supplement}"')
+        for column in ["Seeding Density", "Fold Expansion AVG", "Experiment Sample Size", "Bioreactor Culture Time",
+                       "Bioreactor Volumes Spent"]:
+            if entry[column] <= 0:
+                errors.append(f'"{column}" must be positive')
+        if entry["Fold Expansion SEM"] < 0:
+            errors.append('"Fold Expansion SEM" must not be negative')
+
+    elif table == "Recovery Simulations":
+        if not 0 < entry["Recovery Efficiency AVG"] < 1:
+            errors.append('"Recovery Efficiency AVG" must be between 0 and 1')
+        elif entry["Recovery Efficiency SEM"] <= 0 or entry["Experiment Sample Size"] <= 0:
+            errors.append('"Recovery Efficiency SEM" and "Experiment Sample Size" must be positive')
+        else:
+            # Recovery efficiency must be representable by a beta distribution (see "bioprocess.py")
+            std = utils.sem_to_std(entry["Recovery Efficiency SEM"], entry["Experiment Sample Size"]) / 3
+            if min(utils.alpha_beta(entry["Recovery Efficiency AVG"], std)) <= 0:
+                errors.append('"Recovery Efficiency SEM" is too high for a beta distribution')
+
+    elif table == "Expansion Replicates":
+        if entry["Expansion Simulation"] not in names["Expansion Simulations"]:
+            errors.append(f'unknown Expansion Simulation "{entry["Expansion Simulation"]}"')
+        if entry["Fold Expansion"] <= 0:
+            errors.append('"Fold Expansion" must be positive')
+
+    elif table == "Recovery Replicates":
+        if entry["Recovery Simulation"] not in names["Recovery Simulations"]:
+            errors.append(f'unknown Recovery Simulation "{entry["Recovery Simulation"]}"')
+        if not 0 < entry["Recovery Efficiency"] <= 1:
+            errors.append('"Recovery Efficiency" must be greater than 0 and at most 1')
+
+    elif table == "Bioprocess Parameters":
+        if entry["2D Platform"] not in names["2D Platforms"]:
+            errors.append(f'unknown 2D Platform "{entry["2D Platform"]}"')
+        for bioreactor in entry["Bioreactors"].split(";"):
+            if bioreactor not in names["Bioreactors"]:
+                errors.append(f'unknown Bioreactor "{bioreactor}"')
+        for column in ["Coating Substrate", "Dissociation Enzyme"]:
+            if entry[column] not in names["Reagents"]:
+                errors.append(f'unknown {column} "{entry[column]}"')
+        for (column, table) in [("Expansion Simulation", "Expansion Simulations"),
+                                ("Recovery Simulation", "Recovery Simulations")]:
+            if entry[column] not in names[table]:
+                errors.append(f'unknown {column} "{entry[column]}"')
+        if not 0 < entry["Initial Cell Number"] < entry["Target Cell Number"]:
+            errors.append('"Target Cell Number" must be greater than a positive "Initial Cell Number"')
+        if not 0 < entry["Minimum Threshold"] < 1:
+            errors.append('"Minimum Threshold" must be between 0 and 1')
+
+    return errors
+
+
+# Function for importing entries into the database (all entries are validated first and inserted in a single
+# transaction, so either all entries are imported or none are)
+def import_entries(entries, database_file="database.db"):
+    # Connect to database
+    connection = sqlite3.connect(database_file)
+
+    # Create cursor
+    cursor = connection.cursor()
+
+    try:
+        # Validate and insert entries in a single explicit transaction, so that schema changes are also rolled back if
+        # any entry is invalid (sqlite3 does not open transactions implicitly before CREATE statements)
+        with connection:
+            cursor.execute('BEGIN')
+
+            # Create tables of replicate measurements in databases created before them
+            database.create_replicate_tables(cursor)
+
+            # Validate entries before anything is written to the database
+            (rows, errors) = validate_entries(cursor, entries)
+            if errors:
+                if len(errors) > MAX_REPORTED_ERRORS:
+                    errors = errors[:MAX_REPORTED_ERRORS] + [f'... and {len(errors) - MAX_REPORTED_ERRORS} more '
+                                                             f'errors']
+                raise ValueError('Invalid entries:\n' + '\n'.join(errors))
+
+            # Insert entries with batched inserts (committed only if all inserts succeed)
+            database.create_name_indexes(cursor)
+            for table in IMPORT_TABLES:
+                if rows.get(table):
+                    placeholders = ', '.join(['?'] * len(rows[table][0]))
+                    cursor.executemany(f'INSERT INTO "{table}" VALUES ({placeholders})', rows[table])
+
+    finally:
+        # Close database
+        connection.close()
+
+    return {table: len(rows[table]) for table in rows}
+
+
+# Function for importing entries from one or more files (see "read_import_file")
+def import_files(file_names, table=None, database_file="database.db"):
+    entries = {}
+    for file_name in file_names:
+        for (file_table, file_entries) in read_import_file(file_name, table).items():
+            entries.setdefault(file_table, []).extend(file_entries)
+
+    return import_entries(entries, database_file)
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Import files given as arguments, e.g.: python3 importer.py scenarios.json
+# (CSV files must be preceded by the name of their table, e.g.: python3 importer.py "Bioprocess Parameters" sets.csv)
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    table = None
+    if arguments and arguments[0] in IMPORT_TABLES:
+        table = arguments.pop(0)
+
+    try:
+        imported = import_files(arguments, table)
+    except ValueError as error:
+        print(error)
+        sys.exit(1)
+
+    for (table, number) in imported.items():
+        print(f'Imported {number} entries into "{table}"')
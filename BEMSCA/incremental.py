@@ -0,0 +1,185 @@
+import utils
+
+# Heavy modules only loaded when bioprocesses are first simulated (see "utils.lazy_import")
+bioprocess = utils.lazy_import("bioprocess")
+replicates = utils.lazy_import("replicates")
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+# Nodes of a bioprocess simulation (only the Monte Carlo node is expensive to recompute)
+DAILY_COSTS = "Daily Costs"
+PLANAR_EXPANSION = "Planar Expansion"
+MONTE_CARLO = "Monte Carlo"
+BIOREACTOR_WORKFLOW = "Bioreactor Workflow"
+BIOREACTOR_EXPANSION = "Bioreactor Expansion"
+BIOPROCESS = "Bioprocess"
+
+# Nodes which must be recomputed when a given node changes
+NODE_DEPENDENTS = {DAILY_COSTS: [PLANAR_EXPANSION, BIOREACTOR_EXPANSION],
+                   PLANAR_EXPANSION: [BIOPROCESS],
+                   MONTE_CARLO: [BIOREACTOR_WORKFLOW],
+                   BIOREACTOR_WORKFLOW: [BIOREACTOR_EXPANSION],
+                   BIOREACTOR_EXPANSION: [BIOPROCESS],
+                   BIOPROCESS: []}
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for determining which database cells ((table, entry, column) tuples) are used by each node
+# of the simulation of a given set of bioprocess parameters (see "bioprocess.py")
+def determine_dependencies(db_data, bio_params_name):
+    bio_params = db_data["Bioprocess Parameters"].loc[bio_params_name]
+    expansion_simulation = bio_params["Expansion Simulation"]
+    recovery_simulation = bio_params["Recovery Simulation"]
+    bioreactors = bio_params["Bioreactors"].split(";")
+    culture_medium = db_data["Expansion Simulations"].loc[expansion_simulation, "Culture Medium"]
+    supplements = db_data["Expansion Simulations"].loc[expansion_simulation, "Supplements"]
+
+    dependencies = {}
+
+    # Auxiliary function for registering the cells of a table used by a node
+    def add(node, table, entries, columns):
+        for entry in entries:
+            for column in columns:
+                dependencies.setdefault((table, entry, column), set()).add(node)
+
+    # <>------------------- Daily Costs -----------------<>
+    add(DAILY_COSTS, "Construction Costs", ["Standard Rooms", "Clean Rooms"], ["Area", "Cost"])
+    add(DAILY_COSTS, "Equipment", db_data["Equipment"].index,
+        ["Amount", "Acquisition Cost", "Energy Consumption", "Use Factor"])
+    add(DAILY_COSTS, "Facility Specifications",
+        ["Energy Cost", "Equipment Lifespan", "Facility Lifespan", "Parallel Processes"], ["Value"])
+    add(DAILY_COSTS, "Labor Costs", db_data["Labor Costs"].index, ["Number", "Salary"])
+    add(DAILY_COSTS, "Operating Costs", db_data["Operating Costs"].index, ["Cost"])
+
+    # <>---------------- Planar Expansion ---------------<>
+    add(PLANAR_EXPANSION, "Bioprocess Parameters", [bio_params_name],
+        ["2D Platform", "Coating Substrate", "Bioreactors", "Dissociation Enzyme", "Expansion Simulation"])
+    add(PLANAR_EXPANSION, "2D Platforms", [bio_params["2D Platform"]], db_data["2D Platforms"].columns)
+    add(PLANAR_EXPANSION, "Bioreactors", bioreactors, ["Min Volume"])
+    add(PLANAR_EXPANSION, "Expansion Simulations", [expansion_simulation], ["Culture Medium", "Seeding Density"])
+    add(PLANAR_EXPANSION, "Reagents", [bio_params["Coating Substrate"], "EDTA", culture_medium, bioprocess.ROCKI,
+                                       "DPBS", bio_params["Dissociation Enzyme"]], ["Cost"])
+
+    # <>------------------ Monte Carlo ------------------<>
+    add(MONTE_CARLO, "Bioprocess Parameters", [bio_params_name],
+        ["Target Cell Number", "Bioreactors", "Expansion Simulation", "Recovery Simulation", "Minimum Threshold"])
+    add(MONTE_CARLO, "Bioreactors", bioreactors, ["Min Volume"])
+    add(MONTE_CARLO, "Expansion Simulations", [expansion_simulation],
+        ["Seeding Density", "Fold Expansion AVG", "Fold Expansion SEM", "Experiment Sample Size"])
+    add(MONTE_CARLO, "Recovery Simulations", [recovery_simulation],
+        ["Recovery Efficiency AVG", "Recovery Efficiency SEM", "Experiment Sample Size"])
+    if bioprocess.PLANAR_MODE == "stochastic":
+        # Inoculated cells are simulated from the planar workflow (see "PlanarExpansion.simulate_planar_expansion")
+        add(MONTE_CARLO, "Bioprocess Parameters", [bio_params_name], ["2D Platform"])
+        add(MONTE_CARLO, "2D Platforms", [bio_params["2D Platform"]], ["Surface Confluency", "Confluency STD"])
+    if bioprocess.ENGINE == "empirical":
+        for (table, reference_column, column, _) in replicates.REPLICATE_TABLES.values():
+            # Replicate measurements of the Expansion and Recovery Simulations are only sampled by the empirical
+            # engine (see "replicates.get_measurements"), and any replicate may be reassigned to the simulations
+            if table in db_data:
+                replicate_table = db_data[table]
+                simulation = (expansion_simulation if reference_column == "Expansion Simulation"
+                              else recovery_simulation)
+                add(MONTE_CARLO, table, replicate_table.index, [reference_column])
+                add(MONTE_CARLO, table, replicate_table.index[replicate_table[reference_column] == simulation],
+                    [column])
+
+    # <>-------------- Bioreactor Workflow --------------<>
+    add(BIOREACTOR_WORKFLOW, "Bioreactors", bioreactors, ["Min Volume", "Max Volume"])
+
+    # <>-------------- Bioreactor Expansion -------------<>
+    add(BIOREACTOR_EXPANSION, "Bioprocess Parameters", [bio_params_name], ["Coating Substrate", "Dissociation Enzyme"])
+    add(BIOREACTOR_EXPANSION, "2D Platforms", ["12-well"], ["Cost", "Coating Volume", "Culture Volume"])
+    add(BIOREACTOR_EXPANSION, "Antibodies", set(bioprocess.INT_FC_ANTIBODIES + bioprocess.SUR_FC_ANTIBODIES
+                                                + bioprocess.INT_IMMUNO_ANTIBODIES + bioprocess.SUR_IMMUNO_ANTIBODIES),
+        ["Cost"])
+    add(BIOREACTOR_EXPANSION, "Bioreactors", bioreactors,
+        ["Max Volume", "Acquisition Cost", "Use Cost", "Energy Consumption"])
+    add(BIOREACTOR_EXPANSION, "Expansion Simulations", [expansion_simulation],
+        ["Culture Medium", "Supplements", "Bioreactor Culture Time", "Bioreactor Volumes Spent"])
+    add(BIOREACTOR_EXPANSION, "Facility Specifications", ["Energy Cost", "Equipment Lifespan"], ["Value"])
+    add(BIOREACTOR_EXPANSION, "Quality Controls", db_data["Quality Controls"].index, ["Cost"])
+    reagents = [bio_params["Coating Substrate"], bio_params["Dissociation Enzyme"], culture_medium, bioprocess.ROCKI]
+    if supplements != "n/a":
+        reagents += supplements.split(";")
+    add(BIOREACTOR_EXPANSION, "Reagents", reagents, ["Cost"])
+
+    return dependencies
+
+
+# Function for determining all nodes affected by a change to the given nodes (including themselves)
+def determine_affected_nodes(nodes):
+    affected_nodes = set()
+    pending_nodes = list(nodes)
+    while pending_nodes:
+        node = pending_nodes.pop()
+        if node not in affected_nodes:
+            affected_nodes.add(node)
+            pending_nodes += NODE_DEPENDENTS[node]
+
+    return affected_nodes
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for caching simulation results and recomputing them incrementally when database values change
+class IncrementalResults():
+    # Initializer of class object
+    def __init__(self, db_data):
+        # <>---------- Important Object Attributes ----------<>
+        self.db_data = db_data
+
+        # Cached simulation results and database cell dependencies of each set of bioprocess parameters
+        self.results = {}
+        self.dependencies = {}
+
+
+    # Function for obtaining the simulation results of a set of bioprocess parameters (simulated only once, the
+    # progress of the simulation can be followed through a progress function, see "bioprocess.report_progress")
+    def simulate(self, bio_params_name, progress=None):
+        if bio_params_name not in self.results:
+            self.recompute(bio_params_name, determine_affected_nodes([DAILY_COSTS, PLANAR_EXPANSION, MONTE_CARLO]),
+                           progress)
+
+        return self.results[bio_params_name]
+
+
+    # Function for recomputing the affected nodes of the simulation of a set of bioprocess parameters
+    def recompute(self, bio_params_name, affected_nodes, progress=None):
+        bio_params = self.db_data["Bioprocess Parameters"].loc[[bio_params_name]]
+
+        # Reuse the cached Monte Carlo simulation unless it was affected (all other nodes are deterministic and
+        # are recomputed in milliseconds)
+        monte_carlo = None
+        if MONTE_CARLO not in affected_nodes:
+            monte_carlo = self.results[bio_params_name].bioreactor_expansion.monte_carlo
+
+        self.results[bio_params_name] = bioprocess.Bioprocess(self.db_data, bio_params, monte_carlo, progress)
+
+        # Update dependencies (foreign references of the bioprocess parameters may have changed)
+        self.dependencies[bio_params_name] = determine_dependencies(self.db_data, bio_params_name)
+
+
+    # Function for changing a database value and recomputing the affected nodes of every cached simulation
+    def update_value(self, table, name, column, value, persist=False):
+        # Determine affected nodes of each cached simulation before the value is changed
+        affected = {}
+        for bio_params_name, dependencies in self.dependencies.items():
+            if (table, name, column) in dependencies:
+                affected[bio_params_name] = determine_affected_nodes(dependencies[(table, name, column)])
+
+        # Update value in loaded database data (and in the database itself, if requested)
+        self.db_data[table].at[name, column] = value
+        if persist:
+            utils.update_database_value(table, name, column, value)
+
+        # Recompute affected nodes
+        for bio_params_name, affected_nodes in affected.items():
+            self.recompute(bio_params_name, affected_nodes)
+
+        return affected
@@ -0,0 +1,210 @@
+import time
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+PROFILE_FUNCTIONS = 25 # functions with the highest cumulative time included in reports
+
+# State of the instrumentation of this process (disabled by default, see "enable"). The profiling and memory tracing
+# modules are only imported once they are used, so importing this module does not slow down BEMSCA's startup
+enabled = False
+spans = {} # name -> [calls, total time (s)]
+counters = {} # name -> count
+profiler = None # cProfile profiler, if profiling
+tracing_memory = False
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for timing a named span of code in a "with" statement (the time of each span is added to all
+# previous spans with the same name)
+class Span():
+    __slots__ = ("name", "start")
+
+    # Initializer of class object
+    def __init__(self, name):
+        # <>---------- Important Object Attributes ----------<>
+        self.name = name
+        self.start = None
+
+
+    # Functions for timing the span in a "with" statement
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exception_type, exception, traceback):
+        span_time = time.perf_counter() - self.start
+        if self.name in spans:
+            spans[self.name][0] += 1
+            spans[self.name][1] += span_time
+        else:
+            spans[self.name] = [1, span_time]
+
+
+# Define class for a span which does nothing (used while instrumentation is disabled, so spans cost almost nothing)
+class NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exception_type, exception, traceback):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for enabling instrumentation, optionally profiling function calls (cProfile) and tracing the peak memory
+# allocated by Python (tracemalloc), both of which slow down the instrumented code. Previous measurements are reset
+def enable(profile=False, trace_memory=False):
+    global enabled, tracing_memory
+    disable()
+    enabled = True
+    tracing_memory = trace_memory
+    reset(profile)
+
+
+# Function for disabling instrumentation (measurements are kept until instrumentation is enabled or reset again)
+def disable():
+    global enabled, profiler, tracing_memory
+    enabled = False
+    if profiler is not None:
+        profiler.disable()
+    if tracing_memory:
+        import tracemalloc
+        tracemalloc.stop()
+    tracing_memory = False
+
+
+# Function for resetting all measurements (e.g., before each run), restarting the profiler and memory tracing if
+# they were enabled (profiling can also be enabled or disabled by giving "profile")
+def reset(profile=None):
+    global profiler
+    spans.clear()
+    counters.clear()
+
+    if profile is None:
+        profile = profiler is not None
+    if profiler is not None:
+        profiler.disable()
+    profiler = None
+    if enabled and profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if enabled and tracing_memory:
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+        else:
+            tracemalloc.start()
+
+
+# Function for timing a named span of code, e.g.: with instrumentation.span("Cycle Search"): ...
+def span(name):
+    if not enabled:
+        return NULL_SPAN
+    return Span(name)
+
+
+# Function for adding an amount to a named counter (e.g., Monte Carlo samples drawn or cache hits)
+def count(name, amount=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + amount
+
+
+# Function for building a structured report of the current measurements (dictionary of plain values): the calls and
+# total time (s) of each span, the value of each counter, the peak memory allocated by Python (MB, if traced) and the
+# functions with the highest cumulative time (if profiled)
+def report():
+    instrumentation_report = {"Spans": {name: {"Calls": calls, "Time": span_time}
+                                        for name, (calls, span_time) in spans.items()},
+                              "Counters": dict(counters), "Peak Memory": None, "Profile": None}
+
+    if tracing_memory:
+        import tracemalloc
+        instrumentation_report["Peak Memory"] = tracemalloc.get_traced_memory()[1] / 1e6
+
+    if profiler is not None:
+        import pstats
+        profiler.disable()
+        stats = pstats.Stats(profiler).stats
+        profiler.enable()
+        functions = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:PROFILE_FUNCTIONS]
+        instrumentation_report["Profile"] = [{"Function": f'{file_name}:{line}({function})', "Calls": calls,
+                                              "Total Time": total_time, "Cumulative Time": cumulative_time}
+                                             for ((file_name, line, function),
+                                                  (primitive_calls, calls, total_time, cumulative_time, callers))
+                                             in functions]
+
+    return instrumentation_report
+
+
+# Function for aggregating the reports of several runs (e.g., the tasks of a sweep) into a single report. Spans,
+# counters and profiled functions are summed, while the peak memory is the highest peak of all runs
+def aggregate(reports):
+    aggregated_report = {"Runs": 0, "Spans": {}, "Counters": {}, "Peak Memory": None, "Profile": None}
+    profile = {}
+    for run_report in reports:
+        aggregated_report["Runs"] += run_report.get("Runs", 1)
+
+        for name, span_report in run_report["Spans"].items():
+            aggregated_span = aggregated_report["Spans"].setdefault(name, {"Calls": 0, "Time": 0})
+            aggregated_span["Calls"] += span_report["Calls"]
+            aggregated_span["Time"] += span_report["Time"]
+
+        for name, value in run_report["Counters"].items():
+            aggregated_report["Counters"][name] = aggregated_report["Counters"].get(name, 0) + value
+
+        if run_report["Peak Memory"] is not None:
+            aggregated_report["Peak Memory"] = max(aggregated_report["Peak Memory"] or 0, run_report["Peak Memory"])
+
+        for function_report in run_report["Profile"] or []:
+            aggregated_function = profile.setdefault(function_report["Function"],
+                                                     {"Function": function_report["Function"], "Calls": 0,
+                                                      "Total Time": 0, "Cumulative Time": 0})
+            for key in ["Calls", "Total Time", "Cumulative Time"]:
+                aggregated_function[key] += function_report[key]
+
+    if profile:
+        aggregated_report["Profile"] = sorted(profile.values(), key=lambda function: function["Cumulative Time"],
+                                              reverse=True)[:PROFILE_FUNCTIONS]
+
+    return aggregated_report
+
+
+# Function for formatting a report as text (spans sorted by total time)
+def format_report(instrumentation_report):
+    lines = []
+    if "Runs" in instrumentation_report:
+        lines.append(f'INSTRUMENTATION ({instrumentation_report["Runs"]} runs):')
+    else:
+        lines.append('INSTRUMENTATION:')
+
+    for name, span_report in sorted(instrumentation_report["Spans"].items(), key=lambda item: item[1]["Time"],
+                                    reverse=True):
+        lines.append(f'  {name:<40} {span_report["Time"]:>10.4f} s  ({span_report["Calls"]} calls)')
+
+    for name, value in instrumentation_report["Counters"].items():
+        lines.append(f'  {name:<40} {value:>12,}')
+
+    if instrumentation_report["Peak Memory"] is not None:
+        lines.append(f'  {"Peak Memory":<40} {instrumentation_report["Peak Memory"]:>10.1f} MB')
+
+    if instrumentation_report["Profile"]:
+        lines.append('  PROFILE (cumulative time):')
+        for function_report in instrumentation_report["Profile"]:
+            lines.append(f'    {function_report["Cumulative Time"]:>10.4f} s  {function_report["Calls"]:>10,}  '
+                         f'{function_report["Function"]}')
+
+    return '\n'.join(lines)
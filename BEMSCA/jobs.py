@@ -0,0 +1,214 @@
+import queue
+import threading
+import time
+import utils
+
+# Heavy modules only loaded when a job is first run (see "utils.lazy_import")
+bioprocess = utils.lazy_import("bioprocess")
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+PROGRESS_INTERVAL = 0.5 # s (time between progress updates presented in the terminal)
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define exception raised at a progress checkpoint of a cancelled job (stops the running simulation)
+class JobCancelled(Exception):
+    pass
+
+
+# Define class for a job which simulates one or more sets of bioprocess parameters in the background. The job
+# follows the progress of each Monte Carlo simulation (see "bioprocess.report_progress") and can be cancelled
+# at any progress checkpoint, keeping the results of the simulations completed until then
+class Job():
+    # Initializer of class object
+    def __init__(self, db_data, bio_params_names, simulate=None, listener=None, engine=None):
+        # <>---------- Important Object Attributes ----------<>
+        self.db_data = db_data
+        self.bio_params_names = list(bio_params_names)
+
+        # Monte Carlo engine of sets simulated anew (see "bioprocess.ENGINES"), by default "bioprocess.ENGINE"
+        self.engine = engine
+
+        # Function used to simulate each set of bioprocess parameters, called with its name and a progress function
+        # (e.g., "incremental.IncrementalResults.simulate", so results are cached), else each set is simulated anew
+        self.simulate = simulate or self.simulate_bioprocess
+
+        # Function called with the job and each progress event, if any (called from the job's thread)
+        self.listener = listener
+
+        # State of the job ("pending", "running", "completed", "cancelled" or "failed")
+        self.status = "pending"
+        self.error = None
+        self.done = threading.Event()
+        self.cancel_requested = threading.Event()
+
+        # Results of completed simulations and partial results of a cancelled simulation (a bioprocess simulated
+        # with the last fold increase cap accepted before cancellation, if the cap search had already started)
+        self.results = {}
+        self.partial_results = {}
+
+        # Last progress event and progress counters (used to estimate the remaining time)
+        self.progress = None
+        self.start_time = None
+        self.completed_chunks = 0
+
+
+    # Function for simulating a set of bioprocess parameters (when no other simulation function is given)
+    def simulate_bioprocess(self, bio_params_name, progress):
+        return bioprocess.Bioprocess(self.db_data, self.db_data["Bioprocess Parameters"].loc[[bio_params_name]],
+                                     progress=progress, engine=self.engine)
+
+
+    # Function for running the job (in the job queue's thread)
+    def run(self):
+        self.status = "running"
+        self.start_time = time.perf_counter()
+        try:
+            for index, bio_params_name in enumerate(self.bio_params_names):
+                try:
+                    self.results[bio_params_name] = self.simulate(
+                        bio_params_name, lambda event: self.report_progress(index, bio_params_name, event))
+                except JobCancelled:
+                    # Complete the deterministic part of the simulation with the partial Monte Carlo results
+                    monte_carlo = self.progress["Monte Carlo"] if self.progress is not None else None
+                    if monte_carlo is not None and self.progress["Bioprocess Parameters"] == bio_params_name:
+                        self.partial_results[bio_params_name] = bioprocess.Bioprocess(
+                            self.db_data, self.db_data["Bioprocess Parameters"].loc[[bio_params_name]], monte_carlo)
+                    self.status = "cancelled"
+                    return
+
+            self.status = "completed"
+
+        except Exception as error:
+            self.status = "failed"
+            self.error = error
+
+        finally:
+            self.done.set()
+
+
+    # Function for reporting a progress event of the simulation of a set of bioprocess parameters (raises
+    # "JobCancelled" if the job was cancelled, stopping the simulation at this checkpoint)
+    def report_progress(self, index, bio_params_name, event):
+        if self.cancel_requested.is_set():
+            raise JobCancelled()
+
+        event["Bioprocess Parameters"] = bio_params_name
+        event["Completed Sets"] = index
+        event["Sets"] = len(self.bio_params_names)
+
+        # Count completed chunks of simulation runs (a checkpoint takes place at the start of each chunk, so every
+        # checkpoint but the first follows a completed chunk)
+        if self.progress is not None:
+            self.completed_chunks += 1
+        event["Completed Chunks"] = self.completed_chunks
+
+        event["ETA"] = self.estimate_remaining_time(event)
+        self.progress = event
+
+        if self.listener is not None:
+            self.listener(self, event)
+
+
+    # Function for estimating the remaining time of the job (s), based on the average time of each chunk of
+    # simulation runs. An upper bound is estimated once the fold increase cap search of a set starts (assuming all
+    # caps are tested, and that other sets require as many chunks), no estimate is made before that (None)
+    def estimate_remaining_time(self, event):
+        if event["Max Cap Steps"] is None or self.completed_chunks == 0:
+            return None
+
+        chunk_time = (time.perf_counter() - self.start_time) / self.completed_chunks
+        chunks_per_step = event["Simulation Runs"] / event["Chunk Runs"]
+        remaining_chunks = ((event["Max Cap Steps"] - event["Cap Step"]) * chunks_per_step
+                            - event["Runs"] / event["Chunk Runs"])
+        remaining_sets = event["Sets"] - event["Completed Sets"] - 1
+        set_chunks = (event["Required Cycles"] + event["Max Cap Steps"]) * chunks_per_step
+
+        return (remaining_chunks + remaining_sets * set_chunks) * chunk_time
+
+
+    # Function for requesting the cancellation of the job (the running simulation stops at its next checkpoint)
+    def cancel(self):
+        self.cancel_requested.set()
+        if self.status == "pending":
+            self.status = "cancelled"
+            self.done.set()
+
+
+    # Function for waiting until the job is done (or the timeout, in s, elapses), returns whether it is done
+    def wait(self, timeout=None):
+        return self.done.wait(timeout)
+
+
+# Define class for running jobs one at a time in a background thread, in order of submission
+class JobQueue():
+    # Initializer of class object
+    def __init__(self):
+        # <>---------- Important Object Attributes ----------<>
+        self.jobs = queue.Queue()
+
+        # <>------------------- Main Body -------------------<>
+        # Start background thread (daemon, so it does not keep BEMSCA running once the input loop ends)
+        self.thread = threading.Thread(target=self.run_jobs, daemon=True)
+        self.thread.start()
+
+
+    # Function for submitting a job, returns the job
+    def submit(self, job):
+        self.jobs.put(job)
+        return job
+
+
+    # Function for running submitted jobs (skipping those cancelled before they started)
+    def run_jobs(self):
+        while True:
+            job = self.jobs.get()
+            if job.status == "pending":
+                job.run()
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for formatting a progress event as a single line of text
+def format_progress(event):
+    if event["Stage"] == "Required Cycles":
+        stage = f'testing {event["Required Cycles"]} cycles'
+    else:
+        stage = f'{event["Required Cycles"]} cycles, cap step {event["Cap Step"] + 1}/{event["Max Cap Steps"]}'
+
+    eta = "estimating" if event["ETA"] is None else f'{event["ETA"]:.0f} s'
+
+    return (f'[{event["Bioprocess Parameters"]}] ({event["Completed Sets"] + 1}/{event["Sets"]}) {stage}, '
+            f'runs {event["Runs"]:,}/{event["Simulation Runs"]:,} (chunks done: {event["Completed Chunks"]}, '
+            f'ETA: {eta})')
+
+
+# Function for running a job while presenting its progress in the terminal, returns the job once it is done.
+# The job is cancelled if the user presses Ctrl+C, keeping the results completed until then
+def run_with_progress(job_queue, job):
+    job_queue.submit(job)
+    line_length = 0
+    try:
+        while not job.wait(PROGRESS_INTERVAL):
+            if job.progress is not None:
+                line = format_progress(job.progress)
+                print(f'\r{line:<{line_length}}', end='', flush=True)
+                line_length = len(line)
+    except KeyboardInterrupt:
+        job.cancel()
+        job.wait()
+
+    if line_length:
+        print()
+
+    # Raise errors of failed jobs as if the simulations ran in the foreground
+    if job.status == "failed":
+        raise job.error
+
+    return job
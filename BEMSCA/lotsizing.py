@@ -0,0 +1,102 @@
+import argparse
+import math
+import time
+import numpy.random as nprand
+import bioprocess
+import export
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+MAX_BATCHES = 10 # largest number of batches the annual cell output is split into (if not given)
+LOT_SIZING_ENGINE = "cached" # Monte Carlo engine of the analysis (variates are reused by every number of batches)
+CELLS_UNIT = 1e9 # costs are given per billion cells
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for analyzing the split of an annual cell output into 1 to "max_batches" batches of a set of bioprocess
+# parameters (scale-out, each batch targeting an equal share of the output, versus scale-up, a single larger batch),
+# returns a record for each number of batches. Batches are run in waves of up to "Parallel Processes" batches at a
+# time, so the campaign lasts as many batch durations as waves. Costs are given per CELLS_UNIT cells, both with the
+# facility and labor costs shared by parallel processes (as in "bioprocess.Bioprocess", i.e. idle parallel processes
+# are used by other campaigns) and with the whole facility dedicated to the campaign (idle parallel processes of the
+# last wave are also paid). Every number of batches is simulated with the cached Monte Carlo engine, so the fold
+# increase variates of each cycle are drawn once and shared by all batch sizes (which also makes differences between
+# batch sizes free of Monte Carlo noise), and each search is warm-started from the solution of the previous size
+def analyze_lot_sizes(db_data, bio_params_name, annual_cells, max_batches=MAX_BATCHES, seed=None,
+                      engine=LOT_SIZING_ENGINE):
+    parallel_processes = int(db_data["Facility Specifications"].loc["Parallel Processes"].item())
+    default_engine = bioprocess.ENGINE
+    bioprocess.ENGINE = engine
+    if seed is not None:
+        nprand.seed(seed)
+
+    records = []
+    hint = None
+    try:
+        for batches in range(1, max_batches + 1):
+            bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]].copy()
+            bio_params["Target Cell Number"] = annual_cells / batches
+            simulation_results = bioprocess.Bioprocess(db_data, bio_params, hint=hint)
+            hint = simulation_results.bioreactor_expansion.monte_carlo[:2]
+
+            waves = math.ceil(batches / parallel_processes)
+            campaign_cost = batches * simulation_results.bioprocess_overall_cost
+            # Dedicated facility pays the daily facility and labor costs of every parallel process (rather than of
+            # the batches only) for the whole campaign
+            d_shared_cost = simulation_results.d_facility_cost + simulation_results.d_labor_cost
+            dedicated_cost = (campaign_cost + d_shared_cost * simulation_results.bioprocess_duration
+                              * (parallel_processes * waves - batches))
+
+            records.append({"Batches": batches, "Batch Target Cell Number": annual_cells / batches,
+                            "Required Cycles": int(simulation_results.bioreactor_expansion.monte_carlo[0]),
+                            "Batch Duration": int(simulation_results.bioprocess_duration),
+                            "Waves": waves, "Campaign Duration": int(waves * simulation_results.bioprocess_duration),
+                            "Batch Cost": float(simulation_results.bioprocess_overall_cost),
+                            "Campaign Cost": float(campaign_cost),
+                            "Cost per Billion Cells": float(campaign_cost / annual_cells * CELLS_UNIT),
+                            "Dedicated Cost per Billion Cells": float(dedicated_cost / annual_cells * CELLS_UNIT),
+                            "Confidence Level": float(simulation_results.confidence_level)})
+    finally:
+        bioprocess.ENGINE = default_engine
+
+    return records
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Analyze the split of an annual cell output of a set of bioprocess parameters into batches, optionally exporting
+# the analysis to a JSON Lines, CSV or Parquet file, e.g.: python3 lotsizing.py "Default" 2e10 --export lots.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="lotsizing.py", description="Compare splitting an annual cell output into "
+                                                                      "one or more parallel batches.")
+    parser.add_argument("bioprocess_parameters", help="set of bioprocess parameters")
+    parser.add_argument("annual_cells", type=float, help="annual cell output")
+    parser.add_argument("--max-batches", type=int, default=MAX_BATCHES, help="largest number of batches")
+    parser.add_argument("--seed", type=int, help="seed of the random draws")
+    parser.add_argument("--engine", default=LOT_SIZING_ENGINE, choices=list(bioprocess.ENGINES),
+                        help="Monte Carlo engine")
+    parser.add_argument("--export", help="JSON Lines, CSV or Parquet file")
+    options = parser.parse_args()
+
+    start_time = time.perf_counter()
+    records = analyze_lot_sizes(utils.get_database_data(), options.bioprocess_parameters, options.annual_cells,
+                                options.max_batches, options.seed, options.engine)
+
+    print(f'{"Batches":>7} {"Cells/Batch":>12} {"Cycles":>6} {"Waves":>5} {"Duration":>8} {"€/1e9 Cells":>12} '
+          f'{"Dedicated":>12} {"Confidence":>10}')
+    for record in records:
+        print(f'{record["Batches"]:>7} {record["Batch Target Cell Number"]:>12.3g} {record["Required Cycles"]:>6} '
+              f'{record["Waves"]:>5} {record["Campaign Duration"]:>6} d {record["Cost per Billion Cells"]:>12,.2f} '
+              f'{record["Dedicated Cost per Billion Cells"]:>12,.2f} {record["Confidence Level"]:>9.1f}%')
+    print(f'\nAnalysis completed in {time.perf_counter() - start_time:.1f} s')
+
+    if options.export:
+        with export.RecordWriter(options.export) as writer:
+            for record in records:
+                writer.write(record)
@@ -1,8 +1,16 @@
 import os
+import sys
 import database
+import importer
 import utils
-import bioprocess
-import outputs
+import incremental
+import jobs
+import warehouse
+
+# Heavy modules only loaded by the commands that use them (see "utils.lazy_import")
+batch = utils.lazy_import("batch")
+outputs = utils.lazy_import("outputs")
+sweep = utils.lazy_import("sweep")
 
 # -----------------------------------------------------------------------------
 #    FUNCTIONS
@@ -60,19 +68,132 @@ def compare_command():
     # Define output customization array
     output_customization = [base_case_index, study_name, color_palette, labels]
 
-    # Simulate bioprocess using each set of bioprocess parameters
+    # Ask user whether the sets of bioprocess parameters should share their random draws (common random numbers), so
+    # differences from the base-case are estimated with much less Monte Carlo noise
+    print('\nUse common random numbers for a paired comparison (y/n)?')
+    common = input('\n>>> ')
+    while common.lower() not in ['y', 'n']:
+        print('\nInvalid input. Please type "y" or "n":')
+        common = input('\n>>> ')
+
+    # Simulate bioprocess using each set of bioprocess parameters in the background, presenting its progress
+    # (previously simulated results are reused, and completed simulations are kept if the comparison is cancelled).
+    # Paired comparisons are always simulated anew, with the common random numbers engine (and are not kept)
+    if common.lower() == 'y':
+        job = jobs.Job(database_data, selection, engine="common")
+    else:
+        job = jobs.Job(database_data, selection, simulation_cache.simulate)
+    job = jobs.run_with_progress(job_queue, job)
+    if job.status == "cancelled":
+        if common.lower() == 'y':
+            print('\nComparison study cancelled.')
+        else:
+            print(f'\nComparison study cancelled. Completed simulations ({list(job.results)}) will be reused.')
+        return
+
     simulation_results = []
     for sets in selection:
-        simulation_results.append(bioprocess.Bioprocess(database_data, database_data["Bioprocess Parameters"].loc[[sets]]))
+        simulation_results.append(job.results[sets])
+
+    # Store results of each simulation in the results warehouse
+    for sets, results in zip(selection, simulation_results):
+        store_results(sets, results)
 
     # Present outputs of comparison study
     outputs.compare_output(database_data, selection, simulation_results, output_customization)
 
 
+# Function for executing tasks related to "edit" command
+def edit_command():
+    # Ask user which table, entry and column should be edited (accept only valid input)
+    print('\nSelect table from the list below:\n')
+    print(list(database_data.keys()))
+    table = input('\n>>> ')
+    while table not in database_data:
+        print('\nInvalid input. Please select table from the list above (case sensitive):')
+        table = input('\n>>> ')
+
+    print('\nSelect entry from the list below:\n')
+    print(database_data[table].index.tolist())
+    name = input('\n>>> ')
+    while name not in database_data[table].index.tolist():
+        print('\nInvalid input. Please select entry from the list above (case sensitive):')
+        name = input('\n>>> ')
+
+    print('\nSelect column from the list below:\n')
+    print(database_data[table].columns.tolist())
+    column = input('\n>>> ')
+    while column not in database_data[table].columns.tolist():
+        print('\nInvalid input. Please select column from the list above (case sensitive):')
+        column = input('\n>>> ')
+
+    # Ask user for the new value (converted to the type of the current value)
+    print(f'\nDefine new value (current value: {database_data[table].loc[name, column]}):')
+    value = input('\n>>> ')
+    while not isinstance(database_data[table].loc[name, column], str):
+        try:
+            value = float(value)
+            break
+        except ValueError:
+            print('\nInvalid input. Please define a numeric value:')
+            value = input('\n>>> ')
+
+    # Update value and recompute only the affected nodes of previously simulated bioprocesses
+    affected = simulation_cache.update_value(table, name, column, value, persist=True)
+
+    # Present (and store) updated outputs of affected bioprocesses
+    for bio_params_name, affected_nodes in affected.items():
+        print(f'\nRecomputed {sorted(affected_nodes)} of [{bio_params_name}]')
+        store_results(bio_params_name, simulation_cache.simulate(bio_params_name))
+        outputs.simulate_output(database_data, bio_params_name, simulation_cache.simulate(bio_params_name))
+
+
+# Function for executing tasks related to "import" command
+def import_command():
+    # Ask user which files should be imported (JSON files, or CSV files of a single table)
+    print('\nDefine files to be imported (type them in one at a time, then type "Done"):')
+    file_names = []
+    file_name = input('\n>>> ')
+    while file_name.capitalize() != 'Done':
+        if not os.path.exists(file_name):
+            print('\nInvalid input. File does not exist:')
+        else:
+            file_names.append(file_name)
+        file_name = input('\n>>> ')
+
+    # Ask user which table the entries of CSV files belong to
+    table = None
+    if any(not file_name.lower().endswith('.json') for file_name in file_names):
+        print('\nSelect table of the entries in CSV files from the list below:\n')
+        print(importer.IMPORT_TABLES)
+        table = input('\n>>> ')
+        while table not in importer.IMPORT_TABLES:
+            print('\nInvalid input. Please select table from the list above (case sensitive):')
+            table = input('\n>>> ')
+
+    # Validate and import all entries (nothing is imported if any entry is invalid)
+    try:
+        imported = importer.import_files(file_names, table)
+    except ValueError as error:
+        print(f'\n{error}')
+        return
+
+    for (table, number) in imported.items():
+        print(f'\nImported {number} entries into "{table}"')
+
+    # Reload database data so imported entries are available (previously simulated results remain valid)
+    database_data.update(utils.get_database_data())
+
+
 # Function for executing tasks related to "help" command
 def help_command():
     print('\nTo simulate a specific set of bioprocess parameters type "Simulate".')
     print('To execute a comparison study with more than one set of bioprocess parameters type "Compare".')
+    print('To change a database value (updating previous simulations) type "Edit".')
+    print('To import bioprocess parameters and simulations from JSON or CSV files type "Import".')
+    print('To run a parameter sweep described by a sweep file type "Sweep".')
+    print('Running simulations can be cancelled by pressing Ctrl+C (completed simulations are kept, except those of '
+          'paired comparisons).')
     print('To terminate BEMSCA type "Quit".')
 
 
@@ -86,41 +207,112 @@ def simulate_command():
         print('\nInvalid input. Please select preset bioprocess parameters from the list below (case sensitive):')
         set = input('\n>>> ')
 
-    # Simulate bioprocess using the selected preset bioprocess parameters
-    simulation_results = bioprocess.Bioprocess(database_data, database_data["Bioprocess Parameters"].loc[[set]])
+    # Simulate bioprocess using the selected preset bioprocess parameters in the background, presenting its progress
+    job = jobs.run_with_progress(job_queue, jobs.Job(database_data, [set], simulation_cache.simulate))
+
+    # Present partial outputs if the simulation was cancelled during the fold increase cap search (these are
+    # neither cached nor stored, as the medium volume of each cycle was not fully optimized)
+    if job.status == "cancelled":
+        if set in job.partial_results:
+            print(f'\nSimulation cancelled. Presenting partial results (fold increase cap search stopped at step '
+                  f'{job.progress["Cap Step"]}):')
+            outputs.simulate_output(database_data, set, job.partial_results[set])
+        else:
+            print('\nSimulation cancelled before any partial results were obtained.')
+        return
+
+    simulation_results = job.results[set]
+
+    # Store results of simulation in the results warehouse
+    store_results(set, simulation_results)
 
     # Present outputs of simulated bioprocess
     outputs.simulate_output(database_data, set, simulation_results)
 
 
+# Function for executing tasks related to "sweep" command
+def sweep_command():
+    # Ask user which sweep file should be run (accept only existing files)
+    print('\nDefine sweep file:')
+    file_name = input('\n>>> ')
+    while not os.path.exists(file_name):
+        print('\nInvalid input. File does not exist:')
+        file_name = input('\n>>> ')
+
+    # Run sweep on a pool of worker processes, presenting results as they are completed
+    (sweep_name, bio_params_names, axes, seed, workers) = sweep.read_sweep_file(file_name)
+    n_tasks = len(sweep.build_tasks(bio_params_names, axes, seed))
+    print(f'\nRunning sweep "{sweep_name}" ({n_tasks} tasks, completed tasks are skipped):\n')
+    for record in sweep.run_sweep(sweep_name, bio_params_names, axes, seed, workers):
+        print(f'[{record["Name"]}] {record["Overrides"]} -> {record["Overall Cost"]:,.2f} € '
+              f'({record["Confidence Level"]:.1f}%)')
+
+    for record in sweep.read_sweep_results(sweep_name, failed=True):
+        print(f'[{record["Name"]}] {record["Overrides"]} failed: {record["Error"]}')
+
+    print(f'\nSweep results saved to "{sweep.SWEEP_DIRECTORY}/{sweep_name}.jsonl"')
+
+
+# Function for storing simulation results in the results warehouse (each simulation is only stored once)
+def store_results(bio_params_name, simulation_results):
+    if stored_results.get(bio_params_name) is not simulation_results:
+        results_warehouse.store(database_data, bio_params_name, simulation_results)
+        stored_results[bio_params_name] = simulation_results
+
+
 # -----------------------------------------------------------------------------
 #    INPUT LOOP
 # -----------------------------------------------------------------------------
-# Check if database exists and is accessible, if it does not initialize it
-if not os.path.exists("database.db"):
-    database.initialize_database()
-
-# Load stored database data so BEMSCA has access to it (stored in pandas dataframes)
-database_data = utils.get_database_data()
-
-# Initialize variable to store user command
-command = ''
-
-# Print welcome message
-print('\n<>------------------------------------------------------------------------------------------------------<>')
-print('  Welcome to BEMSCA. For a list of available commands, type "help". Alternatively, type desired command.  ')
-print('<>------------------------------------------------------------------------------------------------------<>')
-
-# Start input loop (terminate when 'quit' command is received)
-while command != 'Quit':
-
-    command = input('\n>>> ').capitalize()
-
-    if command == 'Compare':
-        compare_command()
-    elif command == 'Help':
-        help_command()
-    elif command == 'Simulate':
-        simulate_command()
-    elif command != 'Quit':
-        print('\nInvalid command.')
\ No newline at end of file
+# Run BEMSCA only when this file is executed (not when it is imported, e.g. by worker processes)
+if __name__ == "__main__":
+    # Check if database exists and is accessible, if it does not initialize it
+    if not os.path.exists("database.db"):
+        database.initialize_database()
+
+    # Run headless batch jobs if command line arguments were given instead of starting the input loop
+    # (see "batch.py")
+    if len(sys.argv) > 1:
+        sys.exit(batch.main(sys.argv[1:]))
+
+    # Access stored database data so BEMSCA has access to it (stored in pandas dataframes, each table is only
+    # loaded when it is first used)
+    database_data = utils.DatabaseData()
+
+    # Initialize cache of simulation results (recomputed incrementally when database values are edited)
+    simulation_cache = incremental.IncrementalResults(database_data)
+
+    # Start job queue (simulations run in the background, so their progress is presented and they can be cancelled
+    # by pressing Ctrl+C)
+    job_queue = jobs.JobQueue()
+
+    # Open results warehouse (simulation results are persisted in "results/warehouse")
+    results_warehouse = warehouse.ResultsWarehouse()
+    stored_results = {}
+
+    # Initialize variable to store user command
+    command = ''
+
+    # Print welcome message
+    print('\n<>------------------------------------------------------------------------------------------------------<>')
+    print('  Welcome to BEMSCA. For a list of available commands, type "help". Alternatively, type desired command.  ')
+    print('<>------------------------------------------------------------------------------------------------------<>')
+
+    # Start input loop (terminate when 'quit' command is received)
+    while command != 'Quit':
+
+        command = input('\n>>> ').capitalize()
+
+        if command == 'Compare':
+            compare_command()
+        elif command == 'Edit':
+            edit_command()
+        elif command == 'Help':
+            help_command()
+        elif command == 'Import':
+            import_command()
+        elif command == 'Simulate':
+            simulate_command()
+        elif command == 'Sweep':
+            sweep_command()
+        elif command != 'Quit':
+            print('\nInvalid command.')
\ No newline at end of file
@@ -1,18 +1,167 @@
+import concurrent.futures
+import hashlib
+import json
 import math
+import multiprocessing
+import os
+import sys
+import threading
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+import instrumentation
+import utils
+
+# Heavy modules only loaded when a graph is first rendered (see "utils.lazy_import")
+plt = utils.lazy_import("matplotlib.pyplot")
+sweep = utils.lazy_import("sweep")
 
 
 # -----------------------------------------------------------------------------
 #    GLOBAL CONSTANTS
 # -----------------------------------------------------------------------------
 DEFAULT_BAR_WIDTH = 0.5
-DPI = 600
 THINING_FACTOR = 0.85
 TOTAL_BAR_WIDTH = 0.15
 Y_SHIFT_FACTOR = 1.1
 
+# Comparison reports (used when more conditions are compared than can be presented side by side)
+MAX_COMPARED_CONDITIONS = 5
+REPORT_CATEGORIES = ["Consumables", "Reagents", "Facility", "Labor"]
+REPORT_CATEGORY_COLORS = "YlOrBr" # colormap from which category colors are generated
+REPORT_CONDITION_COLORS = "viridis" # colormap from which colors of groups of conditions are generated
+REPORT_DPI = 200 # (lower than the DPI of other graphs, as reports may have many pages)
+REPORT_PAGE_SIZE = 25 # conditions presented in each page of the category costs graph
+MAX_REPORT_PAGES = 4 # pages of the category costs graph rendered (the costs of all conditions are in the report table)
+
+# Rendering settings (see "configure_rendering")
+DPI = 600
+FORMATS = ["png"] # any combination of "png", "svg" and "pdf"
+RESULTS_DIRECTORY = "results"
+
+# Content hashes of the data of previously rendered graphs (graphs are only rendered again if their data changes)
+HASHES_FILE = "chart_hashes.json"
+
+# Background rendering process and graphs it is rendering (created when the first graph is rendered)
+renderer = None
+rendering = {}
+renderer_lock = threading.Lock()
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for changing the resolution and file formats of rendered graphs
+def configure_rendering(dpi=None, formats=None):
+    global DPI, FORMATS
+    if dpi is not None:
+        DPI = dpi
+    if formats is not None:
+        FORMATS = [file_format.lower() for file_format in formats]
+
+
+# Function for initializing the background rendering process (the non-interactive Agg backend is used, as graphs
+# are only saved to files)
+def initialize_renderer():
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+# Function for rendering a graph in the background process and saving it in each file format (the figure is
+# closed once saved, so memory does not grow with the number of rendered graphs)
+def render_graph(graph, data, file_name, dpi, formats):
+    with instrumentation.span("Graph Rendering"):
+        figure = GRAPHS[graph](data)
+        try:
+            for file_format in formats:
+                figure.savefig(f'{file_name}.{file_format}', dpi=dpi)
+        finally:
+            plt.close(figure)
+
+
+# Function for determining the content hash of a graph (its data and rendering settings)
+def hash_graph(graph, data, dpi, formats):
+    content = json.dumps([graph, data, dpi, sorted(formats)], sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+# Function for reading the content hashes of previously rendered graphs
+def read_hashes():
+    hashes_file = os.path.join(RESULTS_DIRECTORY, HASHES_FILE)
+    if not os.path.exists(hashes_file):
+        return {}
+    with open(hashes_file) as file:
+        try:
+            return json.load(file)
+        except json.JSONDecodeError:
+            return {}
+
+
+# Function for recording the content hash of a rendered graph (called once it is saved)
+def write_hash(file_name, content_hash, future):
+    with renderer_lock:
+        if rendering.get(file_name) is future:
+            del rendering[file_name]
+
+        if future.cancelled() or future.exception() is not None:
+            if not future.cancelled():
+                print(f'Graph "{file_name}" could not be rendered: {future.exception()!r}', file=sys.stderr)
+            return
+
+        hashes = read_hashes()
+        hashes[file_name] = content_hash
+        with open(os.path.join(RESULTS_DIRECTORY, HASHES_FILE), 'w') as file:
+            json.dump(hashes, file, indent=2)
+
+
+# Function for rendering a graph in the background with the current rendering settings (its resolution is limited
+# to the given maximum DPI, if any), unless an identical graph (same data and settings) was already rendered to the
+# same files. Returns the future of the rendering (None if it is skipped)
+def render(graph, data, file_name, max_dpi=None):
+    global renderer
+    dpi = DPI if max_dpi is None else min(DPI, max_dpi)
+    content_hash = hash_graph(graph, data, dpi, FORMATS)
+    file_name = os.path.join(RESULTS_DIRECTORY, file_name)
+
+    with renderer_lock:
+        # Skip graph if it is already rendered (or being rendered) with the same content
+        if (read_hashes().get(file_name) == content_hash
+                and all(os.path.exists(f'{file_name}.{file_format}') for file_format in FORMATS)):
+            instrumentation.count("Graph Cache Hits")
+            return None
+        if file_name in rendering and rendering[file_name].content_hash == content_hash:
+            instrumentation.count("Graph Cache Hits")
+            return rendering[file_name]
+        instrumentation.count("Graphs Submitted")
+
+        # Start background rendering process (spawned, so it does not inherit the state of the calling process)
+        if renderer is None:
+            os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+            renderer = concurrent.futures.ProcessPoolExecutor(1, multiprocessing.get_context("spawn"),
+                                                              initializer=initialize_renderer)
+
+        future = renderer.submit(render_graph, graph, data, file_name, dpi, FORMATS)
+        future.content_hash = content_hash
+        rendering[file_name] = future
+
+    future.add_done_callback(lambda future: write_hash(file_name, content_hash, future))
+    return future
+
+
+# Function for waiting until all graphs are rendered
+def wait_for_graphs():
+    with renderer_lock:
+        futures = list(rendering.values())
+    concurrent.futures.wait(futures)
+
+
+# Function for waiting until all graphs are rendered and stopping the background rendering process
+def close_renderer():
+    global renderer
+    wait_for_graphs()
+    if renderer is not None:
+        renderer.shutdown()
+        renderer = None
+
 
 # Function for organizing BEMSCA's outputs based on the obtained simulation results
 def simulate_output(db_data, bio_params_name, simulation_results):
@@ -41,7 +190,7 @@ def simulate_output(db_data, bio_params_name, simulation_results):
 
     # Organize data to make bioreactor worflow easier to interpret for user
     print(f'BIOREACTORS: {simulation_results.bioreactor_expansion.bioreactors.index.tolist()}\n')
-    bioreactor_workflow_table = simulation_results.bioreactor_expansion.bioreactor_workflow[1]
+    bioreactor_workflow_table = simulation_results.bioreactor_expansion.bioreactor_workflow[1].copy()
     bioreactor_workflow_table["Volume (L)"] = np.round(simulation_results.bioreactor_expansion.bioreactor_workflow[0], 3)
     bioreactor_workflow_table["Inoculated Cells"] = (bioreactor_workflow_table["Volume (L)"] * 1e3
                                                      * simulation_results.planar_expansion.seeding_density)
@@ -96,50 +245,19 @@ def simulate_output(db_data, bio_params_name, simulation_results):
     pd.options.display.float_format = "{:,.2f}".format
     print(cost_categories)
 
-    # Calculate the average final cell number
-    fin_cell_number_pd = (simulation_results.bioreactor_expansion.fold_increase_pds[-1]
-                          * simulation_results.planar_expansion.inoc_cells)
-    avg_fin_cell_number = np.average(fin_cell_number_pd)
-    
-    # Calculate the confidence level
-    confidence_level = ((fin_cell_number_pd >= fin_target_cell_number).sum()
-                        / simulation_results.bioreactor_expansion.SIMULATION_RUNS) * 100
-    
     # Print important info
-    print(f'\nAVERAGE FINAL CELL NUMBER: {avg_fin_cell_number:.2e}')
-    print(f'CONFIDENCE LEVEL: {confidence_level:.1f}%')
-    print(f'''OVERALL DURATION: {simulation_results.planar_expansion.duration
-                                 + simulation_results.bioreactor_expansion.duration} days''')
+    print(f'\nAVERAGE FINAL CELL NUMBER: {simulation_results.avg_fin_cell_number:.2e}')
+    print(f'CONFIDENCE LEVEL: {simulation_results.confidence_level:.1f}%')
+    print(f'OVERALL DURATION: {simulation_results.bioprocess_duration} days')
     print(f'MEDIUM COST: {simulation_results.bioprocess_medium_cost:,.2f} € ({relative_medium_cost:.0f}%)')
     print(f'OVERALL COST: {simulation_results.bioprocess_overall_cost:,.2f} €\n')
 
     # <>---------------- Graphical Output ---------------<>
-    # Create figure and axis
-    figure, axes = plt.subplots(tight_layout=True)
-
-    # Define graph title
-    axes.set_title('Bioprocess costs by category', fontweight='bold')
-
-    # Define position of bars
-    y_pos = np.arange(len(cost_categories.columns))
-
-    # Add bars to graph and define axes labels
-    axes.barh(y_pos, cost_categories.loc["Absolute Cost (€)", :], DEFAULT_BAR_WIDTH, align='center', color='goldenrod')
-    axes.set_yticks(y_pos)
-    axes.set_yticklabels(cost_categories)
-    axes.invert_yaxis()
-    axes.set_xlabel('Cost (€)')
-    
-    # Add shading to reagents bar to highlight culture medium cost
-    axes.barh(y_pos[1], simulation_results.bioprocess_medium_cost, DEFAULT_BAR_WIDTH,
-              left=(simulation_results.bioprocess_reagents_cost - simulation_results.bioprocess_medium_cost),
-              color='gold', label='Medium Cost')
-    
-    # Show graph legend
-    axes.legend(loc='upper right')
-
-    # Save figure to "results" folder
-    plt.savefig(f'results/Cost_Categories_{bio_params_name}.png', dpi=DPI)
+    # Render graph in the background and save it to "results" folder
+    render("Cost Categories", {"Categories": cost_categories.columns.tolist(),
+                               "Costs": cost_categories.loc["Absolute Cost (€)"].astype(float).tolist(),
+                               "Medium Cost": float(simulation_results.bioprocess_medium_cost)},
+           f'Cost_Categories_{bio_params_name}')
 
     return cost_categories, simulation_results.bioprocess_medium_cost
 
@@ -161,6 +279,22 @@ def compare_output(db_data, bio_params_names, simulations, customization):
     # Define labels
     labels = customization[3]
 
+    # Present the differences of each condition from the base-case, along with their standard errors
+    differences = paired_differences(simulations, labels, base_case_index)
+    paired = all(simulation.bioreactor_expansion.engine == "common" for simulation in simulations)
+    random_numbers = "paired, common random numbers" if paired else "independent random numbers"
+    print(f'\n<>--- Differences from Base Case ({random_numbers}) ---<>\n')
+    print(differences.to_string(float_format=lambda value: f'{value:,.4g}'))
+    print('\n(overall cost and required cycles are decided by a single simulation of each condition, so their '
+          'differences have no SE)')
+
+    # Present a comparison report if there are too many conditions to be presented side by side
+    if len(simulations) > min(MAX_COMPARED_CONDITIONS, len(primary_colors)):
+        records = [sweep.summarize_results(simulation) for simulation in simulations]
+        report = compare_report(records, labels, name, base_case_index)
+        print(report)
+        return
+
     # Define medium labels
     medium_labels = []
     for label in labels:
@@ -173,95 +307,234 @@ def compare_output(db_data, bio_params_names, simulations, customization):
     for bio_params_name, simulation in zip (bio_params_names, simulations):
         cost_categories[bio_params_name] = simulate_output(db_data, bio_params_name, simulation)
 
-    # Create figure and axis (overwrite any existing figure)
+    # Organize data of graphs (absolute costs of each category and medium cost of each condition)
+    data = {"Name": name, "Base Case": base_case_index, "Labels": labels, "Medium Labels": medium_labels,
+            "Primary Colors": primary_colors, "Secondary Colors": secondary_colors,
+            "Categories": cost_categories[bio_params_names[-1]][0].columns.tolist(),
+            "Costs": [cost_categories[bio_params_name][0].loc["Absolute Cost (€)"].astype(float).tolist()
+                      for bio_params_name in bio_params_names],
+            "Medium Costs": [float(cost_categories[bio_params_name][1]) for bio_params_name in bio_params_names]}
+
+    # Define file names suffix
+    file_suffix = ''
+    for bio_params_name in bio_params_names[1:]:
+        file_suffix += f'_{bio_params_name}'
+
+    # Render graphs in the background and save them to "results" folder
+    render("Cost Categories Comparison", data, f'Cost_Categories_Comp{file_suffix}')
+    render("Total Cost Comparison", data, f'Total_Cost_Comp{file_suffix}')
+
+
+# Function for determining the differences between the outputs of each condition and those of the base-case, along
+# with their standard errors (SE), returns a table with a row per condition. Differences of the average final cell
+# number and confidence level are estimated from the final cell number of each simulation run: if all conditions
+# were simulated with common random numbers (see "bioprocess.BioreactorExpansion.sample_common_fold_increases"),
+# each run of a condition is paired with the same run of the base-case, so only the real effects of the condition
+# (and not Monte Carlo noise) contribute to the paired differences and their much lower standard errors. Differences
+# of the overall cost and required cycles are differences between the decisions of a single simulation of each
+# condition, so they have no standard error (they are only free of Monte Carlo noise if the conditions are paired)
+def paired_differences(simulations, labels, base_case_index=0):
+    base_case = simulations[base_case_index]
+    paired = all(simulation.bioreactor_expansion.engine == "common" for simulation in simulations)
+
+    rows = []
+    for simulation in simulations:
+        row = {}
+        outputs = [(simulation.fin_cell_number_pd, base_case.fin_cell_number_pd, "Final Cell Number"),
+                   # Confidence level is the percentage of runs reaching the target cell number
+                   ((simulation.fin_cell_number_pd >= simulation.bioreactor_expansion.tfi
+                     * simulation.bioreactor_expansion.initial_cells.item()) * 100.0,
+                    (base_case.fin_cell_number_pd >= base_case.bioreactor_expansion.tfi
+                     * base_case.bioreactor_expansion.initial_cells.item()) * 100.0, "Confidence Level")]
+        for (runs, base_runs, output) in outputs:
+            row[f'{output} Difference'] = np.mean(runs) - np.mean(base_runs)
+            if paired and len(runs) == len(base_runs):
+                row[f'{output} SE'] = np.std(runs - base_runs, ddof=1) / math.sqrt(len(runs))
+            else:
+                row[f'{output} SE'] = math.sqrt(np.var(runs, ddof=1) / len(runs)
+                                                + np.var(base_runs, ddof=1) / len(base_runs))
+
+        row["Overall Cost Difference"] = simulation.bioprocess_overall_cost - base_case.bioprocess_overall_cost
+        row["Required Cycles Difference"] = (simulation.bioreactor_expansion.monte_carlo[0]
+                                             - base_case.bioreactor_expansion.monte_carlo[0])
+        rows.append(row)
+
+    differences = pd.DataFrame.from_records(rows, index=pd.Index(labels, name="Condition"))
+    return differences.drop(differences.index[base_case_index])
+
+
+# Function for presenting a comparison report of any number of conditions from the records of their results (see
+# "sweep.summarize_results"), e.g. the records of a sweep. Costs of all conditions are organized in a single table
+# (saved to "results" folder) and presented in paginated graphs (of the first MAX_REPORT_PAGES pages of conditions),
+# with colors generated for any number of conditions (those with the same "Name" share a color). Returns the table
+def compare_report(records, labels, name, base_case_index=0):
+    # <>----------------- Report Table ------------------<>
+    with instrumentation.span("Report Table"):
+        report = pd.DataFrame.from_records(records, index=pd.Index(labels, name="Condition"))
+        columns = [f'{category} Cost' for category in REPORT_CATEGORIES]
+        report = report[columns + ["Medium Cost", "Overall Cost", "Overall Duration", "Confidence Level"]
+                        + (["Name"] if "Name" in report else [])]
+
+        # Calculate relative category costs and reduction of overall cost relative to the base-case (in %)
+        for category, column in zip(REPORT_CATEGORIES, columns):
+            report[f'Relative {category} Cost'] = report[column] / report["Overall Cost"] * 100
+        report["Relative Medium Cost"] = report["Medium Cost"] / report["Overall Cost"] * 100
+        report["Cost Reduction"] = (1 - report["Overall Cost"] / report["Overall Cost"].iloc[base_case_index]) * 100
+
+    os.makedirs(RESULTS_DIRECTORY, exist_ok=True)
+    table_file = os.path.join(RESULTS_DIRECTORY, f'Comparison_{name}.csv')
+    report.to_csv(table_file)
+
+    # <>---------------- Graphical Output ---------------<>
+    # Group conditions by name (each condition is its own group if names are not given)
+    groups = report["Name"] if "Name" in report else report.index.to_series()
+    group_names = list(dict.fromkeys(groups))
+    group_indexes = [group_names.index(group) for group in groups]
+
+    # Render one graph of category costs per page of conditions (up to MAX_REPORT_PAGES, as each page takes most of a
+    # second to render), and a graph of the overall cost of all conditions
+    pages = min(math.ceil(len(report) / REPORT_PAGE_SIZE), MAX_REPORT_PAGES)
+    if len(report) > pages * REPORT_PAGE_SIZE:
+        print(f'\nCategory costs are only graphed for the first {pages * REPORT_PAGE_SIZE} of {len(report)} conditions '
+              f'(see "{table_file}" for the costs of all conditions)')
+    for page, start in enumerate(range(0, pages * REPORT_PAGE_SIZE, REPORT_PAGE_SIZE)):
+        page_report = report.iloc[start:start+REPORT_PAGE_SIZE]
+        render("Cost Categories Report", {"Name": name, "Page": page + 1, "Pages": pages,
+                                          "Labels": page_report.index.tolist(), "Categories": REPORT_CATEGORIES,
+                                          "Costs": page_report[columns].values.tolist(),
+                                          "Medium Costs": page_report["Medium Cost"].tolist()},
+               f'Cost_Categories_Report_{name}_{page + 1}', REPORT_DPI)
+
+    render("Total Cost Report", {"Name": name, "Labels": report.index.tolist(), "Base Case": base_case_index,
+                                 "Total Costs": report["Overall Cost"].tolist(), "Groups": group_names,
+                                 "Group Indexes": group_indexes},
+           f'Total_Cost_Report_{name}', REPORT_DPI)
+
+    return report
+
+
+# Function for generating a number of colors from a colormap
+def generate_palette(colormap, n_colors):
+    return plt.get_cmap(colormap)(np.linspace(0.2, 0.9, n_colors) if n_colors > 1 else [0.5])
+
+
+# Function for plotting the costs of each category of a bioprocess, returns the figure
+def plot_cost_categories(data):
+    # Create figure and axis
+    figure, axes = plt.subplots(tight_layout=True)
+
+    # Define graph title
+    axes.set_title('Bioprocess costs by category', fontweight='bold')
+
+    # Define position of bars
+    y_pos = np.arange(len(data["Categories"]))
+
+    # Add bars to graph and define axes labels
+    axes.barh(y_pos, data["Costs"], DEFAULT_BAR_WIDTH, align='center', color='goldenrod')
+    axes.set_yticks(y_pos)
+    axes.set_yticklabels(data["Categories"])
+    axes.invert_yaxis()
+    axes.set_xlabel('Cost (€)')
+    
+    # Add shading to reagents bar to highlight culture medium cost
+    axes.barh(y_pos[1], data["Medium Cost"], DEFAULT_BAR_WIDTH, left=(data["Costs"][1] - data["Medium Cost"]),
+              color='gold', label='Medium Cost')
+    
+    # Show graph legend
+    axes.legend(loc='upper right')
+
+    return figure
+
+
+# Function for plotting the costs of each category of the compared conditions, returns the figure
+def plot_cost_categories_comparison(data):
+    n_conditions = len(data["Costs"])
+
+    # Create figure and axis
     figure, axes = plt.subplots(tight_layout=True)
 
     # Define cost categories graph title
-    axes.set_title(f'Impact of {name} on bioprocess category costs', fontweight='bold')
+    axes.set_title(f'Impact of {data["Name"]} on bioprocess category costs', fontweight='bold')
     
     # Adjust bar width according to number of conditions being compared
-    bar_width = DEFAULT_BAR_WIDTH/2 * THINING_FACTOR**(len(simulations)-2)
+    bar_width = DEFAULT_BAR_WIDTH/2 * THINING_FACTOR**(n_conditions-2)
 
     # Define position of bars
-    y_pos = np.arange(len(cost_categories[bio_params_names[-1]][0].columns))
+    y_pos = np.arange(len(data["Categories"]))
 
     # Determine appropriate initial y shift of bars according to number of conditions being compared
-    if len(bio_params_names) % 2 == 0:
-        y_shift = -bar_width * (Y_SHIFT_FACTOR/2) * (len(bio_params_names)/2)
+    if n_conditions % 2 == 0:
+        y_shift = -bar_width * (Y_SHIFT_FACTOR/2) * (n_conditions/2)
     else:
-        y_shift = -bar_width * Y_SHIFT_FACTOR * (len(bio_params_names)//2)
+        y_shift = -bar_width * Y_SHIFT_FACTOR * (n_conditions//2)
 
     # Construct cost categories graph
-    for i, bio_params_name in enumerate(bio_params_names):
+    for i in range(n_conditions):
         # Add bars to graph
-        axes.barh(y_pos + y_shift, cost_categories[bio_params_name][0].loc[['Absolute Cost (€)']].values[0],
-                    bar_width, align='center', color=primary_colors[i], label=labels[i])
+        axes.barh(y_pos + y_shift, data["Costs"][i], bar_width, align='center', color=data["Primary Colors"][i],
+                  label=data["Labels"][i])
         
         # Add shading to reagents bar to highlight culture medium cost
-        axes.barh(y_pos[1] + y_shift, cost_categories[bio_params_name][1], bar_width,
-            left=(cost_categories[bio_params_name][0].loc['Absolute Cost (€)', 'Reagents']
-                  - cost_categories[bio_params_name][1]), color=secondary_colors[i])
+        axes.barh(y_pos[1] + y_shift, data["Medium Costs"][i], bar_width,
+            left=(data["Costs"][i][1] - data["Medium Costs"][i]), color=data["Secondary Colors"][i])
         
         # Update y shift
         y_shift += (bar_width * Y_SHIFT_FACTOR)
 
     # Define axes label
     axes.set_yticks(y_pos)
-    axes.set_yticklabels(cost_categories[bio_params_names[-1]][0])
+    axes.set_yticklabels(data["Categories"])
     axes.invert_yaxis()
     axes.set_xlabel('Cost (€)')
 
     # Show graph legend
     axes.legend(loc='upper right')
 
-    # Define file name
-    file_name = 'results/Cost_Categories_Comp'
-    for bio_params_name in bio_params_names[1:]:
-        file_name += f'_{bio_params_name}'
-    file_name += '.png'
+    return figure
 
-    # Save figure to "results" folder
-    plt.savefig(file_name, dpi=DPI)
 
-    # Clear axes in order to create new graph (with total costs)
-    axes.clear()
+# Function for plotting the total cost of the compared conditions, returns the figure
+def plot_total_cost_comparison(data):
+    n_conditions = len(data["Costs"])
+    base_case_index = data["Base Case"]
+
+    # Create figure and axis
+    figure, axes = plt.subplots(tight_layout=True)
 
     # Define total costs graph title
-    axes.set_title(f'Impact of {name} on total bioprocess cost', fontweight='bold')
+    axes.set_title(f'Impact of {data["Name"]} on total bioprocess cost', fontweight='bold')
 
     # Adjust thick bar width according to number of conditions being compared
-    bar_width = TOTAL_BAR_WIDTH * (THINING_FACTOR+0.05)**(len(simulations)-2)
+    bar_width = TOTAL_BAR_WIDTH * (THINING_FACTOR+0.05)**(n_conditions-2)
 
     # Define y position of bars (for an aesthetic graph)
-    y_pos = np.linspace(0.1+0.2**(len(simulations)-1), 0.9-0.2**(len(simulations)-1), len(simulations))
+    y_pos = np.linspace(0.1+0.2**(n_conditions-1), 0.9-0.2**(n_conditions-1), n_conditions)
 
     # Create array with total costs
-    total_costs = np.zeros(len(y_pos))
-    for i, bio_params_name in enumerate(bio_params_names):
-        total_costs[i] = cost_categories[bio_params_name][0].loc[['Absolute Cost (€)']].sum(axis=1).values[0]
+    total_costs = np.array([sum(costs) for costs in data["Costs"]])
 
     # Add bars to graph and define axes labels
     axes.set_ylim(0, 1)
-    axes.barh(y_pos, total_costs, bar_width, align='center', color=primary_colors)
+    axes.barh(y_pos, total_costs, bar_width, align='center', color=data["Primary Colors"][:n_conditions])
     axes.set_yticks(y_pos)
-    axes.set_yticklabels(labels)
+    axes.set_yticklabels(data["Labels"])
     axes.invert_yaxis()
     axes.set_xlabel('Total Cost (€)')
 
     # Add additional elements to graph
-    for i, bio_params_name in enumerate(bio_params_names):
+    for i in range(n_conditions):
         # Add shading to reagents bar to highlight culture medium cost
-        if i < len(medium_labels):
-            bar = axes.barh(y_pos[i], cost_categories[bio_params_name][1], bar_width,
-                            left=(total_costs[i] - cost_categories[bio_params_name][1]),
-                            color=secondary_colors[i], label=f'{medium_labels[i]} medium cost')
+        if i < len(data["Medium Labels"]):
+            bar = axes.barh(y_pos[i], data["Medium Costs"][i], bar_width,
+                            left=(total_costs[i] - data["Medium Costs"][i]),
+                            color=data["Secondary Colors"][i], label=f'{data["Medium Labels"][i]} medium cost')
         else:
-            bar = axes.barh(y_pos[i], cost_categories[bio_params_name][1], bar_width,
-                            left=(total_costs[i] - cost_categories[bio_params_name][1]),
-                            color=secondary_colors[i])            
+            bar = axes.barh(y_pos[i], data["Medium Costs"][i], bar_width,
+                            left=(total_costs[i] - data["Medium Costs"][i]),
+                            color=data["Secondary Colors"][i])            
     
         # Calculate medium percentage and add to corresponding bar
-        medium_percentage = cost_categories[bio_params_name][1] / total_costs[i] * 100
+        medium_percentage = data["Medium Costs"][i] / total_costs[i] * 100
         axes.bar_label(bar, labels=['%.0f%%' % medium_percentage], label_type='center', fontweight='bold')
 
         # Calculate reduction percentage and add to corresponding bar
@@ -272,11 +545,86 @@ def compare_output(db_data, bio_params_names, simulations, customization):
     # Show graph legend
     axes.legend()
 
-    # Define file name
-    file_name = 'results/Total_Cost_Comp'
-    for bio_params_name in bio_params_names[1:]:
-        file_name += f'_{bio_params_name}'
-    file_name += '.png'
+    return figure
+
+
+# Function for plotting a page of the category costs of a comparison report (stacked bars, one per condition),
+# returns the figure
+def plot_cost_categories_report(data):
+    n_conditions = len(data["Labels"])
+    costs = np.array(data["Costs"])
+    colors = generate_palette(REPORT_CATEGORY_COLORS, len(data["Categories"]))
+
+    # Create figure and axis (height adjusted to the number of conditions)
+    figure, axes = plt.subplots(figsize=(6.4, 1.5 + 0.25 * n_conditions), tight_layout=True)
+
+    # Define graph title
+    axes.set_title(f'Bioprocess category costs of {data["Name"]} ({data["Page"]}/{data["Pages"]})',
+                   fontweight='bold')
+
+    # Add stacked bars of each category
+    y_pos = np.arange(n_conditions)
+    left = np.zeros(n_conditions)
+    for i, category in enumerate(data["Categories"]):
+        axes.barh(y_pos, costs[:, i], DEFAULT_BAR_WIDTH, left=left, color=colors[i], label=category)
+        left += costs[:, i]
+
+    # Add hatching to reagents bars to highlight culture medium cost
+    axes.barh(y_pos, data["Medium Costs"], DEFAULT_BAR_WIDTH, left=costs[:, :2].sum(axis=1) - data["Medium Costs"],
+              fill=False, hatch='///', label='Medium Cost')
+
+    # Define axes labels
+    axes.set_yticks(y_pos)
+    axes.set_yticklabels(data["Labels"], fontsize='small')
+    axes.set_ylim(n_conditions - 0.5, -0.5)
+    axes.set_xlabel('Cost (€)')
+
+    # Show graph legend (below the graph, so it does not cover any bar)
+    axes.legend(loc='upper center', bbox_to_anchor=(0.5, -0.5 / (1.5 + 0.25 * n_conditions)), ncol=3,
+                fontsize='small')
+
+    return figure
+
+
+# Function for plotting the overall cost of all conditions of a comparison report (sorted, so the spread of costs
+# is shown regardless of the number of conditions), returns the figure
+def plot_total_cost_report(data):
+    total_costs = np.array(data["Total Costs"])
+    group_indexes = np.array(data["Group Indexes"])
+    colors = generate_palette(REPORT_CONDITION_COLORS, len(data["Groups"]))
+    order = np.argsort(total_costs)
+
+    # Create figure and axis
+    figure, axes = plt.subplots(tight_layout=True)
+
+    # Define graph title
+    axes.set_title(f'Total bioprocess cost of {data["Name"]}', fontweight='bold')
+
+    # Add bars of each group of conditions (legend only presented for a readable number of groups)
+    ranks = np.arange(len(total_costs))
+    for i, group in enumerate(data["Groups"]):
+        in_group = group_indexes[order] == i
+        axes.bar(ranks[in_group], total_costs[order][in_group], 1, color=colors[i],
+                 label=group if len(data["Groups"]) <= MAX_COMPARED_CONDITIONS * 2 else None)
+
+    # Highlight base-case
+    axes.axhline(total_costs[data["Base Case"]], color='black', linestyle='--', linewidth=1,
+                 label=f'Base case ({data["Labels"][data["Base Case"]]})')
+
+    # Define axes labels
+    axes.set_xlim(-0.5, len(total_costs) - 0.5)
+    axes.set_xlabel('Conditions (sorted by total cost)')
+    axes.set_ylabel('Total Cost (€)')
+
+    # Show graph legend
+    axes.legend(fontsize='small')
+
+    return figure
+
 
-    # Save figure to "results" folder
-    plt.savefig(file_name, dpi=DPI)
\ No newline at end of file
+# Functions for plotting each type of graph (see "render")
+GRAPHS = {"Cost Categories": plot_cost_categories,
+          "Cost Categories Comparison": plot_cost_categories_comparison,
+          "Total Cost Comparison": plot_total_cost_comparison,
+          "Cost Categories Report": plot_cost_categories_report,
+          "Total Cost Report": plot_total_cost_report}
@@ -0,0 +1,292 @@
+import abc
+import hashlib
+import json
+import sys
+import numpy as np
+import numpy.random as nprand
+import bioprocess
+import incremental
+import instrumentation
+import replicates
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+COST_CATEGORIES = ["Consumables", "Reagents", "Facility", "Labor"]
+
+# Nodes of the simulation of a bioprocess (see "incremental.py") used by each built-in stage
+PLANAR_STAGE_NODES = {incremental.DAILY_COSTS, incremental.PLANAR_EXPANSION}
+BIOREACTOR_STAGE_NODES = {incremental.DAILY_COSTS, incremental.MONTE_CARLO, incremental.BIOREACTOR_WORKFLOW,
+                          incremental.BIOREACTOR_EXPANSION}
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define base class of the stages of a bioprocess pipeline. Each stage consumes the cell number distribution
+# produced by the upstream stage (None for the first stage) and produces a stage output: a dictionary with its own
+# cell number distribution ("Cells"), "Workflow", "Duration" (days), "Costs" of each category, "Medium Cost",
+# "Daily Depreciation" of its equipment (applied to the duration of every stage, see "PipelineResults") and the
+# underlying simulation "Results", if any. Stage outputs are memoized by the stage's inputs (see "Pipeline")
+class Stage(abc.ABC):
+    name = None
+
+    # Function for determining the inputs of the stage (dictionary of plain values), which must include every
+    # database value and parameter its output depends on (other than the upstream output)
+    @abc.abstractmethod
+    def determine_inputs(self, db_data, bio_params_name, dependencies):
+        pass
+
+
+    # Function for running the stage, returns its output
+    @abc.abstractmethod
+    def run(self, pipeline, db_data, bio_params, upstream):
+        pass
+
+
+# Define stage of planar expansion (see "bioprocess.PlanarExpansion"), which produces the cells that inoculate
+# the first bioreactor
+class PlanarStage(Stage):
+    name = "Planar Expansion"
+
+    def determine_inputs(self, db_data, bio_params_name, dependencies):
+        return select_inputs(db_data, dependencies, PLANAR_STAGE_NODES)
+
+
+    def run(self, pipeline, db_data, bio_params, upstream):
+        (d_facility_cost, d_labor_cost) = pipeline.determine_daily_costs(db_data)
+        planar_expansion = bioprocess.PlanarExpansion(db_data, bio_params, d_facility_cost, d_labor_cost)
+
+        # Cells inoculated into the first bioreactor (simulated in stochastic planar mode)
+        cells = planar_expansion.inoc_cells_pd
+        if cells is None:
+            cells = np.array([planar_expansion.inoc_cells])
+
+        return {"Cells": cells, "Workflow": list(planar_expansion.planar_workflow),
+                "Duration": planar_expansion.duration,
+                "Costs": {"Consumables": planar_expansion.T_consumables_cost,
+                          "Reagents": planar_expansion.T_reagents_cost,
+                          "Facility": planar_expansion.T_facility_cost, "Labor": planar_expansion.T_labor_cost},
+                "Medium Cost": planar_expansion.T_medium_cost, "Daily Depreciation": 0,
+                "Results": planar_expansion}
+
+
+# Define stage of bioreactor expansion (see "bioprocess.BioreactorExpansion"), whose cell number distribution is
+# the simulated fold increase of each run applied to the upstream distribution (the ratio between upstream and
+# required initial cells is coupled to the Monte Carlo simulation). Its Monte Carlo simulation is memoized
+# separately, so changes that only affect its costs or bioreactor assignment do not repeat it
+class BioreactorStage(Stage):
+    name = "Bioreactor Expansion"
+
+    def determine_inputs(self, db_data, bio_params_name, dependencies):
+        return select_inputs(db_data, dependencies, BIOREACTOR_STAGE_NODES)
+
+
+    def run(self, pipeline, db_data, bio_params, upstream):
+        (d_facility_cost, d_labor_cost) = pipeline.determine_daily_costs(db_data)
+
+        # Inputs of the Monte Carlo simulation include the replicate measurements sampled by the empirical engine
+        # (see "incremental.determine_dependencies") and their sampling method
+        monte_carlo_key = hash_inputs(["Monte Carlo", select_inputs(db_data, pipeline.dependencies,
+                                                                    {incremental.MONTE_CARLO}),
+                                       bioprocess.SIMULATION_RUNS, bioprocess.ENGINE, bioprocess.PLANAR_MODE,
+                                       replicates.SAMPLING_METHOD])
+        monte_carlo = pipeline.cache.get(monte_carlo_key)
+        if monte_carlo is not None:
+            pipeline.count_cache_hit()
+
+        # Upstream cells are only coupled to the simulation if they are a distribution (a single value matches the
+        # initial cells of the bioreactor expansion)
+        inoc_cells_pd = upstream["Cells"] if len(upstream["Cells"]) > 1 else None
+
+        bioreactor_expansion = bioprocess.BioreactorExpansion(db_data, bio_params, d_facility_cost, d_labor_cost,
+                                                              monte_carlo, pipeline.progress, inoc_cells_pd)
+        pipeline.cache[monte_carlo_key] = bioreactor_expansion.monte_carlo
+
+        # Infeasible expansions (see "bioprocess.Bioprocess") have no accepted distribution, and output no cells
+        cells = np.empty(0)
+        if bioreactor_expansion.fold_increase_pds:
+            cells = bioreactor_expansion.fold_increase_pds[-1] * bioreactor_expansion.initial_cells.item()
+
+        return {"Cells": cells,
+                "Workflow": bioreactor_expansion.bioreactor_workflow, "Duration": bioreactor_expansion.duration,
+                "Costs": {"Consumables": bioreactor_expansion.T_consumables_cost,
+                          "Reagents": bioreactor_expansion.T_reagents_cost,
+                          "Facility": bioreactor_expansion.T_facility_cost,
+                          "Labor": bioreactor_expansion.T_labor_cost},
+                "Medium Cost": bioreactor_expansion.T_medium_cost,
+                "Daily Depreciation": bioreactor_expansion.d_bioreactor_depreciation, "Results": bioreactor_expansion}
+
+
+# Define generic stage which processes cells with a random yield (beta distribution of the fraction of cells kept),
+# e.g. differentiation, harvest/downstream processing or cryopreservation. Besides facility and labor costs (daily
+# costs over the stage's duration), the stage has fixed costs of each category and a cost per million input cells
+class YieldStage(Stage):
+    # Initializer of class object
+    def __init__(self, name, yield_avg, yield_std, duration, fixed_costs=None, cost_per_million_cells=0,
+                 cost_per_million_cells_category="Reagents"):
+        # <>---------- Important Object Attributes ----------<>
+        self.name = name
+        self.yield_avg = yield_avg
+        self.yield_std = yield_std
+        self.duration = duration # days
+        self.fixed_costs = dict(fixed_costs or {})
+        self.cost_per_million_cells = cost_per_million_cells
+        self.cost_per_million_cells_category = cost_per_million_cells_category
+
+
+    def determine_inputs(self, db_data, bio_params_name, dependencies):
+        inputs = select_inputs(db_data, dependencies, {incremental.DAILY_COSTS})
+        inputs.update({"Yield AVG": self.yield_avg, "Yield STD": self.yield_std, "Duration": self.duration,
+                       "Fixed Costs": self.fixed_costs, "Cost per Million Cells": self.cost_per_million_cells,
+                       "Cost per Million Cells Category": self.cost_per_million_cells_category})
+        return inputs
+
+
+    def run(self, pipeline, db_data, bio_params, upstream):
+        (d_facility_cost, d_labor_cost) = pipeline.determine_daily_costs(db_data)
+
+        # Sample yield of each run of the upstream distribution
+        (alpha, beta) = utils.alpha_beta(self.yield_avg, self.yield_std)
+        cells = upstream["Cells"] * nprand.beta(alpha, beta, len(upstream["Cells"]))
+
+        costs = {category: self.fixed_costs.get(category, 0) for category in COST_CATEGORIES}
+        costs["Facility"] += d_facility_cost * self.duration
+        costs["Labor"] += d_labor_cost * self.duration
+        if len(upstream["Cells"]):
+            costs[self.cost_per_million_cells_category] += (self.cost_per_million_cells * np.average(upstream["Cells"])
+                                                            / 1e6)
+
+        return {"Cells": cells, "Workflow": None, "Duration": self.duration, "Costs": costs, "Medium Cost": 0,
+                "Daily Depreciation": 0, "Results": None}
+
+
+# Define class for running a pipeline of stages (by default, the planar and bioreactor expansion stages of
+# "bioprocess.Bioprocess"). The output of each stage is memoized by its inputs and the inputs of all upstream
+# stages, so changing a downstream stage never recomputes the upstream stages (nor their Monte Carlo simulations)
+class Pipeline():
+    # Initializer of class object
+    def __init__(self, stages=None):
+        # <>---------- Important Object Attributes ----------<>
+        self.stages = stages if stages is not None else [PlanarStage(), BioreactorStage()]
+
+        # Memoized stage outputs, Monte Carlo simulations and daily costs (by the hash of their inputs)
+        self.cache = {}
+        self.cache_hits = 0
+
+        # State of the current run (database cell dependencies of the simulated set of bioprocess parameters and
+        # progress function, see "bioprocess.report_progress")
+        self.dependencies = None
+        self.progress = None
+
+
+    # Function for running the pipeline for a set of bioprocess parameters, returns its results
+    def run(self, db_data, bio_params_name, progress=None):
+        bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]]
+        self.dependencies = incremental.determine_dependencies(db_data, bio_params_name)
+        self.progress = progress
+
+        stage_outputs = {}
+        upstream = None
+        upstream_key = None
+        for stage in self.stages:
+            key = hash_inputs([stage.name, stage.determine_inputs(db_data, bio_params_name, self.dependencies),
+                               upstream_key])
+            if key in self.cache:
+                self.count_cache_hit()
+            else:
+                with instrumentation.span(f'Stage: {stage.name}'):
+                    self.cache[key] = stage.run(self, db_data, bio_params, upstream)
+
+            stage_outputs[stage.name] = self.cache[key]
+            (upstream, upstream_key) = (self.cache[key], key)
+
+        self.progress = None
+        return PipelineResults(stage_outputs, bio_params)
+
+
+    # Function for determining the daily facility and labor costs (memoized, see "bioprocess.Bioprocess")
+    def determine_daily_costs(self, db_data):
+        key = hash_inputs(["Daily Costs", select_inputs(db_data, self.dependencies, {incremental.DAILY_COSTS})])
+        if key not in self.cache:
+            self.cache[key] = (bioprocess.Bioprocess.determine_daily_facility_cost(db_data),
+                               bioprocess.Bioprocess.determine_daily_labor_cost(db_data))
+
+        return self.cache[key]
+
+
+    # Function for counting a memoized output reused by a run
+    def count_cache_hit(self):
+        self.cache_hits += 1
+        instrumentation.count("Stage Cache Hits")
+
+
+# Define class for the results of a pipeline run, with the same summary attributes as "bioprocess.Bioprocess"
+class PipelineResults():
+    # Initializer of class object
+    def __init__(self, stage_outputs, bio_params):
+        # <>---------- Important Object Attributes ----------<>
+        self.stage_outputs = stage_outputs
+
+        # <>------------------- Main Body -------------------<>
+        # Determine the costs of each stage, taking into account the depreciation of the equipment of all stages
+        # during each stage (memoized stage outputs are not changed)
+        d_depreciation = sum(output["Daily Depreciation"] for output in stage_outputs.values())
+        self.stage_costs = {}
+        for name, output in stage_outputs.items():
+            self.stage_costs[name] = dict(output["Costs"])
+            self.stage_costs[name]["Facility"] += d_depreciation * output["Duration"]
+
+        # <>--------------- Costs by Category ---------------<>
+        (self.bioprocess_consumables_cost, self.bioprocess_reagents_cost, self.bioprocess_facility_cost,
+         self.bioprocess_labor_cost) = [sum(costs[category] for costs in self.stage_costs.values())
+                                        for category in COST_CATEGORIES]
+        self.bioprocess_medium_cost = sum(output["Medium Cost"] for output in stage_outputs.values())
+        self.bioprocess_overall_cost = (self.bioprocess_consumables_cost + self.bioprocess_reagents_cost
+                                        + self.bioprocess_facility_cost + self.bioprocess_labor_cost)
+
+        # <>--------------- Bioprocess Summary --------------<>
+        self.bioprocess_duration = sum(output["Duration"] for output in stage_outputs.values())
+
+        # Distribution of final cell numbers (output of the last stage) and confidence level of reaching the target
+        # (unknown and 0% if the pipeline is infeasible, i.e. its last stage outputs no cells)
+        self.fin_cell_number_pd = list(stage_outputs.values())[-1]["Cells"]
+        self.avg_fin_cell_number = np.nan
+        self.confidence_level = 0.0
+        if len(self.fin_cell_number_pd):
+            self.avg_fin_cell_number = np.average(self.fin_cell_number_pd)
+            self.confidence_level = ((self.fin_cell_number_pd >= bio_params["Target Cell Number"].item()).sum()
+                                     / len(self.fin_cell_number_pd)) * 100
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for selecting the database values used by the given nodes of a simulation (see "incremental.py")
+def select_inputs(db_data, dependencies, nodes):
+    return {'/'.join(cell): db_data[cell[0]].at[cell[1], cell[2]]
+            for cell in sorted(dependencies) if dependencies[cell] & nodes}
+
+
+# Function for hashing the inputs of a stage (any JSON serializable structure, numpy values are converted to plain
+# values)
+def hash_inputs(inputs):
+    content = json.dumps(inputs, sort_keys=True, default=lambda value: value.item() if hasattr(value, "item")
+                         else str(value))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Run the default pipeline for the given bioprocess parameters, e.g.: python3 pipeline.py Default
+if __name__ == "__main__":
+    pipeline = Pipeline()
+    results = pipeline.run(utils.get_database_data(), sys.argv[1])
+    for stage_name, stage_costs in results.stage_costs.items():
+        print(f'[{stage_name}] {results.stage_outputs[stage_name]["Duration"]} days, '
+              f'{sum(stage_costs.values()):,.2f} €')
+    print(f'OVERALL: {results.bioprocess_duration} days, {results.bioprocess_overall_cost:,.2f} € '
+          f'({results.confidence_level:.1f}% confidence level)')
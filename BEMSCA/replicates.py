@@ -0,0 +1,167 @@
+import argparse
+import time
+import numpy as np
+import numpy.random as nprand
+import instrumentation
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+# Sampling methods of replicate measurements: "bootstrap" resamples the measurements themselves, while "kde" draws
+# from a kernel density estimate of them (smoothed bootstrap, see "ReplicateSampler")
+SAMPLING_METHODS = ["bootstrap", "kde"]
+SAMPLING_METHOD = "kde" # sampling method used by the empirical Monte Carlo engine (see "bioprocess.ENGINES")
+
+# Tables of replicate measurements of each quantity: (table, column referencing the simulation, measurement column,
+# bounds of the measurements)
+REPLICATE_TABLES = {"Fold Expansion": ("Expansion Replicates", "Expansion Simulation", "Fold Expansion", (0, None)),
+                    "Recovery Efficiency": ("Recovery Replicates", "Recovery Simulation", "Recovery Efficiency",
+                                            (0, 1))}
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for drawing variates from the replicate measurements of a simulation in vectorized blocks. Bootstrap
+# draws pick measurements uniformly at random. KDE draws add Gaussian noise (with Silverman's bandwidth) to each picked
+# measurement and scale the result around the mean of the measurements, so draws keep the mean and (sample) variance
+# of the measurements (variance-preserving smoothed bootstrap). Draws outside the bounds of the measured quantity are
+# reflected back inside them. Variates are drawn from numpy's global random state, so seeded simulations remain
+# reproducible
+class ReplicateSampler():
+    # Initializer of class object
+    def __init__(self, measurements, method=SAMPLING_METHOD, bounds=(None, None)):
+        if method not in SAMPLING_METHODS:
+            raise ValueError(f'Unknown sampling method "{method}" (methods: {", ".join(SAMPLING_METHODS)})')
+
+        # <>---------- Important Object Attributes ----------<>
+        self.measurements = np.sort(np.asarray(measurements, dtype=float))
+        self.method = method
+        self.bounds = bounds
+
+        # Mean and std of the measurements and kernel bandwidth (no smoothing for bootstrap draws)
+        self.mean = self.measurements.mean()
+        self.std = self.measurements.std(ddof=1) if len(self.measurements) > 1 else 0.0
+        self.bandwidth = silverman_bandwidth(self.measurements) if method == "kde" else 0.0
+
+        # Measurements (centered on their mean) and kernel bandwidth scaled so that the variance of smoothed draws is
+        # the sample variance of the measurements (the variance of picked measurements plus that of the kernel noise
+        # is their population variance plus the squared bandwidth)
+        scale = 1.0
+        if self.bandwidth > 0:
+            scale = self.std / np.sqrt(self.measurements.var() + self.bandwidth**2)
+        self.scaled_measurements = (self.measurements - self.mean) * scale + self.mean
+        self.scaled_bandwidth = self.bandwidth * scale
+
+        # Key identifying the distribution of the draws (e.g., to cache variates drawn from it)
+        self.key = (method, tuple(self.measurements.tolist()), bounds)
+
+
+    # Function for drawing an array of variates of the given shape
+    def draw(self, shape):
+        variates = self.scaled_measurements[nprand.randint(len(self.measurements), size=shape)]
+        if self.scaled_bandwidth > 0:
+            noise = nprand.standard_normal(shape)
+            noise *= self.scaled_bandwidth
+            variates += noise
+            reflect(variates, self.bounds)
+
+        instrumentation.count("Replicate Variates", variates.size)
+        return variates
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for determining the kernel bandwidth of a set of measurements (Silverman's rule of thumb, using the smaller
+# of the std and the normalized interquartile range, or the std if the interquartile range is 0)
+def silverman_bandwidth(measurements):
+    if len(measurements) < 2:
+        return 0.0
+    std = np.std(measurements, ddof=1)
+    spread = np.subtract(*np.percentile(measurements, [75, 25])) / 1.34
+    spread = min(std, spread) if spread > 0 else std
+    return 0.9 * spread * len(measurements)**(-1/5)
+
+
+# Function for reflecting variates which fall outside the given bounds (lower, upper, either of which can be None)
+# back inside them, in place (only the few variates outside the bounds are rewritten). With both bounds, variates are
+# reflected at each bound in turn until they are inside them (folded into the interval at once)
+def reflect(variates, bounds):
+    (lower, upper) = bounds
+    if lower is not None and upper is not None:
+        outside = (variates < lower) | (variates > upper)
+        if outside.any():
+            width = upper - lower
+            folded = np.mod(variates[outside] - lower, 2 * width)
+            variates[outside] = lower + np.where(folded > width, 2 * width - folded, folded)
+    elif lower is not None and variates.min() < lower:
+        outside = variates < lower
+        variates[outside] = 2 * lower - variates[outside]
+    elif upper is not None and variates.max() > upper:
+        outside = variates > upper
+        variates[outside] = 2 * upper - variates[outside]
+    return variates
+
+
+# Function for obtaining the replicate measurements of a quantity ("Fold Expansion" or "Recovery Efficiency", see
+# REPLICATE_TABLES) of a simulation, returns an empty array if there are none (or if the database was created before
+# the tables of replicate measurements)
+def get_measurements(db_data, quantity, simulation_name):
+    (table, reference_column, column, _) = REPLICATE_TABLES[quantity]
+    if table not in db_data:
+        return np.empty(0)
+    replicates = db_data[table]
+    return replicates.loc[replicates[reference_column] == simulation_name, column].to_numpy(float)
+
+
+# Function for obtaining the sampler of the replicate measurements of a quantity of a simulation, or None if it has
+# no replicate measurements (in which case its parametric distribution is used)
+def get_sampler(db_data, quantity, simulation_name, method=SAMPLING_METHOD):
+    measurements = get_measurements(db_data, quantity, simulation_name)
+    if not len(measurements):
+        return None
+    return ReplicateSampler(measurements, method, REPLICATE_TABLES[quantity][3])
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Summarize the replicate measurements of every Expansion and Recovery Simulation (compared to the parametric
+# average and std of the simulation) and time vectorized draws of each sampler against the parametric distribution,
+# e.g.: python3 replicates.py --method bootstrap
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="replicates.py", description="Summarize replicate measurements and time "
+                                                                       "their samplers.")
+    parser.add_argument("--method", default=SAMPLING_METHOD, choices=SAMPLING_METHODS, help="sampling method")
+    parser.add_argument("--draws", type=float, default=1e6, help="variates drawn by each sampler")
+    options = parser.parse_args()
+
+    db_data = utils.get_database_data()
+    draws = int(options.draws)
+    for (quantity, table, avg_column, sem_column) in [("Fold Expansion", "Expansion Simulations",
+                                                       "Fold Expansion AVG", "Fold Expansion SEM"),
+                                                      ("Recovery Efficiency", "Recovery Simulations",
+                                                       "Recovery Efficiency AVG", "Recovery Efficiency SEM")]:
+        print(f'{quantity}:')
+        for name, simulation in db_data[table].iterrows():
+            std = utils.sem_to_std(simulation[sem_column], simulation["Experiment Sample Size"])
+            sampler = get_sampler(db_data, quantity, name, options.method)
+            if sampler is None:
+                print(f'  {name:<28} no replicates (parametric: {simulation[avg_column]:.3f} ± {std:.3f})')
+                continue
+
+            start_time = time.perf_counter()
+            variates = sampler.draw(draws)
+            draw_time = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            if quantity == "Fold Expansion":
+                nprand.normal(simulation[avg_column], std, draws)
+            else:
+                nprand.beta(*utils.alpha_beta(simulation[avg_column], std / 3), draws)
+            parametric_time = time.perf_counter() - start_time
+            print(f'  {name:<28} {len(sampler.measurements)} replicates: {sampler.mean:.3f} ± {sampler.std:.3f} '
+                  f'(parametric: {simulation[avg_column]:.3f} ± {std:.3f}), draws {variates.mean():.3f} ± '
+                  f'{variates.std():.3f} in {draw_time * 1e3:.1f} ms (parametric: {parametric_time * 1e3:.1f} ms)')
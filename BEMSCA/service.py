@@ -0,0 +1,299 @@
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import sys
+import urllib.parse
+import batch
+import sweep
+import utils
+import warehouse
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+SERVICE_DIRECTORY = "results/service"
+SERVICE_HOST = "127.0.0.1" # (only local clients, such as dashboards, are served by default)
+SERVICE_PORT = 8080
+MAX_REQUEST_SIZE = 1e6 # bytes
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+                413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for serving simulations over HTTP/JSON from a long-lived process. Database data and simulation
+# results are kept in memory between requests, simulations run on a pool of worker processes (which read a snapshot
+# of the database once) and identical requests received while a simulation is running share its computation
+class SimulationService():
+    # Initializer of class object
+    def __init__(self, workers=None, directory=SERVICE_DIRECTORY, database_file="database.db"):
+        # <>---------- Important Object Attributes ----------<>
+        self.workers = workers
+        self.directory = directory
+        self.database_file = database_file
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Simulation results and their records (see "sweep.summarize_results") of each (name, seed) key, and
+        # simulations or sweeps currently running
+        self.results = {}
+        self.records = {}
+        self.in_flight = {}
+
+        # Number of requests answered from memory (or by a running computation) and of computations started
+        self.cache_hits = 0
+        self.computations = 0
+
+        self.results_warehouse = warehouse.ResultsWarehouse()
+        self.executor = None
+        self.rendering = False # whether graphs of comparison reports were rendered (see "close")
+
+        # <>------------------- Main Body -------------------<>
+        self.reload()
+
+
+    # Function for (re)loading the database data and restarting the worker pool, discarding cached results.
+    # Simulations submitted to the previous pool still finish on it rather than being cancelled, so the clients
+    # waiting for them are answered (see "run_simulation"), while new simulations run on the new pool
+    def reload(self):
+        snapshot_file = os.path.join(self.directory, "database.db")
+        utils.snapshot_database(snapshot_file, self.database_file)
+        self.db_data = utils.get_database_data(snapshot_file)
+
+        # Workers are spawned rather than forked, so they do not inherit the connections of clients being answered
+        # (which would otherwise remain open until the workers exit)
+        executor = self.executor
+        self.executor = concurrent.futures.ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"),
+                                                               initializer=sweep.initialize_worker,
+                                                               initargs=(snapshot_file,))
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+        self.results.clear()
+        self.records.clear()
+
+
+    # Function for obtaining the record of a simulated set of bioprocess parameters (simulated only once for each
+    # seed, identical requests received during the simulation wait for the same computation)
+    async def simulate(self, bio_params_name, seed=None):
+        key = (bio_params_name, seed)
+        if key in self.records:
+            self.cache_hits += 1
+            return self.records[key]
+
+        if key not in self.in_flight:
+            self.in_flight[key] = asyncio.ensure_future(self.run_simulation(key))
+        else:
+            self.cache_hits += 1
+
+        # Shield computation so it is not cancelled when one of the clients waiting for it disconnects
+        return await asyncio.shield(self.in_flight[key])
+
+
+    # Function for running the simulation of a (name, seed) key on the worker pool and caching its results
+    async def run_simulation(self, key):
+        self.computations += 1
+        try:
+            # Repeat simulation if the database was reloaded while it was running
+            executor = None
+            while executor is not self.executor:
+                executor = self.executor
+                simulation_results = await asyncio.get_running_loop().run_in_executor(executor, batch.simulate_task,
+                                                                                      *key)
+
+            record = dict(simulation_results.summary)
+            record["Warehouse Run"] = self.results_warehouse.store(self.db_data, key[0], simulation_results)
+            self.results[key] = simulation_results
+            self.records[key] = record
+            return record
+        finally:
+            del self.in_flight[key]
+
+
+    # Function for running a sweep described by a sweep file (identical sweeps received while it is running wait
+    # for the same computation), returns its journal and number of completed tasks as presented by batch jobs
+    async def sweep(self, sweep_file):
+        (sweep_name, bio_params_names, axes, seed, workers) = sweep.read_sweep_file(sweep_file)
+        key = ("Sweep", sweep_name)
+        if key not in self.in_flight:
+            self.computations += 1
+            # The sweep's worker pool is spawned rather than forked, as the service's workers are (see "reload")
+            self.in_flight[key] = asyncio.get_running_loop().run_in_executor(
+                None, lambda: list(sweep.run_sweep(sweep_name, bio_params_names, axes, seed, workers or self.workers,
+                                                   mp_context=multiprocessing.get_context("spawn"))))
+            self.in_flight[key].add_done_callback(lambda future: self.in_flight.pop(key))
+        else:
+            self.cache_hits += 1
+        await asyncio.shield(self.in_flight[key])
+
+        return {"journal": os.path.join(sweep.SWEEP_DIRECTORY, f'{sweep_name}.jsonl'),
+                "completed tasks": len(sweep.read_sweep_results(sweep_name)),
+                "failed tasks": len(sweep.read_sweep_results(sweep_name, failed=True))}
+
+
+    # Function for running a job (same format as the jobs of "batch.py", along with an optional "seed"), returns
+    # the job with its "status" and "results" (or "error")
+    async def run_job(self, job):
+        job_output = dict(job)
+        errors = batch.validate_jobs(self.db_data, [job])
+        if errors:
+            job_output["status"] = "invalid"
+            job_output["error"] = '; '.join(errors)
+            return job_output
+
+        if job["command"] == "simulate":
+            job_output["results"] = {job["bioprocess parameters"]: await self.simulate(job["bioprocess parameters"],
+                                                                                      job.get("seed"))}
+        elif job["command"] == "compare":
+            # Simulate all sets of bioprocess parameters concurrently (graphs are not created by the service)
+            records = await asyncio.gather(*[self.simulate(sets, job.get("seed")) for sets in
+                                             job["bioprocess parameters"]])
+            job_output["results"] = dict(zip(job["bioprocess parameters"], records))
+        elif job["command"] == "report":
+            # Present the comparison report of the sets of bioprocess parameters (simulated concurrently) or of the
+            # completed tasks of a sweep, as batch jobs do (graphs are rendered in the background, and the table is
+            # written in a thread, so other requests are answered meanwhile)
+            records = {}
+            if "sweep" not in job:
+                records = dict(zip(job["bioprocess parameters"],
+                                   await asyncio.gather(*[self.simulate(sets, job.get("seed"))
+                                                          for sets in job["bioprocess parameters"]])))
+            self.rendering = True
+            job_output["results"] = await asyncio.get_running_loop().run_in_executor(None, batch.report_job, job,
+                                                                                     records)
+        elif job["command"] == "sweep":
+            job_output["results"] = await self.sweep(job["sweep file"])
+        else:
+            job_output["status"] = "invalid"
+            job_output["error"] = f'Unknown command "{job["command"]}"'
+            return job_output
+
+        job_output["status"] = "completed"
+        return job_output
+
+
+    # Function for answering a request, returns the HTTP status and response body
+    async def respond(self, method, path, body):
+        url = urllib.parse.urlsplit(path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+
+        # Simulate a single set of bioprocess parameters, e.g.: GET /simulate?name=Default&seed=0
+        if url.path == "/simulate" and method == "GET":
+            if "name" not in query:
+                return 400, {"error": 'Bioprocess parameters must be given as "name"'}
+            job = {"command": "simulate", "bioprocess parameters": query["name"]}
+            if "seed" in query:
+                job["seed"] = int(query["seed"])
+            job_output = await self.run_job(job)
+            return (400 if job_output["status"] == "invalid" else 200), job_output
+
+        # Run a job (or a list of "jobs") given as a JSON body
+        elif url.path == "/jobs" and method == "POST":
+            request = json.loads(body)
+            if "jobs" in request:
+                return 200, {"jobs": await asyncio.gather(*[self.run_job(job) for job in request["jobs"]])}
+            job_output = await self.run_job(request)
+            return (400 if job_output["status"] == "invalid" else 200), job_output
+
+        # List available bioprocess parameters and color palettes
+        elif url.path == "/parameters" and method == "GET":
+            return 200, {"bioprocess parameters": self.db_data["Bioprocess Parameters"].index.tolist(),
+                         "color palettes": self.db_data["Color Palettes"].index.tolist()}
+
+        # Present state of caches
+        elif url.path == "/status" and method == "GET":
+            return 200, {"cached results": [list(key) for key in self.records],
+                         "in flight": [list(key) for key in self.in_flight],
+                         "cache hits": self.cache_hits, "computations": self.computations}
+
+        # Reload database (e.g., after it was edited or new entries were imported), discarding cached results
+        elif url.path == "/reload" and method == "POST":
+            self.reload()
+            return 200, {"status": "reloaded"}
+
+        elif url.path in ["/simulate", "/jobs", "/parameters", "/status", "/reload"]:
+            return 405, {"error": f'Method {method} not allowed for {url.path}'}
+
+        return 404, {"error": f'Unknown path {url.path}'}
+
+
+    # Function for handling a client connection (one request per connection)
+    async def handle_connection(self, reader, writer):
+        try:
+            # Read request line, headers and body
+            (method, path, version) = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                (header, value) = line.split(":", 1)
+                headers[header.strip().lower()] = value.strip()
+
+            content_length = int(headers.get("content-length", 0))
+            if content_length > MAX_REQUEST_SIZE:
+                (status, response) = (413, {"error": "Request is too large"})
+            else:
+                body = await reader.readexactly(content_length)
+                try:
+                    (status, response) = await self.respond(method, path, body)
+                except (ValueError, KeyError, TypeError) as error:
+                    (status, response) = (400, {"error": repr(error)})
+                except Exception as error:
+                    (status, response) = (500, {"error": repr(error)})
+
+            # Write JSON response
+            payload = json.dumps(response).encode()
+            writer.write(f'HTTP/1.1 {status} {HTTP_REASONS[status]}\r\nContent-Type: application/json\r\n'
+                         f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'.encode("latin-1") + payload)
+            await writer.drain()
+
+        except (ValueError, ConnectionError, asyncio.IncompleteReadError):
+            # Ignore malformed requests and clients that disconnect before being answered
+            pass
+
+        finally:
+            writer.close()
+
+
+    # Function for serving requests until the service is interrupted
+    async def serve(self, host=SERVICE_HOST, port=SERVICE_PORT):
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print(f'BEMSCA service listening on http://{host}:{port} (press Ctrl+C to stop)')
+        async with server:
+            await server.serve_forever()
+
+
+    # Function for stopping the worker pool, waiting for graphs rendered in the background and closing the results
+    # warehouse
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.rendering:
+            batch.outputs.close_renderer()
+        self.results_warehouse.close()
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Run service until interrupted, e.g.: python3 service.py --port 8080 --workers 4
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="service.py", description="Serve BEMSCA simulations over HTTP/JSON.")
+    parser.add_argument("--host", default=SERVICE_HOST, help="address on which requests are accepted")
+    parser.add_argument("--port", type=int, default=SERVICE_PORT, help="port on which requests are accepted")
+    parser.add_argument("--workers", type=int, help="number of worker processes")
+    options = parser.parse_args()
+
+    service = SimulationService(options.workers)
+    try:
+        asyncio.run(service.serve(options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+        sys.exit(0)
@@ -0,0 +1,459 @@
+import argparse
+import itertools
+import math
+import sys
+import time
+import numpy as np
+import pandas as pd
+import bioprocess
+import export
+import instrumentation
+import sweep
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+BLOCK_VARIATES = 2**21 # scenarios x simulation runs evaluated at a time (bounds the memory of each stacked array)
+MAX_CYCLES = 20 # scenarios requiring more bioreactor expansion cycles are not evaluated (marked as not valid)
+
+# Class constants of "bioprocess.BioreactorExpansion" used by the Monte Carlo searches
+DECREASE_RATIO = 0.99
+MIN_FINAL_VOLUME = 1.8 # L
+
+# Power of each element of arrays computed by the C library (as by Python floats and numpy scalars, while array
+# powers may differ in the last digit), so results are identical to those of the sequential simulations
+power = np.vectorize(math.pow, otypes=[float])
+
+# Columns of a scenario which do not change its costs, only its Monte Carlo decisions (see "cost_workflows")
+DECISION_COLUMNS = ["Target Cell Number", "Minimum Threshold"]
+
+# Columns of the table of results (same fields as "sweep.summarize_results")
+RESULT_COLUMNS = ["Required Cycles", "Optimal Fold Increase", "Planar Duration", "Bioreactor Duration",
+                  "Overall Duration", "Consumables Cost", "Reagents Cost", "Facility Cost", "Labor Cost",
+                  "Medium Cost", "Overall Cost", "Average Final Cell Number", "Confidence Level"]
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for building a table of scenarios (rows in the format of the "Bioprocess Parameters" table, named after
+# their set of bioprocess parameters) over a grid of parameters, as in sweep files. Only columns of the "Bioprocess
+# Parameters" table can be swept, since scenarios do not carry their own copy of the referenced tables
+def build_scenarios(db_data, bio_params_names, axes):
+    for axis in axes:
+        if not isinstance(axis, str):
+            raise ValueError(f'Axis {list(axis)} is not a column of the "Bioprocess Parameters" table (stacked '
+                             f'evaluation only sweeps bioprocess parameters, run a sweep instead)')
+
+    grid = list(itertools.product(*axes.values()))
+    scenarios = db_data["Bioprocess Parameters"].loc[np.repeat(bio_params_names, len(grid))].copy()
+    for i, axis in enumerate(axes):
+        scenarios[axis] = [values[i] for values in grid] * len(bio_params_names)
+
+    return scenarios
+
+
+# Function for compiling the parameters of the Monte Carlo decisions of each scenario as arrays (computed once for
+# each Expansion, Recovery Simulation and set of bioreactors, exactly as in "bioprocess.BioreactorExpansion"): fold
+# expansion mean and std, recovery efficiency alpha and beta, average fold increase (initial fold increase cap),
+# minimum volume of the bioreactors, initial cells, target total fold increase (tfi), target cell number and the
+# percentile of the threshold test
+def compile_scenarios(db_data, scenarios):
+    expansion_simulations = db_data["Expansion Simulations"]
+    recovery_simulations = db_data["Recovery Simulations"]
+
+    fold_exp_std = {name: utils.sem_to_std(expansion_simulations.at[name, "Fold Expansion SEM"],
+                                           expansion_simulations.at[name, "Experiment Sample Size"])
+                    for name in scenarios["Expansion Simulation"].unique()}
+    recovery_eff_alpha_beta = {}
+    for name in scenarios["Recovery Simulation"].unique():
+        # (the recovery efficiency std is divided by 3, see "BioreactorExpansion.simulate_bioreactor_expansion")
+        recovery_eff_std = utils.sem_to_std(recovery_simulations.at[name, "Recovery Efficiency SEM"],
+                                            recovery_simulations.at[name, "Experiment Sample Size"]) / 3
+        recovery_eff_alpha_beta[name] = utils.alpha_beta(recovery_simulations.at[name, "Recovery Efficiency AVG"],
+                                                         recovery_eff_std)
+    min_volumes = {bioreactors: db_data["Bioreactors"].loc[bioreactors.split(";"), "Min Volume"].min()
+                   for bioreactors in scenarios["Bioreactors"].unique()}
+
+    expansion = scenarios["Expansion Simulation"]
+    recovery = scenarios["Recovery Simulation"]
+    parameters = {"Fold Expansion AVG": expansion.map(expansion_simulations["Fold Expansion AVG"]).to_numpy(float),
+                  "Fold Expansion STD": expansion.map(fold_exp_std).to_numpy(float),
+                  "Recovery Efficiency Alpha": recovery.map(lambda name: recovery_eff_alpha_beta[name][0])
+                                                       .to_numpy(float),
+                  "Recovery Efficiency Beta": recovery.map(lambda name: recovery_eff_alpha_beta[name][1])
+                                                      .to_numpy(float),
+                  "Min Volume": scenarios["Bioreactors"].map(min_volumes).to_numpy(float),
+                  "Target Cell Number": scenarios["Target Cell Number"].to_numpy(float)}
+    parameters["Average Fold Increase"] = (parameters["Fold Expansion AVG"]
+                                           * recovery.map(recovery_simulations["Recovery Efficiency AVG"])
+                                                     .to_numpy(float))
+    parameters["Initial Cells"] = (expansion.map(expansion_simulations["Seeding Density"]).to_numpy(float)
+                                   * parameters["Min Volume"] * 1e3)
+    parameters["TFI"] = parameters["Target Cell Number"] / parameters["Initial Cells"]
+    parameters["Percentile"] = (1 - scenarios["Minimum Threshold"].to_numpy(float)) * 100
+
+    return parameters
+
+
+# Function for testing whether each row of an array respects the minimum threshold, i.e. whether its percentile (at
+# the percentile of its row) reaches the target total fold increase (tfi) of its row, as "np.percentile(row,
+# percentile) >= tfi". Rows are decided by counting their values below the tfi (the percentile lies between the
+# values around its position), except for rows whose count is too close to the position of the percentile, which are
+# decided by "np.percentile" itself (so decisions are identical to the sequential searches)
+def respect_threshold(values, percentiles, tfi):
+    below = (values < tfi[:, np.newaxis]).sum(axis=1)
+    position = np.floor(percentiles / 100 * (values.shape[1] - 1)).astype(int)
+    respected = below < position
+
+    undecided = np.flatnonzero((below >= position) & (below <= position + 2))
+    for percentile in np.unique(percentiles[undecided]):
+        rows = undecided[percentiles[undecided] == percentile]
+        respected[rows] = np.percentile(values[rows], percentile, axis=1) >= tfi[rows]
+
+    return respected
+
+
+# Function for drawing the fold increase variates of a cycle for each distribution (rows of "distributions", with
+# their fold expansion mean and std and recovery efficiency alpha and beta) from the common random numbers of the
+# cycle, exactly as the common Monte Carlo engine (see "BioreactorExpansion.sample_common_fold_increases")
+def draw_cycle_variates(distributions, cycle, runs):
+    (z, u) = bioprocess.draw_common_variates(cycle, runs)
+    variates = np.empty((len(distributions), runs))
+    for i, (mean, std, alpha, beta) in enumerate(distributions):
+        variates[i] = (mean + std * z) * utils.beta_quantiles(u, alpha, beta)
+
+    instrumentation.count("Cached Cycle Variates", len(distributions) * runs)
+    return variates
+
+
+# Function for searching the required cycles and optimal fold increase of a block of scenarios at once, given their
+# compiled parameters (see "compile_scenarios"). The cycle search tests every unresolved scenario with the same
+# number of cycles at each step (scenarios are dropped as soon as they respect the threshold). Since fold increases
+# are limited by a lower cap in every run, the threshold test can only fail more often for lower caps, so the cap
+# search bisects the sequence of caps of each scenario (starting at the average fold increase and decreasing by
+# "DECREASE_RATIO" down to the minimum fold increase) instead of testing every cap. Results are the same as the
+# sequential searches of the common Monte Carlo engine. Returns the required cycles, optimal fold increase, fold
+# increase distribution of the last accepted cap and validity of each scenario (not valid if more than MAX_CYCLES
+# cycles are required, if a single cycle is required or if the average fold increase already disrespects the
+# threshold, which the sequential searches cannot simulate either)
+def search_block(parameters, runs):
+    n_scenarios = len(parameters["TFI"])
+    distributions = np.stack([parameters["Fold Expansion AVG"], parameters["Fold Expansion STD"],
+                              parameters["Recovery Efficiency Alpha"], parameters["Recovery Efficiency Beta"]],
+                             axis=1)
+    (distributions, distribution_index) = np.unique(distributions, axis=0, return_inverse=True)
+    distribution_index = distribution_index.reshape(-1)
+    cycle_variates = []
+
+    # Variates of a cycle for the given scenarios (broadcast if the block has a single distribution, as blocks of
+    # scenarios sorted by distribution usually have)
+    def scenario_variates(cycle, scenarios):
+        if len(distributions) == 1:
+            return cycle_variates[cycle-1]
+        return cycle_variates[cycle-1][distribution_index[scenarios]]
+
+    # <>------------------ Cycle Search -----------------<>
+    required_cycles = np.zeros(n_scenarios, dtype=int)
+    unresolved = np.arange(n_scenarios)
+    fold_increase = np.ones((n_scenarios, runs))
+    while len(unresolved) and len(cycle_variates) < MAX_CYCLES:
+        cycle_variates.append(draw_cycle_variates(distributions, len(cycle_variates), runs))
+        fold_increase *= scenario_variates(len(cycle_variates), unresolved)
+        instrumentation.count("Cycle Search Iterations", len(unresolved))
+
+        respected = respect_threshold(fold_increase, parameters["Percentile"][unresolved],
+                                      parameters["TFI"][unresolved])
+        required_cycles[unresolved[respected]] = len(cycle_variates)
+        (unresolved, fold_increase) = (unresolved[~respected], fold_increase[~respected])
+
+    # <>------------------- Cap Search ------------------<>
+    valid = required_cycles > 1
+    min_fold_increase = power(MIN_FINAL_VOLUME / parameters["Min Volume"], 1 / np.maximum(required_cycles - 1, 1))
+
+    # Sequence of caps of each scenario (the last cap of a scenario is its minimum fold increase)
+    caps = [parameters["Average Fold Increase"].copy()]
+    last_cap = np.where(valid, -1, 0)
+    while (last_cap < 0).any():
+        cap = caps[-1] * DECREASE_RATIO
+        reached = cap < min_fold_increase
+        cap[reached] = min_fold_increase[reached]
+        last_cap[(last_cap < 0) & (cap == min_fold_increase)] = len(caps)
+        caps.append(cap)
+    caps = np.stack(caps, axis=1)
+
+    # Bisect sequence of caps (every cap up to "accepted" respects the threshold, "rejected" is the first cap
+    # known to disrespect it)
+    accepted = np.full(n_scenarios, -1)
+    rejected = last_cap + 1
+    fold_increase_pd = np.empty((n_scenarios, runs))
+    while True:
+        searching = np.flatnonzero(valid & (rejected - accepted > 1))
+        if not len(searching):
+            break
+        step = (accepted[searching] + rejected[searching]) // 2
+        cap = caps[searching, step]
+        instrumentation.count("Cap Search Iterations", len(searching))
+
+        respected = np.empty(len(searching), dtype=bool)
+        for cycles in np.unique(required_cycles[searching]):
+            rows = required_cycles[searching] == cycles
+            fold_increase = np.ones((rows.sum(), runs))
+            for cycle in range(1, cycles+1):
+                fold_increase *= scenario_variates(cycle, searching[rows])
+
+                # Limit fold increase of a cycle to the cap (except for the last cycle)
+                if cycle != cycles:
+                    np.minimum(fold_increase, power(cap[rows, np.newaxis], cycle), out=fold_increase)
+
+            respected[rows] = respect_threshold(fold_increase, parameters["Percentile"][searching[rows]],
+                                                parameters["TFI"][searching[rows]])
+            fold_increase_pd[searching[rows & respected]] = fold_increase[respected[rows]]
+
+        accepted[searching[respected]] = step[respected]
+        rejected[searching[~respected]] = step[~respected]
+
+    # Optimal fold increase is the minimum fold increase if every cap was accepted, else the cap above the first
+    # rejected cap (as the sequential search undoes its last decrease)
+    valid &= accepted >= 0
+    rows = np.arange(n_scenarios)
+    optimal_fold_increase = np.where(accepted == last_cap, caps[rows, np.maximum(accepted, 0)],
+                                     caps[rows, np.minimum(rejected, caps.shape[1] - 1)] * (1 / DECREASE_RATIO))
+    optimal_fold_increase[~valid] = np.nan
+
+    return required_cycles, optimal_fold_increase, fold_increase_pd, valid
+
+
+# Function for assigning bioreactors to each expansion cycle of every scenario at once, exactly as "bioprocess.
+# BioreactorExpansion.assign_bioreactors" (the bioreactor type needing the fewest bioreactors among those which can
+# be properly filled, the first of the scenario's bioreactors on ties, correcting the medium volumes of previous
+# cycles when the bioreactors cannot be properly filled). Bioreactor types are the rows of the "Bioreactors" table
+# and "positions" is the position of each type in the bioreactors of each scenario (np.inf if not used). Returns the
+# total medium volume and the number of bioreactors of each type of each scenario, and whether bioreactors could be
+# assigned to every cycle
+def assign_bioreactors(bioreactors, positions, min_volume, required_cycles, optimal_fold_increase):
+    n_scenarios = len(required_cycles)
+    cycle_medium_volumes = min_volume[:, np.newaxis] * power(optimal_fold_increase[:, np.newaxis],
+                                                             np.arange(max(required_cycles.max(initial=0), 1)))
+    n_bioreactors = np.zeros((n_scenarios, len(bioreactors)))
+    assigned = np.ones(n_scenarios, dtype=bool)
+    for cycle in range(cycle_medium_volumes.shape[1]):
+        rows = np.flatnonzero(assigned & (required_cycles > cycle))
+        volume = cycle_medium_volumes[rows, cycle, np.newaxis]
+
+        # Bioreactor types where at least 1 bioreactor can be properly filled, and the least number of bioreactors
+        # of each type which can contain the medium volume
+        fillable = (np.floor(volume / bioreactors["Min Volume"].to_numpy()) > 0) & np.isfinite(positions[rows])
+        required = np.where(fillable, np.ceil(volume / bioreactors["Max Volume"].to_numpy()), np.inf)
+        selected = np.where(required == required.min(axis=1, keepdims=True), positions[rows], np.inf).argmin(axis=1)
+
+        assigned[rows[~fillable.any(axis=1)]] = False
+        rows_required = required[np.arange(len(rows)), selected]
+        n_bioreactors[rows, selected] += np.where(np.isfinite(rows_required), rows_required, 0)
+
+        # Correct medium volumes if the required bioreactors cannot be properly filled
+        min_volumes = bioreactors["Min Volume"].to_numpy()[selected] * rows_required
+        corrected = rows[(volume[:, 0] < min_volumes) & np.isfinite(rows_required)]
+        if len(corrected) and cycle == 0:
+            assigned[corrected] = False
+        elif len(corrected):
+            corrected_fold_increase = power(min_volumes[np.isin(rows, corrected)] / cycle_medium_volumes[corrected, 0],
+                                            1/cycle)
+            for index in range(1, cycle+1):
+                cycle_medium_volumes[corrected, index] = (cycle_medium_volumes[corrected, index-1]
+                                                          * corrected_fold_increase)
+
+    # Total medium volume (scenarios with the same number of cycles are summed together, as a single scenario)
+    medium_volume = np.zeros(n_scenarios)
+    for cycles in np.unique(required_cycles[required_cycles > 0]):
+        rows = required_cycles == cycles
+        medium_volume[rows] = cycle_medium_volumes[rows, :cycles].sum(axis=1)
+
+    return medium_volume, n_bioreactors, assigned
+
+
+# Function for determining the costs and durations of each scenario from its Monte Carlo decisions, as stacked array
+# computations. Costs are linear in the total medium volume, number of bioreactors of each type and number of cycles
+# of the bioreactor workflow (see "assign_bioreactors"), with coefficients which only depend on the columns of a
+# scenario that are not decision columns, so planar expansions and coefficients are determined once for each
+# distinct combination of those columns (as in "bioprocess.Bioprocess"). Returns a dictionary of arrays of each
+# cost and duration field (NaN for scenarios which are not valid) and whether bioreactors could be assigned
+def cost_workflows(db_data, scenarios, required_cycles, optimal_fold_increase, valid):
+    bioreactors = db_data["Bioreactors"]
+    d_facility_cost = bioprocess.Bioprocess.determine_daily_facility_cost(db_data)
+    d_labor_cost = bioprocess.Bioprocess.determine_daily_labor_cost(db_data)
+    equipment_lifespan = db_data["Facility Specifications"].loc["Equipment Lifespan"].item()
+    energy_cost = db_data["Facility Specifications"].loc["Energy Cost"].item()
+
+    # Coefficients of each distinct combination of cost columns
+    cost_columns = [column for column in scenarios.columns if column not in DECISION_COLUMNS]
+    cost_groups = scenarios.groupby(cost_columns, sort=False, dropna=False).ngroup().to_numpy()
+    (_, first_scenario) = np.unique(cost_groups, return_index=True)
+    coefficients = {name: np.empty(len(first_scenario)) for name in
+                    ["Planar Consumables", "Planar Reagents", "Planar Facility", "Planar Labor", "Planar Medium",
+                     "Planar Overall", "Planar Duration", "Culture Time", "Enzyme", "ROCKi", "Volumes Spent",
+                     "Medium", "Initial QC", "Flow Cytometry", "Final QC"]}
+    positions = np.full((len(first_scenario), len(bioreactors)), np.inf)
+    for group, scenario in enumerate(first_scenario):
+        bio_params = scenarios.iloc[[scenario]]
+        planar_expansion = bioprocess.PlanarExpansion(db_data, bio_params, d_facility_cost, d_labor_cost)
+        expansion_simulation = db_data["Expansion Simulations"].loc[bio_params["Expansion Simulation"].item()]
+        coefficients["Planar Consumables"][group] = planar_expansion.T_consumables_cost
+        coefficients["Planar Reagents"][group] = planar_expansion.T_reagents_cost
+        coefficients["Planar Facility"][group] = planar_expansion.T_facility_cost
+        coefficients["Planar Labor"][group] = planar_expansion.T_labor_cost
+        coefficients["Planar Medium"][group] = planar_expansion.T_medium_cost
+        coefficients["Planar Overall"][group] = planar_expansion.overall_cost
+        coefficients["Planar Duration"][group] = planar_expansion.duration
+        coefficients["Culture Time"][group] = expansion_simulation["Bioreactor Culture Time"]
+        coefficients["Enzyme"][group] = db_data["Reagents"].loc[bio_params["Dissociation Enzyme"].item()].item()
+        coefficients["ROCKi"][group] = db_data["Reagents"].loc[bioprocess.ROCKI].item()
+        coefficients["Volumes Spent"][group] = expansion_simulation["Bioreactor Volumes Spent"]
+        coefficients["Medium"][group] = db_data["Reagents"].loc[expansion_simulation["Culture Medium"]].item()
+        (coefficients["Initial QC"][group], coefficients["Flow Cytometry"][group],
+         coefficients["Final QC"][group]) = bioprocess.BioreactorExpansion.determine_quality_control_costs(
+            db_data, expansion_simulation["Culture Medium"], bio_params["Coating Substrate"].item())
+        for position, name in enumerate(bio_params["Bioreactors"].item().split(";")):
+            positions[group, bioreactors.index.get_loc(name)] = position
+    coefficients = {name: values[cost_groups] for name, values in coefficients.items()}
+
+    # Bioreactor workflow of each scenario
+    cycles = np.where(valid, required_cycles, 0)
+    (medium_volume, n_bioreactors, assigned) = assign_bioreactors(bioreactors, positions[cost_groups],
+                                                                  bioreactors["Min Volume"].to_numpy()[np.argmin(
+                                                                      positions[cost_groups], axis=1)],
+                                                                  cycles, np.where(valid, optimal_fold_increase, 1))
+
+    # Bioreactor expansion costs (as "BioreactorExpansion.determine_bioreactor_expansion_cost")
+    # (summed over bioreactor types, in the same order of operations, so costs are identical)
+    diss_enz_volume = (n_bioreactors * bioreactors["Max Volume"].to_numpy() * 0.2).sum(axis=1)
+    bioreactor_duration = cycles * coefficients["Culture Time"] + 3
+    consumables_cost = (n_bioreactors * bioreactors["Use Cost"].to_numpy()).sum(axis=1)
+    medium_cost = medium_volume * coefficients["Volumes Spent"] * coefficients["Medium"]
+    reagents_cost = (diss_enz_volume * coefficients["Enzyme"] + (diss_enz_volume + medium_volume)
+                     * coefficients["ROCKi"] + medium_cost
+                     + (coefficients["Initial QC"] + coefficients["Flow Cytometry"] * (cycles - 1)
+                        + coefficients["Final QC"]))
+    d_bioreactor_depreciation = ((n_bioreactors * bioreactors["Acquisition Cost"].to_numpy()).sum(axis=1)
+                                 / (equipment_lifespan * bioprocess.YEAR_TO_DAYS))
+    facility_cost = (d_facility_cost * bioreactor_duration
+                     + (n_bioreactors * bioreactors["Energy Consumption"].to_numpy()
+                        * coefficients["Culture Time"][:, np.newaxis]).sum(axis=1) * energy_cost)
+    labor_cost = d_labor_cost * bioreactor_duration
+    overall_cost = consumables_cost + reagents_cost + facility_cost + labor_cost
+
+    # Bioreactor depreciation is paid during both phases (as in "bioprocess.Bioprocess")
+    planar_depreciation = d_bioreactor_depreciation * coefficients["Planar Duration"]
+    bioreactor_depreciation = d_bioreactor_depreciation * bioreactor_duration
+    costs = {"Planar Duration": coefficients["Planar Duration"], "Bioreactor Duration": bioreactor_duration,
+             "Overall Duration": coefficients["Planar Duration"] + bioreactor_duration,
+             "Consumables Cost": coefficients["Planar Consumables"] + consumables_cost,
+             "Reagents Cost": coefficients["Planar Reagents"] + reagents_cost,
+             "Facility Cost": ((coefficients["Planar Facility"] + planar_depreciation)
+                               + (facility_cost + bioreactor_depreciation)),
+             "Labor Cost": coefficients["Planar Labor"] + labor_cost,
+             "Medium Cost": coefficients["Planar Medium"] + medium_cost,
+             "Overall Cost": ((coefficients["Planar Overall"] + planar_depreciation)
+                              + (overall_cost + bioreactor_depreciation))}
+    for field in costs:
+        costs[field] = np.where(valid & assigned, costs[field], np.nan)
+
+    return costs, assigned
+
+
+# Function for evaluating a table of scenarios (see "build_scenarios") as stacked array computations, returns a table
+# of results with a row per scenario (same fields as "sweep.summarize_results", plus whether each scenario is
+# "Valid"). Identical scenarios are only evaluated once, and distinct scenarios are searched in blocks of up to
+# BLOCK_VARIATES variates (see "search_block"), sorted so scenarios sharing their fold increase distributions are
+# searched together. Every scenario is simulated with the common random numbers of "runs" simulation runs (by
+# default "bioprocess.SIMULATION_RUNS"), so results match those of the common Monte Carlo engine (in deterministic
+# planar mode)
+def evaluate_scenarios(db_data, scenarios, runs=None):
+    if bioprocess.PLANAR_MODE == "stochastic":
+        raise ValueError('Stacked evaluation only supports the deterministic planar mode')
+    runs = bioprocess.SIMULATION_RUNS if runs is None else runs
+
+    with instrumentation.span("Scenario Compilation"):
+        parameters = compile_scenarios(db_data, scenarios)
+        decision_inputs = np.stack([parameters[name] for name in ["Fold Expansion AVG", "Fold Expansion STD",
+                                                                  "Recovery Efficiency Alpha",
+                                                                  "Recovery Efficiency Beta",
+                                                                  "Average Fold Increase", "Min Volume",
+                                                                  "Percentile", "TFI"]], axis=1)
+        (first_scenario, scenario_index) = np.unique(decision_inputs, axis=0, return_index=True,
+                                                     return_inverse=True)[1:]
+        scenario_index = scenario_index.reshape(-1)
+        distinct = {name: values[first_scenario] for name, values in parameters.items()}
+
+    required_cycles = np.zeros(len(first_scenario), dtype=int)
+    optimal_fold_increase = np.empty(len(first_scenario))
+    valid = np.empty(len(first_scenario), dtype=bool)
+    average_fin_cell_number = np.empty(len(first_scenario))
+    confidence_level = np.empty(len(first_scenario))
+    block = max(BLOCK_VARIATES // runs, 1)
+    with instrumentation.span("Stacked Search"):
+        for start in range(0, len(first_scenario), block):
+            rows = slice(start, start + block)
+            block_parameters = {name: values[rows] for name, values in distinct.items()}
+            (required_cycles[rows], optimal_fold_increase[rows], fold_increase_pd,
+             valid[rows]) = search_block(block_parameters, runs)
+
+            # Average final cell number and confidence level of the last accepted cap (as "bioprocess.Bioprocess")
+            fin_cell_number_pd = fold_increase_pd * block_parameters["Initial Cells"][:, np.newaxis]
+            average_fin_cell_number[rows] = np.average(fin_cell_number_pd, axis=1)
+            confidence_level[rows] = ((fin_cell_number_pd >= block_parameters["Target Cell Number"][:, np.newaxis])
+                                      .sum(axis=1) / runs) * 100
+
+    # Gather results of distinct scenarios for every scenario
+    (required_cycles, optimal_fold_increase, valid) = (required_cycles[scenario_index],
+                                                       optimal_fold_increase[scenario_index], valid[scenario_index])
+    with instrumentation.span("Workflow Costs"):
+        (costs, assigned) = cost_workflows(db_data, scenarios, required_cycles, optimal_fold_increase, valid)
+        valid &= assigned
+
+    results = pd.DataFrame({"Required Cycles": required_cycles, "Optimal Fold Increase": optimal_fold_increase,
+                            **costs,
+                            "Average Final Cell Number": np.where(valid, average_fin_cell_number[scenario_index],
+                                                                  np.nan),
+                            "Confidence Level": np.where(valid, confidence_level[scenario_index], np.nan),
+                            "Valid": valid}, index=scenarios.index)
+    return results
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Evaluate the grid of a sweep file (whose axes must be columns of the "Bioprocess Parameters" table) as stacked
+# array computations, optionally exporting the table of results to a JSON Lines, CSV or Parquet file, e.g.:
+# python3 stacked.py sweep.json --runs 10000 --export results/stacked.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="stacked.py", description="Evaluate many scenarios at once as stacked "
+                                                                    "array computations.")
+    parser.add_argument("sweep_file", help="sweep file")
+    parser.add_argument("--runs", type=int, help="simulation runs of each scenario")
+    parser.add_argument("--export", help="JSON Lines, CSV or Parquet file")
+    options = parser.parse_args()
+
+    (sweep_name, bio_params_names, axes, seed, workers) = sweep.read_sweep_file(options.sweep_file)
+    db_data = utils.get_database_data()
+    try:
+        scenarios = build_scenarios(db_data, bio_params_names, axes)
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        sys.exit(1)
+
+    start_time = time.perf_counter()
+    results = evaluate_scenarios(db_data, scenarios, options.runs)
+    elapsed_time = time.perf_counter() - start_time
+
+    print(results.to_string(max_rows=20))
+    print(f'\nEvaluated {len(results):,} scenarios ({results["Valid"].sum():,} valid) of sweep "{sweep_name}" in '
+          f'{elapsed_time:.2f} s ({len(results) / elapsed_time:,.0f} scenarios per second)')
+
+    if options.export:
+        with export.RecordWriter(options.export) as writer:
+            for (name, values, row) in zip(scenarios.index, scenarios[list(axes)].to_dict("records"),
+                                           results.to_dict("records")):
+                writer.write({"Name": name, **values, **row})
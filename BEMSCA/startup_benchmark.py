@@ -0,0 +1,57 @@
+import statistics
+import subprocess
+import sys
+import time
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+BENCHMARK_RUNS = 5
+HEAVY_MODULES = ["matplotlib", "numpy", "pandas"] # must not be imported before they are used
+STARTUP_BUDGET = 0.5 # s (median time of starting BEMSCA, typing "help" and quitting)
+STARTUP_INPUT = "Help\nQuit\n"
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for measuring the time it takes to start BEMSCA, execute a short interactive session and quit
+def measure_startup_time(runs=BENCHMARK_RUNS):
+    startup_times = []
+    for run in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "main.py"], input=STARTUP_INPUT, capture_output=True, text=True, check=True)
+        startup_times.append(time.perf_counter() - start)
+
+    return statistics.median(startup_times)
+
+
+# Function for determining which heavy modules are imported during a short interactive session (or while running
+# the given interpreter arguments, e.g. ["-c", "import main"]). Modules deferred by "utils.lazy_import" are already in
+# sys.modules before they are used, so imports are detected from the import time report instead
+def determine_imported_heavy_modules(arguments=("main.py",), session_input=STARTUP_INPUT):
+    session = subprocess.run([sys.executable, "-X", "importtime", *arguments], input=session_input,
+                             capture_output=True, text=True, check=True)
+
+    # Each line of the import time report ends with the name of an imported module
+    imported_modules = {line.split("|")[-1].strip().split(".")[0] for line in session.stderr.splitlines()
+                        if line.startswith("import time:")}
+
+    return sorted(imported_modules.intersection(HEAVY_MODULES))
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Check startup time against its budget, e.g.: python3 startup_benchmark.py (exits with code 1 if it is exceeded)
+if __name__ == "__main__":
+    startup_time = measure_startup_time()
+    heavy_modules = sorted(set(determine_imported_heavy_modules())
+                           | set(determine_imported_heavy_modules(["-c", "import main"], "")))
+
+    print(f'STARTUP TIME: {startup_time:.3f} s (budget: {STARTUP_BUDGET:.3f} s)')
+    print(f'HEAVY MODULES IMPORTED AT STARTUP: {heavy_modules}')
+
+    if startup_time > STARTUP_BUDGET or heavy_modules:
+        sys.exit(1)
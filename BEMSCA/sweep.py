@@ -0,0 +1,276 @@
+import concurrent.futures
+import contextlib
+import itertools
+import json
+import os
+import sys
+import numpy as np
+import numpy.random as nprand
+import bioprocess
+import export
+import instrumentation
+import utils
+
+# Modules only loaded when they are first used (see "utils.lazy_import")
+decisionindex = utils.lazy_import("decisionindex")
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+SWEEP_DIRECTORY = "results/sweeps"
+WARM_START_CHUNK = 8 # largest number of consecutive tasks of a chain, each warm-started from the previous solution
+WARM_START_CHAINS = 32 # smallest number of chains of a sweep (with enough tasks), so that many workers are kept busy
+
+# Database data of worker processes (loaded once per worker from the sweep's database snapshot)
+worker_data = None
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for building the tasks of a sweep over a grid of parameters. Each axis is either a column of the
+# "Bioprocess Parameters" table or a (table, entry, column) tuple of a referenced table, mapped to its values.
+# Each task is a (key, bioprocess parameters name, overrides, seed) tuple, where overrides are (axis, value) pairs
+def build_tasks(bio_params_names, axes, seed=0):
+    tasks = []
+    grid = list(itertools.product(*axes.values()))
+    for i, (bio_params_name, values) in enumerate(itertools.product(bio_params_names, grid)):
+        overrides = list(zip(axes.keys(), values))
+        key = json.dumps([bio_params_name, overrides, seed + i])
+        tasks.append((key, bio_params_name, overrides, seed + i))
+
+    return tasks
+
+
+# Function for splitting the tasks of a sweep into chains of consecutive tasks (neighbouring points of the grid), each
+# task of a chain being warm-started from the solution of the previous one (see "warm_start_hint"). Chains only depend
+# on the order of the tasks, so every task is warm-started from the same task whichever worker simulates it and
+# whether or not the sweep was resumed (which keeps the results of seeded sweeps reproducible). Unless given, the
+# length of the chains is WARM_START_CHUNK, or less for sweeps with fewer tasks than WARM_START_CHAINS full chains
+def build_chains(tasks, chunk=None):
+    if chunk is None:
+        chunk = max(min(WARM_START_CHUNK, len(tasks) // WARM_START_CHAINS), 1)
+    return [tasks[i:i+chunk] for i in range(0, len(tasks), chunk)]
+
+
+# Function for determining the warm-start hint of a task (see "BioreactorExpansion.simulate_bioreactor_expansion")
+# from the record of the previous task of its chain, if any and if of the same bioprocess parameters
+def warm_start_hint(task, previous_record=None):
+    if previous_record is None or previous_record["Name"] != task[1]:
+        return None
+
+    return previous_record["Required Cycles"], previous_record["Optimal Fold Increase"]
+
+
+# Function for applying the overrides of a task to database data and bioprocess parameters (only overridden
+# tables are copied, all other tables are shared with the original database data)
+def apply_overrides(db_data, bio_params_name, overrides):
+    task_data = dict(db_data)
+    bio_params = db_data["Bioprocess Parameters"].loc[[bio_params_name]].copy()
+    for (axis, value) in overrides:
+        if isinstance(axis, str):
+            bio_params[axis] = value
+        else:
+            (table, name, column) = axis
+            if task_data[table] is db_data[table]:
+                task_data[table] = db_data[table].copy()
+            # Integer columns are converted to floats for fractional values (which would otherwise be truncated)
+            if (np.issubdtype(task_data[table][column].dtype, np.integer) and isinstance(value, float)
+                    and not value.is_integer()):
+                task_data[table][column] = task_data[table][column].astype(float)
+            task_data[table].at[name, column] = value
+
+    return task_data, bio_params
+
+
+# Function for summarizing the results of a simulated bioprocess as a record (dictionary of plain values),
+# optionally including its planar and bioreactor expansion workflows
+def summarize_results(simulation_results, workflows=False):
+    record = {"Required Cycles": int(simulation_results.bioreactor_expansion.monte_carlo[0]),
+              "Optimal Fold Increase": float(simulation_results.bioreactor_expansion.monte_carlo[1]),
+              "Planar Duration": float(simulation_results.planar_expansion.duration),
+              "Bioreactor Duration": float(simulation_results.bioreactor_expansion.duration),
+              "Overall Duration": float(simulation_results.bioprocess_duration),
+              "Consumables Cost": float(simulation_results.bioprocess_consumables_cost),
+              "Reagents Cost": float(simulation_results.bioprocess_reagents_cost),
+              "Facility Cost": float(simulation_results.bioprocess_facility_cost),
+              "Labor Cost": float(simulation_results.bioprocess_labor_cost),
+              "Medium Cost": float(simulation_results.bioprocess_medium_cost),
+              "Overall Cost": float(simulation_results.bioprocess_overall_cost),
+              "Average Final Cell Number": float(simulation_results.avg_fin_cell_number),
+              "Confidence Level": float(simulation_results.confidence_level)}
+
+    if workflows:
+        # Planar workflow as the number of surfaces of each passage, bioreactor workflow as the medium volume (L)
+        # and number of bioreactors of each type used in each cycle
+        (cycle_medium_volumes, required_bioreactors) = simulation_results.bioreactor_expansion.bioreactor_workflow
+        record["Planar Workflow"] = [int(surfaces) for surfaces in simulation_results.planar_expansion.planar_workflow]
+        record["Bioreactor Workflow"] = [{"Volume": float(volume),
+                                          "Bioreactors": {bioreactor: int(number)
+                                                          for bioreactor, number in required_bioreactors.loc[cycle].items()
+                                                          if number > 0}}
+                                         for cycle, volume in zip(required_bioreactors.index, cycle_medium_volumes)]
+
+    return record
+
+
+# Function for initializing a worker process (database data is read once from the sweep's snapshot, which is never
+# written to, so tasks only carry their overrides). Instrumentation of the worker's tasks is enabled with the given
+# options, if any (see "instrumentation.enable"), and tasks are simulated with the given Monte Carlo engine and planar
+# mode, if any (see "bioprocess.ENGINES" and "bioprocess.PLANAR_MODE"), looking up their Monte Carlo decisions in the
+# given decision index file, if any (see "decisionindex.enable")
+def initialize_worker(snapshot_file, instrument=None, engine=None, planar_mode=None, decision_index=None):
+    global worker_data
+    if instrument is not None:
+        instrumentation.enable(**instrument)
+    if engine is not None:
+        bioprocess.ENGINE = engine
+    if planar_mode is not None:
+        bioprocess.PLANAR_MODE = planar_mode
+    if decision_index is not None:
+        decisionindex.enable(decision_index)
+    worker_data = utils.get_database_data(snapshot_file)
+
+
+# Function for running a task of a sweep (in a worker process), returns the record of its results. The Monte Carlo
+# search can be warm-started from the solution of a neighbouring task (see "BioreactorExpansion.
+# simulate_bioreactor_expansion")
+def run_task(task, hint=None):
+    (key, bio_params_name, overrides, seed) = task
+    instrumentation.reset()
+    (task_data, bio_params) = apply_overrides(worker_data, bio_params_name, overrides)
+
+    # Simulate bioprocess with a seed specific to the task (so results are reproducible when resuming, regardless of
+    # the tasks previously run by the worker)
+    nprand.seed(seed)
+    bioprocess.clear_cached_variates()
+    simulation_results = bioprocess.Bioprocess(task_data, bio_params, hint=hint)
+
+    record = {"Task": key, "Name": bio_params_name, "Overrides": overrides, "Seed": seed}
+    record.update(summarize_results(simulation_results, workflows=True))
+
+    # Add instrumentation report of the task, if instrumented
+    if instrumentation.enabled:
+        record["Instrumentation"] = instrumentation.report()
+
+    return record
+
+
+# Function for reading the records of the completed tasks of a sweep (or of its failed tasks, whose records only
+# identify the task and its "Error", if "failed" is True)
+def read_sweep_results(sweep_name, directory=SWEEP_DIRECTORY, failed=False):
+    records = {}
+    journal_file = os.path.join(directory, f'{sweep_name}.jsonl')
+    if os.path.exists(journal_file):
+        with open(journal_file) as journal:
+            for line in journal:
+                # Ignore a partially written last line (if the sweep was interrupted while writing it)
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                # Later records of a task supersede earlier ones (failed tasks are retried when the sweep is resumed)
+                records[record["Task"]] = record
+
+    return [record for record in records.values() if ("Error" in record) == failed]
+
+
+# Function for running a sweep on a pool of worker processes. Records are yielded as soon as each task is
+# completed and appended to the sweep's journal, so an interrupted sweep resumes from the completed tasks. Tasks which
+# fail are journaled with their error instead of being yielded (and are retried when the sweep is resumed).
+# Tasks are instrumented with the given options, if any (see "instrumentation.enable"), and simulated with the given
+# Monte Carlo engine, planar mode and decision index file, if any (see "bioprocess.ENGINES", "bioprocess.PLANAR_MODE"
+# and "decisionindex.enable"). Unless "warm_start" is False, each task of a chain (see "build_chains") is submitted
+# once the previous task of the chain is finished, warm-started from its solution (unless it failed). Worker processes
+# are started with the given multiprocessing context, if any (e.g. spawned by long-lived processes, see "service.py")
+def run_sweep(sweep_name, bio_params_names, axes, seed=0, workers=None, directory=SWEEP_DIRECTORY,
+              database_file="database.db", instrument=None, engine=None, planar_mode=None, warm_start=True,
+              decision_index=None, mp_context=None):
+    os.makedirs(directory, exist_ok=True)
+
+    # Create snapshot of the database shared by all workers (a resumed sweep keeps using its original snapshot)
+    snapshot_file = os.path.join(directory, f'{sweep_name}.db')
+    if not os.path.exists(snapshot_file):
+        utils.snapshot_database(snapshot_file, database_file)
+
+    # Skip tasks completed before the sweep was interrupted (which still warm-start the next tasks of their chains)
+    completed_records = {record["Task"]: record for record in read_sweep_results(sweep_name, directory)}
+    tasks = build_tasks(bio_params_names, axes, seed)
+    chains = build_chains(tasks, None if warm_start else 1)
+
+    with open(os.path.join(directory, f'{sweep_name}.jsonl'), 'a') as journal, \
+         concurrent.futures.ProcessPoolExecutor(workers, mp_context, initializer=initialize_worker,
+                                                initargs=(snapshot_file, instrument, engine, planar_mode,
+                                                          decision_index)) as executor:
+        futures = {} # chain and position of the task of each future
+
+        # Auxiliary function for submitting the first task of a chain which is not completed, from the given position
+        # of the chain (warm-started from the record of the previous task, if any)
+        def submit(chain, position, previous_record=None):
+            while position < len(chain) and chain[position][0] in completed_records:
+                previous_record = completed_records[chain[position][0]]
+                position += 1
+            if position < len(chain):
+                task = chain[position]
+                futures[executor.submit(run_task, task, warm_start_hint(task, previous_record))] = (chain, position)
+
+        for chain in chains:
+            submit(chain, 0)
+        try:
+            while futures:
+                (done, _) = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    (chain, position) = futures.pop(future)
+                    task = chain[position]
+                    try:
+                        record = future.result()
+                    except concurrent.futures.BrokenExecutor:
+                        raise
+                    except Exception as error:
+                        record = {"Task": task[0], "Name": task[1], "Overrides": task[2], "Seed": task[3],
+                                  "Error": f'{type(error).__name__}: {error}'}
+
+                    journal.write(json.dumps(record) + '\n')
+                    journal.flush()
+                    submit(chain, position + 1, None if "Error" in record else record)
+                    if "Error" not in record:
+                        yield record
+        finally:
+            # Cancel pending tasks if the sweep is interrupted
+            for future in futures:
+                future.cancel()
+
+
+# Function for reading a sweep file (JSON object with the sweep's "name", the "bioprocess parameters" to sweep,
+# the "axes" as a list of [axis, values] pairs and, optionally, the "seed" and number of "workers")
+def read_sweep_file(file_name):
+    with open(file_name) as file:
+        sweep = json.load(file)
+
+    axes = {}
+    for (axis, values) in sweep["axes"]:
+        axes[axis if isinstance(axis, str) else tuple(axis)] = values
+
+    return sweep["name"], sweep["bioprocess parameters"], axes, sweep.get("seed", 0), sweep.get("workers")
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Run sweep described by the sweep file given as argument, optionally exporting the records of the tasks completed
+# by this run to a JSON Lines, CSV or Parquet file, e.g.: python3 sweep.py sweep.json results/sweep.csv
+if __name__ == "__main__":
+    (sweep_name, bio_params_names, axes, seed, workers) = read_sweep_file(sys.argv[1])
+    n_tasks = len(build_tasks(bio_params_names, axes, seed))
+
+    with export.RecordWriter(sys.argv[2]) if len(sys.argv) > 2 else contextlib.nullcontext() as writer:
+        for record in run_sweep(sweep_name, bio_params_names, axes, seed, workers):
+            print(f'[{record["Name"]}] {record["Overrides"]} -> {record["Overall Cost"]:,.2f} € '
+                  f'({record["Confidence Level"]:.1f}%)')
+            if writer is not None:
+                writer.write(record)
+
+    print(f'\nCompleted {len(read_sweep_results(sweep_name))} of {n_tasks} tasks of sweep "{sweep_name}"')
+    for record in read_sweep_results(sweep_name, failed=True):
+        print(f'    [{record["Name"]}] {record["Overrides"]} failed: {record["Error"]}')
@@ -0,0 +1,21 @@
+import os
+import sys
+import pytest
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+BEMSCA_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# BEMSCA's modules import each other by name, as when they are executed from the BEMSCA folder
+sys.path.insert(0, BEMSCA_DIRECTORY)
+
+
+# -----------------------------------------------------------------------------
+#    FIXTURES
+# -----------------------------------------------------------------------------
+# Run every test from the BEMSCA folder (the database and "results" subfolder are found relative to it)
+@pytest.fixture(autouse=True)
+def bemsca_directory(monkeypatch):
+    monkeypatch.chdir(BEMSCA_DIRECTORY)
@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import numpy.random as nprand
+import drawpools
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+TEST_POOL_SIZE = 1000 # variates of each pool segment
+TEST_PARAMETERS = (2.0, 0.5)
+
+
+# -----------------------------------------------------------------------------
+#    TESTS
+# -----------------------------------------------------------------------------
+# Streams must never wrap around (variates beyond the end of a segment are read from the next segments)
+def test_streams_do_not_reuse_variates(tmp_path):
+    nprand.seed(0)
+    stream = drawpools.DrawStream("normal", TEST_PARAMETERS, TEST_POOL_SIZE, directory=str(tmp_path))
+    variates = np.concatenate([stream.draw(700) for _ in range(5)])
+
+    assert len(variates) == 3500 and len(np.unique(variates)) == 3500
+    assert stream.segment >= 3
+
+
+# The least recently used pools must be deleted once the directory exceeds its maximum size
+def test_least_recently_used_pools_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(drawpools, "MAX_DRAW_POOL_BYTES", 3 * (8 * TEST_POOL_SIZE + 128))
+    pool_files = []
+    for mean in range(5):
+        drawpools.get_pool("normal", (mean, 1.0), TEST_POOL_SIZE, directory=str(tmp_path))
+        pool_files.append(os.path.join(str(tmp_path), drawpools.pool_file_name("normal", (mean, 1.0),
+                                                                               TEST_POOL_SIZE, 0)))
+        os.utime(pool_files[-1], (mean, mean))
+
+    assert [os.path.exists(pool_file) for pool_file in pool_files] == [False, False, True, True, True]
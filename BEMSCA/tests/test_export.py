@@ -0,0 +1,41 @@
+import csv
+import pytest
+import export
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+# Records of a simulation job followed by records of a sweep job, with more fields (see "batch.run_batch")
+TEST_RECORDS = [{"Name": "Default", "Overall Cost": 1000.5},
+                {"Name": "Default", "Overall Cost": 1200, "Task": [0, 1], "Seed": 3, "Overrides": [["A", 1]]}]
+
+
+# -----------------------------------------------------------------------------
+#    TESTS
+# -----------------------------------------------------------------------------
+# Fields of later records must not be dropped (the columns of the file are the union of the fields of all records)
+def test_csv_columns_are_union_of_fields(tmp_path):
+    file_name = str(tmp_path / "records.csv")
+    with export.RecordWriter(file_name) as writer:
+        for record in TEST_RECORDS:
+            writer.write(record)
+
+    with open(file_name, newline='') as file:
+        rows = list(csv.DictReader(file))
+    assert list(rows[0]) == ["Name", "Overall Cost", "Task", "Seed", "Overrides"]
+    assert rows[0]["Task"] == "" and rows[1]["Task"] == "[0, 1]" and rows[1]["Seed"] == "3"
+
+
+@pytest.mark.parametrize("batch_rows", [1, 1000])
+def test_parquet_columns_are_union_of_fields(tmp_path, monkeypatch, batch_rows):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(export, "PARQUET_BATCH_ROWS", batch_rows)
+    file_name = str(tmp_path / "records.parquet")
+    with export.RecordWriter(file_name) as writer:
+        for record in TEST_RECORDS:
+            writer.write(record)
+
+    rows = pyarrow_parquet.read_table(file_name).to_pylist()
+    assert list(rows[0]) == ["Name", "Overall Cost", "Task", "Seed", "Overrides"]
+    assert rows[0]["Task"] is None and rows[1]["Task"] == "[0, 1]" and rows[1]["Overall Cost"] == 1200
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+import replicates
+
+
+# -----------------------------------------------------------------------------
+#    TESTS
+# -----------------------------------------------------------------------------
+# Reflected variates must end up inside the bounds, however far outside them they were (variates inside the bounds
+# are kept)
+@pytest.mark.parametrize("bounds", [(0, 1), (0, None), (None, 1)])
+def test_reflected_variates_are_inside_bounds(bounds):
+    variates = np.array([-2.7, -0.3, 0.25, 0.5, 1.4, 3.6])
+    replicates.reflect(variates, bounds)
+
+    assert (bounds[0] is None or variates.min() >= bounds[0]) and (bounds[1] is None or variates.max() <= bounds[1])
+    assert variates[2] == 0.25 and variates[3] == 0.5
+    if bounds == (0, 1):
+        assert np.allclose(variates, [0.7, 0.3, 0.25, 0.5, 0.6, 0.4])
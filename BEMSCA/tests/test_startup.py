@@ -0,0 +1,16 @@
+import startup_benchmark
+
+
+# Importing main.py (as worker processes do) must not load any heavy module
+def test_import_main_loads_no_heavy_modules():
+    assert startup_benchmark.determine_imported_heavy_modules(["-c", "import main"], "") == []
+
+
+# A short interactive session must not load any heavy module
+def test_session_loads_no_heavy_modules():
+    assert startup_benchmark.determine_imported_heavy_modules() == []
+
+
+# Starting BEMSCA, typing "help" and quitting must take less than the startup budget
+def test_startup_time_within_budget():
+    assert startup_benchmark.measure_startup_time() <= startup_benchmark.STARTUP_BUDGET
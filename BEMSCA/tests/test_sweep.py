@@ -0,0 +1,88 @@
+import json
+import pytest
+import bioprocess
+import sweep
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+TEST_RUNS = 2000 # Monte Carlo simulation runs of the tasks (inherited by forked workers)
+TEST_AXES = {"Target Cell Number": [1.5e9, 2e9, 2.5e9], "Minimum Threshold": [0.8, "invalid"]}
+
+
+# -----------------------------------------------------------------------------
+#    FIXTURES
+# -----------------------------------------------------------------------------
+# Simulate tasks with few runs, returns the directory of the sweeps
+@pytest.fixture
+def sweep_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(bioprocess, "SIMULATION_RUNS", TEST_RUNS)
+    return str(tmp_path)
+
+
+# -----------------------------------------------------------------------------
+#    TESTS
+# -----------------------------------------------------------------------------
+# Every task must be journaled as soon as it is finished, and failed tasks must be journaled with their error (so the
+# other tasks of the sweep, including the next tasks of their chains, are still completed)
+def test_failed_tasks_are_journaled(sweep_directory, monkeypatch):
+    monkeypatch.setattr(sweep, "WARM_START_CHAINS", 1)
+    records = []
+    for record in sweep.run_sweep("Test", ["Default"], TEST_AXES, 0, 2, directory=sweep_directory, engine="common"):
+        # The records yielded so far (including the current one) are already in the journal
+        records.append(record)
+        with open(f'{sweep_directory}/Test.jsonl') as journal:
+            journaled_tasks = {json.loads(line)["Task"] for line in journal}
+        assert {record["Task"] for record in records} <= journaled_tasks
+
+    failed_records = sweep.read_sweep_results("Test", sweep_directory, failed=True)
+    assert len(records) == 3 and len(failed_records) == 3
+    assert all(record["Overrides"][1][1] == "invalid" and record["Error"] for record in failed_records)
+    assert ([record["Task"] for record in sweep.read_sweep_results("Test", sweep_directory)]
+            == [record["Task"] for record in records])
+
+
+# Resuming a sweep must only retry its failed tasks
+def test_resumed_sweep_retries_failed_tasks(sweep_directory):
+    list(sweep.run_sweep("Test", ["Default"], TEST_AXES, 0, 2, directory=sweep_directory, engine="common"))
+    resumed_records = list(sweep.run_sweep("Test", ["Default"], TEST_AXES, 0, 2, directory=sweep_directory,
+                                           engine="common"))
+
+    assert resumed_records == []
+    assert len(sweep.read_sweep_results("Test", sweep_directory)) == 3
+    assert len(sweep.read_sweep_results("Test", sweep_directory, failed=True)) == 3
+
+
+# Chains must only depend on the number of tasks (at most WARM_START_CHUNK tasks, and at least WARM_START_CHAINS
+# chains while they can be formed)
+@pytest.mark.parametrize("n_tasks, chain_length", [(6, 1), (64, 2), (1000, 8)])
+def test_chain_lengths(n_tasks, chain_length):
+    chains = sweep.build_chains(list(range(n_tasks)))
+    assert {len(chain) for chain in chains[:-1]} <= {chain_length}
+    assert sum(chains, []) == list(range(n_tasks))
+
+
+# Results of a task simulated with the cached engine must not depend on the tasks previously run by the worker
+def test_cached_task_does_not_depend_on_previous_tasks(sweep_directory, monkeypatch):
+    monkeypatch.setattr(bioprocess, "ENGINE", "cached")
+    monkeypatch.setattr(bioprocess, "cycle_fold_increases", {})
+    sweep.initialize_worker("database.db")
+    tasks = sweep.build_tasks(["Default"], {"Target Cell Number": [1.5e9, 2e9]})
+
+    record = sweep.run_task(tasks[1])
+    bioprocess.cycle_fold_increases.clear()
+    sweep.run_task(tasks[0])
+    assert sweep.run_task(tasks[1]) == record
+
+
+# Durations must not be truncated (e.g., with bioreactor culture times of a fraction of a day)
+def test_fractional_durations_are_kept(sweep_directory):
+    sweep.initialize_worker("database.db")
+    expansion_simulation = sweep.worker_data["Bioprocess Parameters"].at["Default", "Expansion Simulation"]
+    task = sweep.build_tasks(["Default"], {("Expansion Simulations", expansion_simulation,
+                                            "Bioreactor Culture Time"): [3.1]})[0]
+    record = sweep.run_task(task)
+
+    assert record["Bioreactor Duration"] % 1 != 0
+    assert record["Overall Duration"] == record["Planar Duration"] + record["Bioreactor Duration"]
@@ -0,0 +1,123 @@
+import multiprocessing
+import os
+import pytest
+import bioprocess
+import sweep
+import workqueue
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+TEST_RUNS = 2000 # Monte Carlo simulation runs of the tasks (inherited by forked workers)
+TEST_AXES = {"Target Cell Number": [1.5e9, 2e9, 2.5e9], "Minimum Threshold": [0.8, 0.9]}
+TEST_ENGINE = "common" # (same variates in every worker, so tasks are simulated alike whichever worker claims them)
+
+
+# -----------------------------------------------------------------------------
+#    FIXTURES
+# -----------------------------------------------------------------------------
+# Create a small queue (6 tasks) simulated with few runs and short polling intervals, returns the queue's file name
+@pytest.fixture
+def queue_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(bioprocess, "SIMULATION_RUNS", TEST_RUNS)
+    monkeypatch.setattr(workqueue, "POLL_INTERVAL", 0.2)
+    return workqueue.create_queue("Test", ["Default"], TEST_AXES, 0, str(tmp_path), engine=TEST_ENGINE)
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for reading the status, worker and attempts of every task of a queue (by key)
+def read_tasks(queue_file):
+    connection = workqueue.connect(queue_file)
+    tasks = {key: (status, worker, attempts)
+             for (key, status, worker, attempts) in connection.execute('SELECT Key, Status, Worker, Attempts '
+                                                                       'FROM Tasks')}
+    connection.close()
+    return tasks
+
+
+# Function for claiming a task of a queue with a short lease, and then hanging until the process is killed
+def claim_and_hang(queue_file, claimed):
+    connection = workqueue.connect(queue_file)
+    workqueue.claim_task(connection, "Killed Worker", lease_duration=1)
+    claimed.set()
+    multiprocessing.Event().wait()
+
+
+# -----------------------------------------------------------------------------
+#    TESTS
+# -----------------------------------------------------------------------------
+# Every task of a queue must be completed exactly once by a pool of local workers
+def test_local_workers_complete_every_task_once(queue_file):
+    completed_tasks = workqueue.run_local_workers(queue_file, 3)
+
+    tasks = read_tasks(queue_file)
+    assert len(tasks) == 6
+    assert len(completed_tasks) == 3 and sum(completed_tasks) == len(tasks)
+    assert all(status == workqueue.COMPLETED and attempts == 1 for (status, worker, attempts) in tasks.values())
+    assert len(workqueue.read_queue_results(queue_file)) == len(tasks)
+
+
+# The task of a killed worker must be claimed by another worker once its lease expires
+def test_expired_lease_is_reclaimed(queue_file):
+    context = multiprocessing.get_context("fork")
+    claimed = context.Event()
+    process = context.Process(target=claim_and_hang, args=(queue_file, claimed))
+    process.start()
+    assert claimed.wait(30)
+    process.kill()
+    process.join()
+
+    completed_tasks = workqueue.run_local_workers(queue_file, 2, wait=True)
+
+    tasks = read_tasks(queue_file)
+
+    assert sum(completed_tasks) == len(tasks)
+    assert all(status == workqueue.COMPLETED and worker != "Killed Worker" for (status, worker, _) in tasks.values())
+    assert sorted(attempts for (_, _, attempts) in tasks.values()) == [1] * (len(tasks) - 1) + [2]
+
+
+# The next task of a chain must only be claimed once the previous task is completed, warm-started from its solution
+# whichever worker claims it
+def test_chained_tasks_are_warm_started_from_previous_task(tmp_path, monkeypatch):
+    monkeypatch.setattr(sweep, "WARM_START_CHAINS", 1)
+    queue_file = workqueue.create_queue("Chained", ["Default"], TEST_AXES, 0, str(tmp_path), engine=TEST_ENGINE)
+
+    connection = workqueue.connect(queue_file)
+    (task, hint) = workqueue.claim_task(connection, "Worker 1")
+    assert hint is None
+    assert workqueue.claim_task(connection, "Worker 2") is None
+
+    record = {"Name": task[1], "Required Cycles": 4, "Optimal Fold Increase": 3.0}
+    workqueue.complete_task(connection, task[0], "Worker 1", record)
+    (next_task, hint) = workqueue.claim_task(connection, "Worker 2")
+    connection.close()
+    assert next_task[0] == sweep.build_tasks(["Default"], TEST_AXES)[1][0]
+    assert hint == (4, 3.0)
+
+
+# An existing queue must not be extended with other settings (so tasks of a queue are all simulated alike)
+def test_queue_settings_cannot_change(queue_file, tmp_path):
+    with pytest.raises(ValueError):
+        workqueue.create_queue("Test", ["Default"], TEST_AXES, 0, str(tmp_path), engine="legacy")
+
+    # Extending the queue with the same settings only adds the missing tasks
+    workqueue.create_queue("Test", ["Default"], {**TEST_AXES, "Target Cell Number": [1.5e9, 2e9, 2.5e9, 3e9]}, 0,
+                           str(tmp_path), engine=TEST_ENGINE)
+    assert len(read_tasks(queue_file)) == 8
+
+
+# The decision index of a queue must be copied next to it and referenced by its settings
+def test_queue_copies_decision_index(tmp_path):
+    index_file = tmp_path / "index.npz"
+    index_file.write_bytes(b"index")
+    queue_file = workqueue.create_queue("Indexed", ["Default"], TEST_AXES, 0, str(tmp_path / "queues"),
+                                        decision_index=str(index_file))
+
+    connection = workqueue.connect(queue_file)
+    settings = workqueue.read_settings(connection)
+    connection.close()
+    assert settings["Decision Index"] == "Indexed.decision_index.npz"
+    assert os.path.exists(os.path.join(os.path.dirname(queue_file), settings["Decision Index"]))
@@ -1,10 +1,39 @@
+import importlib.util
 import math
 import sqlite3
-import pandas as pd
+import sys
+from collections.abc import MutableMapping
+import instrumentation
 
 # -----------------------------------------------------------------------------
 #    FUNCTIONS
 # -----------------------------------------------------------------------------
+# Function for importing a module only when one of its attributes is first used, which keeps BEMSCA's startup fast
+# (heavy modules, such as pandas or matplotlib, are only loaded by the commands that need them)
+def lazy_import(module_name):
+    # Return module if it was already imported
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+
+    # Create module whose execution is deferred until the first access to one of its attributes
+    spec = importlib.util.find_spec(module_name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+# Heavy modules used by this file
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+# Tables of the cumulative distribution functions of beta distributions, by (alpha, beta) (see "beta_quantiles")
+BETA_QUANTILE_POINTS = 2**16
+beta_cdf_tables = {}
+
+
 # Function for calculating std from sem
 def sem_to_std(sem, sample_size):
     std = sem * math.sqrt(sample_size)
@@ -19,10 +48,33 @@ def alpha_beta(avg, std):
     return (alpha, beta)
 
 
+# Function for calculating quantiles of a beta probability distribution (inverse of its cumulative distribution
+# function) at the given probabilities, e.g. to transform uniform variates into beta variates. Numpy has no beta
+# quantile function, so the cumulative distribution function is integrated numerically once for each alpha and
+# beta (on points clustered at both ends of [0, 1]) and inverted by linear interpolation
+def beta_quantiles(probabilities, alpha, beta):
+    if (alpha, beta) not in beta_cdf_tables:
+        t = np.linspace(0, 1, BETA_QUANTILE_POINTS)
+        x = (1 - np.cos(np.pi * t)) / 2
+
+        # Density with respect to t (computed in log space, densities at both ends are taken as 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            log_density = ((alpha - 1) * np.log(x) + (beta - 1) * np.log1p(-x)
+                           + np.log(np.pi / 2 * np.sin(np.pi * t)))
+        log_density[[0, -1]] = -np.inf
+        density = np.exp(log_density - log_density[1:-1].max())
+
+        cdf = np.concatenate([[0], np.cumsum((density[1:] + density[:-1]) / 2)])
+        beta_cdf_tables[(alpha, beta)] = (cdf / cdf[-1], x)
+
+    (cdf, x) = beta_cdf_tables[(alpha, beta)]
+    return np.interp(probabilities, cdf, x)
+
+
 # Function for accessing database data when BEMSCA starts up
-def get_database_data():
+def get_database_data(database_file="database.db"):
     # Connect to database
-    connection = sqlite3.connect("database.db")
+    connection = sqlite3.connect(database_file)
 
     # Create cursor
     cursor = connection.cursor()
@@ -34,27 +86,121 @@ def get_database_data():
     # Extract data for all tables
     table_dict = {}
     for table in tables:
-        # Get column names from table
-        cursor.execute(f'PRAGMA table_info("{table}")')
-        column_names = [info[1] for info in cursor.fetchall()]
-
-        # Get entries from table
-        cursor.execute(f'SELECT * FROM "{table}"')
-        entries = cursor.fetchall()
-
-        # Insert entries into a pandas data frame to keep data organized
-        index = []
-        entry_dict = {}
-        for i, column_name in enumerate(column_names):
-            # Use 'Name' column as index of pandas dataframes
-            if column_name == 'Name':
-                index = [entry[i] for entry in entries]
-
-            # Use all other columns as contents of pandas dataframes
-            else:
-                entry_dict[column_name] = [entry[i] for entry in entries]
-
-        # Save data as pandas dataframe to dictionary with all dataframes
-        table_dict[table] = pd.DataFrame(entry_dict, index=index)
-
-    return table_dict
\ No newline at end of file
+        table_dict[table] = get_table_data(cursor, table)
+
+    # Close database
+    connection.close()
+
+    return table_dict
+
+
+# Function for extracting the data of a database table (stored in a pandas dataframe)
+def get_table_data(cursor, table):
+    # Get column names from table
+    cursor.execute(f'PRAGMA table_info("{table}")')
+    column_names = [info[1] for info in cursor.fetchall()]
+
+    # Get entries from table
+    cursor.execute(f'SELECT * FROM "{table}"')
+    entries = cursor.fetchall()
+
+    instrumentation.count("Database Table Loads")
+
+    # Insert entries into a pandas data frame to keep data organized
+    index = []
+    entry_dict = {}
+    for i, column_name in enumerate(column_names):
+        # Use 'Name' column as index of pandas dataframes
+        if column_name == 'Name':
+            index = [entry[i] for entry in entries]
+
+        # Use all other columns as contents of pandas dataframes
+        else:
+            entry_dict[column_name] = [entry[i] for entry in entries]
+
+    return pd.DataFrame(entry_dict, index=index)
+
+
+# Function for updating a single value of the database (identified by table, entry name and column)
+def update_database_value(table, name, column, value, database_file="database.db"):
+    # Connect to database
+    connection = sqlite3.connect(database_file)
+
+    # Update value and commit database changes
+    connection.execute(f'UPDATE "{table}" SET "{column}" = ? WHERE Name = ?', (value, name))
+    connection.commit()
+
+    # Close database
+    connection.close()
+
+
+# Function for creating a consistent snapshot (copy) of the database, e.g. to be read by other processes
+def snapshot_database(snapshot_file, database_file="database.db"):
+    # Connect to database and snapshot
+    connection = sqlite3.connect(database_file)
+    snapshot_connection = sqlite3.connect(snapshot_file)
+
+    # Copy database to snapshot
+    connection.backup(snapshot_connection)
+
+    # Close database and snapshot
+    snapshot_connection.close()
+    connection.close()
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for accessing database data which only loads each table when it is first used (behaves like the
+# dictionary of pandas dataframes returned by "get_database_data")
+class DatabaseData(MutableMapping):
+    # Initializer of class object
+    def __init__(self, database_file="database.db"):
+        # <>---------- Important Object Attributes ----------<>
+        self.database_file = database_file
+
+        # Get table names from database (tables themselves are only loaded when first used)
+        connection = sqlite3.connect(self.database_file)
+        self.table_names = [name[0] for name in
+                            connection.execute('SELECT Name FROM sqlite_master WHERE TYPE = "table"').fetchall()]
+        connection.close()
+
+        self.tables = {}
+
+
+    # Function for accessing a table (loaded from database if it was not used before)
+    def __getitem__(self, table):
+        if table not in self.tables:
+            if table not in self.table_names:
+                raise KeyError(table)
+            with instrumentation.span("Database Table Load"):
+                connection = sqlite3.connect(self.database_file)
+                self.tables[table] = get_table_data(connection.cursor(), table)
+                connection.close()
+        else:
+            instrumentation.count("Database Table Cache Hits")
+
+        return self.tables[table]
+
+
+    # Function for replacing (or adding) a table
+    def __setitem__(self, table, table_data):
+        if table not in self.table_names:
+            self.table_names.append(table)
+        self.tables[table] = table_data
+
+
+    # Function for removing a table
+    def __delitem__(self, table):
+        self.table_names.remove(table)
+        self.tables.pop(table, None)
+
+
+    # Function for iterating over table names
+    def __iter__(self):
+        return iter(list(self.table_names))
+
+
+    # Function for obtaining the number of tables
+    def __len__(self):
+        return len(self.table_names)
\ No newline at end of file
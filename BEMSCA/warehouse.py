@@ -0,0 +1,218 @@
+import datetime
+import os
+import sqlite3
+import utils
+
+# Heavy modules only loaded when results are first stored or read (see "utils.lazy_import")
+np = utils.lazy_import("numpy")
+pd = utils.lazy_import("pandas")
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+CHUNK_ROWS = 256 # largest number of distributions stored in each chunk file (chunk files grow as rows are written)
+DISTRIBUTION_DTYPE = "float32" # (halves storage while keeping ~7 significant digits)
+WAREHOUSE_DIRECTORY = "results/warehouse"
+BUSY_TIMEOUT = 60 # time (s) a connection waits for other processes storing runs to release the warehouse's lock
+
+
+# -----------------------------------------------------------------------------
+#    CLASSES
+# -----------------------------------------------------------------------------
+# Define class for persisting simulation results (metadata, workflows and costs are stored in a SQLite database,
+# while fold increase distributions are stored in chunked .npy files that are read through memory mapping)
+class ResultsWarehouse():
+    # Initializer of class object
+    def __init__(self, directory=WAREHOUSE_DIRECTORY):
+        # <>---------- Important Object Attributes ----------<>
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+
+        # Connect to warehouse database (creates database if it does not exist)
+        self.connection = sqlite3.connect(os.path.join(self.directory, "warehouse.db"), timeout=BUSY_TIMEOUT)
+
+        # <>------------------- Main Body -------------------<>
+        # Create warehouse tables and indexes (if they do not already exist)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS "Runs" (
+                "ID" integer PRIMARY KEY,
+                "Name" text,
+                "Timestamp" text,
+                "Bioprocess Parameters" text,
+                "Required Cycles" integer,
+                "Optimal Fold Increase" real,
+                "Planar Duration" integer,
+                "Bioreactor Duration" real,
+                "Overall Duration" real,
+                "Consumables Cost" real,
+                "Reagents Cost" real,
+                "Facility Cost" real,
+                "Labor Cost" real,
+                "Medium Cost" real,
+                "Overall Cost" real,
+                "Average Final Cell Number" real,
+                "Confidence Level" real,
+                "Chunk" integer,
+                "Row" integer,
+                "Distributions" integer
+            );
+            CREATE TABLE IF NOT EXISTS "Planar Workflows" (
+                "Run" integer,
+                "Passage" integer,
+                "Surfaces" integer,
+                "Volume" real
+            );
+            CREATE TABLE IF NOT EXISTS "Bioreactor Workflows" (
+                "Run" integer,
+                "Cycle" integer,
+                "Volume" real,
+                "Bioreactor" text,
+                "Number" integer
+            );
+            CREATE TABLE IF NOT EXISTS "Chunks" (
+                "ID" integer PRIMARY KEY,
+                "File" text,
+                "Length" integer,
+                "Rows" integer
+            );
+            CREATE INDEX IF NOT EXISTS "Runs Name" ON "Runs" ("Name", "Timestamp");
+            CREATE INDEX IF NOT EXISTS "Planar Workflows Run" ON "Planar Workflows" ("Run");
+            CREATE INDEX IF NOT EXISTS "Bioreactor Workflows Run" ON "Bioreactor Workflows" ("Run");
+        ''')
+
+
+    # Function for storing the results of a simulated bioprocess, returns the ID of the stored run (only the final
+    # fold increase distribution is stored unless all distributions of the optimization are requested)
+    def store(self, db_data, bio_params_name, simulation_results, all_distributions=False):
+        planar_expansion = simulation_results.planar_expansion
+        bioreactor_expansion = simulation_results.bioreactor_expansion
+
+        # Write fold increase distributions to chunk file (infeasible bioprocesses have none, see "bioprocess.
+        # Bioprocess")
+        fold_increase_pds = bioreactor_expansion.fold_increase_pds
+        if not all_distributions:
+            fold_increase_pds = fold_increase_pds[-1:]
+        # The warehouse is locked from the allocation of the rows of the distributions until the run is stored, so
+        # processes sharing the warehouse (e.g., BEMSCA, batch jobs and the service) never write to the same rows, and
+        # the rows of a run which could not be stored are not allocated
+        with self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            (chunk, row) = (None, None)
+            if len(fold_increase_pds):
+                (chunk, row) = self.write_distributions(np.array(fold_increase_pds, dtype=DISTRIBUTION_DTYPE))
+
+            # Store run metadata, durations and costs
+            cursor = self.connection.execute(
+                'INSERT INTO "Runs" VALUES (NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (bio_params_name, datetime.datetime.now().isoformat(),
+                 db_data["Bioprocess Parameters"].loc[[bio_params_name]].to_json(orient="records"),
+                 bioreactor_expansion.monte_carlo[0], bioreactor_expansion.monte_carlo[1],
+                 planar_expansion.duration, float(bioreactor_expansion.duration),
+                 float(simulation_results.bioprocess_duration),
+                 simulation_results.bioprocess_consumables_cost, simulation_results.bioprocess_reagents_cost,
+                 simulation_results.bioprocess_facility_cost, simulation_results.bioprocess_labor_cost,
+                 simulation_results.bioprocess_medium_cost, simulation_results.bioprocess_overall_cost,
+                 simulation_results.avg_fin_cell_number, simulation_results.confidence_level,
+                 chunk, row, len(fold_increase_pds)))
+            run = cursor.lastrowid
+
+            # Store planar expansion workflow
+            culture_volume = planar_expansion.planar_platform_data["Culture Volume"].item()
+            self.connection.executemany('INSERT INTO "Planar Workflows" VALUES (?, ?, ?, ?)',
+                                        [(run, passage, surfaces, surfaces * culture_volume)
+                                         for passage, surfaces in enumerate(planar_expansion.planar_workflow)])
+
+            # Store bioreactor expansion workflow (one entry per bioreactor type used in each cycle)
+            (cycle_medium_volumes, required_bioreactors) = bioreactor_expansion.bioreactor_workflow
+            self.connection.executemany('INSERT INTO "Bioreactor Workflows" VALUES (?, ?, ?, ?, ?)',
+                                        [(run, cycle, float(volume), bioreactor,
+                                          int(required_bioreactors.loc[cycle, bioreactor]))
+                                         for cycle, volume in zip(required_bioreactors.index, cycle_medium_volumes)
+                                         for bioreactor in required_bioreactors.columns
+                                         if required_bioreactors.loc[cycle, bioreactor] > 0])
+
+        return run
+
+
+    # Function for writing distributions (one per row) to the current chunk file, returns the chunk and first row.
+    # Must be called within a transaction holding the warehouse's lock (see "store"), which covers the allocation of
+    # the rows and the growth of the chunk file
+    def write_distributions(self, distributions):
+        (rows, length) = distributions.shape
+
+        # Use the last chunk if it has distributions of the same length and enough free rows (growing its file if
+        # needed), else create a new one sized for the written rows only
+        last_chunk = self.connection.execute('SELECT * FROM "Chunks" ORDER BY "ID" DESC LIMIT 1').fetchone()
+        if last_chunk is not None and last_chunk[2] == length and last_chunk[3] + rows <= CHUNK_ROWS:
+            (chunk, file_name, length, row) = last_chunk
+            chunk_data = self.grow_chunk(file_name, row + rows)
+        else:
+            chunk = 1 if last_chunk is None else last_chunk[0] + 1
+            file_name = f'chunk_{chunk:06d}.npy'
+            row = 0
+            chunk_data = np.lib.format.open_memmap(os.path.join(self.directory, file_name), mode="w+",
+                                                   dtype=DISTRIBUTION_DTYPE, shape=(rows, length))
+            self.connection.execute('INSERT INTO "Chunks" VALUES (?, ?, ?, 0)', (chunk, file_name, length))
+
+        # Allocate rows and write distributions
+        self.connection.execute('UPDATE "Chunks" SET "Rows" = ? WHERE "ID" = ?', (row + rows, chunk))
+        chunk_data[row:row+rows] = distributions
+        chunk_data.flush()
+        del chunk_data
+
+        return chunk, row
+
+
+    # Function for opening a chunk file for writing, with room for at least the given number of rows (the file is
+    # replaced by a copy with twice as many rows, up to CHUNK_ROWS, whenever it is full, so rows are copied a few
+    # times at most while chunk files only take the space of their rows)
+    def grow_chunk(self, file_name, rows):
+        path = os.path.join(self.directory, file_name)
+        chunk_data = np.load(path, mmap_mode="r+")
+        (capacity, length) = chunk_data.shape
+        if rows <= capacity:
+            return chunk_data
+
+        # Copy rows to a larger file, which replaces the chunk file (memory maps of readers remain valid)
+        grown_path = path + ".grow"
+        grown_data = np.lib.format.open_memmap(grown_path, mode="w+", dtype=DISTRIBUTION_DTYPE,
+                                               shape=(min(CHUNK_ROWS, max(2 * capacity, rows)), length))
+        grown_data[:capacity] = chunk_data
+        grown_data.flush()
+        del chunk_data, grown_data
+        os.replace(grown_path, path)
+        return np.load(path, mmap_mode="r+")
+
+
+    # Function for querying stored runs (optionally filtered by an SQL condition), returns a pandas dataframe
+    def runs(self, condition="1", parameters=()):
+        return pd.read_sql_query(f'SELECT * FROM "Runs" WHERE {condition}', self.connection, params=parameters,
+                                 index_col="ID")
+
+
+    # Function for obtaining the workflows of a stored run ([0] -> planar workflow, [1] -> bioreactor workflow)
+    def workflows(self, run):
+        planar_workflow = pd.read_sql_query('SELECT "Passage", "Surfaces", "Volume" FROM "Planar Workflows" '
+                                            'WHERE "Run" = ?', self.connection, params=(run,), index_col="Passage")
+        bioreactor_workflow = pd.read_sql_query('SELECT "Cycle", "Volume", "Bioreactor", "Number" '
+                                                'FROM "Bioreactor Workflows" WHERE "Run" = ?', self.connection,
+                                                params=(run,))
+        return planar_workflow, bioreactor_workflow
+
+
+    # Function for obtaining the fold increase distributions of a stored run as a read-only memory mapped array
+    # (one distribution per row, the last row being the final distribution), nothing is loaded into memory until used
+    def distributions(self, run):
+        (file_name, row, rows) = self.connection.execute(
+            'SELECT "Chunks"."File", "Runs"."Row", "Runs"."Distributions" FROM "Runs" '
+            'LEFT JOIN "Chunks" ON "Runs"."Chunk" = "Chunks"."ID" WHERE "Runs"."ID" = ?', (run,)).fetchone()
+        if file_name is None:
+            return np.empty((0, 0), dtype=DISTRIBUTION_DTYPE)
+
+        return np.load(os.path.join(self.directory, file_name), mmap_mode="r")[row:row+rows]
+
+
+    # Function for closing the warehouse database
+    def close(self):
+        self.connection.close()
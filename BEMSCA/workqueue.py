@@ -0,0 +1,319 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import bioprocess
+import export
+import sweep
+import utils
+
+
+# -----------------------------------------------------------------------------
+#    GLOBAL CONSTANTS
+# -----------------------------------------------------------------------------
+QUEUE_DIRECTORY = "results/queues"
+LEASE_DURATION = 300 # time (s) a worker holds a task without a heartbeat before the task is leased to another worker
+HEARTBEAT_INTERVAL = 30 # time (s) between heartbeats of a worker renewing the lease of its task
+POLL_INTERVAL = 5 # time (s) between attempts of waiting workers to claim a task (while other workers hold leases)
+MAX_ATTEMPTS = 3 # leases of a task (expired or failed) before it is marked as failed
+BUSY_TIMEOUT = 60 # time (s) a connection waits for other workers to release the queue's lock
+
+# Statuses of tasks
+PENDING = "pending"
+LEASED = "leased"
+COMPLETED = "completed"
+FAILED = "failed"
+
+
+# -----------------------------------------------------------------------------
+#    FUNCTIONS
+# -----------------------------------------------------------------------------
+# Function for connecting to a queue (in autocommit mode, so transactions are explicitly started and committed).
+# The queue uses SQLite's default rollback journal rather than WAL, which requires shared memory and does not
+# work for hosts sharing the queue over a network filesystem
+def connect(queue_file):
+    return sqlite3.connect(queue_file, timeout=BUSY_TIMEOUT, isolation_level=None)
+
+
+# Function for determining the file names of the queue of a sweep and of its database snapshot
+def queue_files(sweep_name, directory=QUEUE_DIRECTORY):
+    return os.path.join(directory, f'{sweep_name}.queue.db'), os.path.join(directory, f'{sweep_name}.db')
+
+
+# Function for creating the queue of a sweep (see "sweep.build_tasks"), along with the database snapshot read by
+# its workers, returns the queue's file name. Creating the queue of an existing sweep only adds its missing tasks,
+# so completed tasks are never repeated (its settings cannot be changed, so all tasks are simulated alike). Each task
+# references the previous task of its chain (see "sweep.build_chains"), whose solution warm-starts it. Tasks are
+# simulated with the given Monte Carlo engine, planar mode and decision index file, if any (see "bioprocess.
+# ENGINES", "bioprocess.PLANAR_MODE" and "decisionindex.enable"), which is copied next to the queue
+def create_queue(sweep_name, bio_params_names, axes, seed=0, directory=QUEUE_DIRECTORY, database_file="database.db",
+                 engine=None, planar_mode=None, decision_index=None):
+    os.makedirs(directory, exist_ok=True)
+    (queue_file, snapshot_file) = queue_files(sweep_name, directory)
+
+    # Files are referenced relative to the queue, so hosts may mount the shared filesystem at different paths
+    index_file = None
+    if decision_index is not None:
+        index_file = f'{sweep_name}.decision_index.npz'
+    settings = {"Snapshot": os.path.basename(snapshot_file), "Engine": engine, "Planar Mode": planar_mode,
+                "Decision Index": index_file}
+
+    connection = connect(queue_file)
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.execute('CREATE TABLE IF NOT EXISTS Settings (Name TEXT PRIMARY KEY, Value TEXT)')
+        connection.execute('CREATE TABLE IF NOT EXISTS Tasks (Key TEXT PRIMARY KEY, Position INTEGER, Task TEXT, '
+                           f"Previous TEXT, Status TEXT DEFAULT '{PENDING}', Worker TEXT, Lease REAL, "
+                           'Attempts INTEGER DEFAULT 0, Record TEXT, Error TEXT)')
+        connection.execute('CREATE INDEX IF NOT EXISTS Claims ON Tasks (Status, Position)')
+
+        # Check the settings of an existing queue (tasks completed with other settings would be mixed with new ones)
+        existing_settings = read_settings(connection)
+        if existing_settings:
+            changed = [name for name, value in settings.items() if existing_settings.get(name) != value]
+            if changed:
+                raise ValueError(f'Queue "{queue_file}" already exists with other settings '
+                                 f'({", ".join(f"{name}: {existing_settings.get(name)}" for name in changed)})')
+        else:
+            connection.executemany('INSERT INTO Settings VALUES (?, ?)',
+                                   [(name, json.dumps(value)) for name, value in settings.items()])
+            utils.snapshot_database(snapshot_file, database_file)
+            if decision_index is not None:
+                shutil.copyfile(decision_index, os.path.join(directory, index_file))
+
+        tasks = sweep.build_tasks(bio_params_names, axes, seed)
+        previous_tasks = [chain[j-1][0] if j > 0 else None for chain in sweep.build_chains(tasks)
+                          for j in range(len(chain))]
+        connection.executemany('INSERT OR IGNORE INTO Tasks (Key, Position, Task, Previous) VALUES (?, ?, ?, ?)',
+                               [(task[0], i, json.dumps(task), previous_task)
+                                for i, (task, previous_task) in enumerate(zip(tasks, previous_tasks))])
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    finally:
+        connection.close()
+
+    return queue_file
+
+
+# Function for reading the settings of a queue
+def read_settings(connection):
+    return {name: json.loads(value) for name, value in connection.execute('SELECT Name, Value FROM Settings')}
+
+
+# Function for claiming the next task of a queue, i.e. the first pending task or task whose lease has expired (once
+# the previous task of its chain is finished), returns the task (see "sweep.build_tasks") and its warm-start hint
+# (see "sweep.warm_start_hint"), or None if no task can be claimed. Expired tasks which have already been leased
+# MAX_ATTEMPTS times are marked as failed instead of being claimed again
+def claim_task(connection, worker_id, lease_duration=LEASE_DURATION, max_attempts=MAX_ATTEMPTS):
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        connection.execute('UPDATE Tasks SET Status = ?, Error = ? WHERE Status = ? AND Lease < ? AND Attempts >= ?',
+                           (FAILED, "Lease expired", LEASED, now, max_attempts))
+        # Tasks are only claimed once the previous task of their chain is completed (or failed), so every task is
+        # warm-started from the same solution whichever worker claims it
+        row = connection.execute('SELECT Tasks.Key, Tasks.Task, Previous.Record FROM Tasks '
+                                 'LEFT JOIN Tasks AS Previous ON Previous.Key = Tasks.Previous '
+                                 'WHERE (Tasks.Status = ? OR (Tasks.Status = ? AND Tasks.Lease < ?)) '
+                                 'AND (Previous.Key IS NULL OR Previous.Status IN (?, ?)) '
+                                 'ORDER BY Tasks.Position LIMIT 1',
+                                 (PENDING, LEASED, now, COMPLETED, FAILED)).fetchone()
+        if row is not None:
+            connection.execute('UPDATE Tasks SET Status = ?, Worker = ?, Lease = ?, Attempts = Attempts + 1 '
+                               'WHERE Key = ?', (LEASED, worker_id, now + lease_duration, row[0]))
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+
+    if row is None:
+        return None
+    (key, bio_params_name, overrides, seed) = json.loads(row[1])
+    # Axes of referenced tables are decoded from JSON as lists, but are (table, entry, column) tuples
+    overrides = [(axis if isinstance(axis, str) else tuple(axis), value) for axis, value in overrides]
+    task = (key, bio_params_name, overrides, seed)
+    return task, sweep.warm_start_hint(task, None if row[2] is None else json.loads(row[2]))
+
+
+# Function for renewing the lease of a worker's task, returns False if the worker no longer holds the lease (its task
+# expired and was claimed by another worker)
+def renew_lease(connection, key, worker_id, lease_duration=LEASE_DURATION):
+    cursor = connection.execute('UPDATE Tasks SET Lease = ? WHERE Key = ? AND Worker = ? AND Status = ?',
+                                (time.time() + lease_duration, key, worker_id, LEASED))
+    return cursor.rowcount == 1
+
+
+# Function for completing a worker's task with the record of its results, returns False if the worker no longer
+# holds the lease (in which case the record is discarded, as the task is being simulated by another worker)
+def complete_task(connection, key, worker_id, record):
+    cursor = connection.execute('UPDATE Tasks SET Status = ?, Record = ?, Error = NULL '
+                                'WHERE Key = ? AND Worker = ? AND Status = ?',
+                                (COMPLETED, json.dumps(record), key, worker_id, LEASED))
+    return cursor.rowcount == 1
+
+
+# Function for releasing a worker's task after an error, so it is retried by any worker (or marked as failed if it
+# has already been leased MAX_ATTEMPTS times)
+def fail_task(connection, key, worker_id, error, max_attempts=MAX_ATTEMPTS):
+    connection.execute('UPDATE Tasks SET Status = CASE WHEN Attempts >= ? THEN ? ELSE ? END, '
+                       'Error = ? WHERE Key = ? AND Worker = ? AND Status = ?',
+                       (max_attempts, FAILED, PENDING, error, key, worker_id, LEASED))
+
+
+# Function for sending heartbeats renewing the lease of a worker's task until the task is finished (runs in its own
+# thread and connection, as SQLite connections cannot be shared between threads)
+def send_heartbeats(queue_file, key, worker_id, finished, lease_duration=LEASE_DURATION,
+                    heartbeat_interval=HEARTBEAT_INTERVAL):
+    connection = connect(queue_file)
+    try:
+        while not finished.wait(heartbeat_interval):
+            if not renew_lease(connection, key, worker_id, lease_duration):
+                break
+    finally:
+        connection.close()
+
+
+# Function for running a worker, which claims and simulates tasks of a queue until no task can be claimed, returns
+# the number of tasks completed by the worker. If "wait" is True, the worker keeps polling the queue while other
+# workers hold leases (so tasks of workers which stopped sending heartbeats are retried once their leases expire).
+# Workers also keep polling while pending tasks wait for the previous tasks of their chains, from whose solutions
+# they are warm-started (see "claim_task"). Tasks are instrumented with the given options, if any (see
+# "instrumentation.enable")
+def run_worker(queue_file, worker_id=None, instrument=None, wait=False, lease_duration=LEASE_DURATION,
+               heartbeat_interval=HEARTBEAT_INTERVAL, max_attempts=MAX_ATTEMPTS):
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+    connection = connect(queue_file)
+    settings = read_settings(connection)
+    decision_index = settings.get("Decision Index")
+    if decision_index is not None:
+        decision_index = os.path.join(os.path.dirname(queue_file), decision_index)
+    sweep.initialize_worker(os.path.join(os.path.dirname(queue_file), settings["Snapshot"]), instrument,
+                            settings["Engine"], settings["Planar Mode"], decision_index)
+
+    completed_tasks = 0
+    try:
+        while True:
+            claim = claim_task(connection, worker_id, lease_duration, max_attempts)
+            if claim is None:
+                counts = count_tasks(connection)
+                if counts[PENDING] > 0 or (wait and counts[LEASED] > 0):
+                    time.sleep(POLL_INTERVAL)
+                    continue
+                break
+            (task, hint) = claim
+
+            finished = threading.Event()
+            heartbeats = threading.Thread(target=send_heartbeats, daemon=True,
+                                          args=(queue_file, task[0], worker_id, finished, lease_duration,
+                                                heartbeat_interval))
+            heartbeats.start()
+            try:
+                record = sweep.run_task(task, hint)
+            except Exception as error:
+                fail_task(connection, task[0], worker_id, f'{type(error).__name__}: {error}', max_attempts)
+                continue
+            finally:
+                finished.set()
+                heartbeats.join()
+
+            record["Worker"] = worker_id
+            completed_tasks += complete_task(connection, task[0], worker_id, record)
+    finally:
+        connection.close()
+
+    return completed_tasks
+
+
+# Function for running a number of local worker processes on a queue, returns the number of tasks completed by each
+# worker (more workers may run on other hosts sharing the queue's filesystem, see "run_worker")
+def run_local_workers(queue_file, workers=None, instrument=None, wait=False):
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(run_worker, queue_file, None, instrument, wait) for _ in range(workers)]
+        return [future.result() for future in futures]
+
+
+# Function for counting the tasks of a queue by status
+def count_tasks(connection):
+    counts = dict.fromkeys([PENDING, LEASED, COMPLETED, FAILED], 0)
+    counts.update(connection.execute('SELECT Status, COUNT(*) FROM Tasks GROUP BY Status').fetchall())
+    return counts
+
+
+# Function for reading the records of the completed tasks of a queue (in the order of the sweep's tasks)
+def read_queue_results(queue_file):
+    connection = connect(queue_file)
+    records = [json.loads(record) for (record,) in
+               connection.execute('SELECT Record FROM Tasks WHERE Status = ? ORDER BY Position', (COMPLETED,))]
+    connection.close()
+
+    return records
+
+
+# -----------------------------------------------------------------------------
+#    COMMAND LINE
+# -----------------------------------------------------------------------------
+# Create the queue of a sweep file, e.g.: python3 workqueue.py create sweep.json
+# run workers on each host sharing the queue, e.g.: python3 workqueue.py work results/queues/sweep.queue.db --workers 8
+# and check its status or export its results, e.g.: python3 workqueue.py status results/queues/sweep.queue.db results.csv
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="workqueue.py", description="Distribute the tasks of a sweep to workers "
+                                                                      "on one or more hosts.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    create_parser = subparsers.add_parser("create", help="create (or extend) the queue of a sweep file")
+    create_parser.add_argument("sweep_file")
+    create_parser.add_argument("--directory", default=QUEUE_DIRECTORY, help="directory shared by all hosts")
+    create_parser.add_argument("--engine", choices=list(bioprocess.ENGINES), help="Monte Carlo engine of tasks")
+    create_parser.add_argument("--stochastic-planar", action="store_true", help="simulate planar expansions")
+    create_parser.add_argument("--decision-index", help="decision index file of tasks (see decisionindex.py)")
+
+    work_parser = subparsers.add_parser("work", help="run workers on this host until the queue is finished")
+    work_parser.add_argument("queue_file")
+    work_parser.add_argument("--workers", type=int, help="number of worker processes (default: number of CPUs)")
+    work_parser.add_argument("--wait", action="store_true", help="wait for tasks leased by other workers, retrying "
+                                                                 "them if their leases expire")
+
+    status_parser = subparsers.add_parser("status", help="count tasks by status, optionally exporting results")
+    status_parser.add_argument("queue_file")
+    status_parser.add_argument("export_file", nargs="?", help="JSON Lines, CSV or Parquet file")
+    options = parser.parse_args()
+
+    if options.command == "create":
+        (sweep_name, bio_params_names, axes, seed, workers) = sweep.read_sweep_file(options.sweep_file)
+        try:
+            queue_file = create_queue(sweep_name, bio_params_names, axes, seed, options.directory,
+                                      engine=options.engine,
+                                      planar_mode="stochastic" if options.stochastic_planar else None,
+                                      decision_index=options.decision_index)
+        except ValueError as error:
+            print(error)
+            sys.exit(1)
+        print(f'Created queue "{queue_file}"')
+
+    elif options.command == "work":
+        completed_tasks = run_local_workers(options.queue_file, options.workers, wait=options.wait)
+        print(f'Completed {sum(completed_tasks)} tasks on {len(completed_tasks)} workers')
+
+    if options.command in ["create", "status"]:
+        queue_file = queue_file if options.command == "create" else options.queue_file
+        connection = connect(queue_file)
+        print(', '.join(f'{number} {status}' for status, number in count_tasks(connection).items()))
+        for (key, error) in connection.execute('SELECT Key, Error FROM Tasks WHERE Status = ?', (FAILED,)):
+            print(f'    {key}: {error}')
+        connection.close()
+
+        if options.command == "status" and options.export_file:
+            with export.RecordWriter(options.export_file) as writer:
+                for record in read_queue_results(queue_file):
+                    writer.write(record)
+
+    sys.exit(0)